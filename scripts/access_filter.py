@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Filters of the accesses for race_check_helper.py (--function, --func-ids,
+# --inst-ids, --space, --addrs) and NVbit tool race_check_trace
+# (FILTER_FUNCTIONS, FILTER_FUNC_IDS, INSTR_BEGIN/INSTR_END, FILTER_SPACE,
+# FILTER_ADDRS).
+#
+# The filters are pushed down to the parser: trace_parser checks the header
+# of an access line once when it caches it, so the lanes of a filtered warp
+# instruction are dropped before their addresses are converted. The address
+# ranges are checked on the converted addresses.
+# Functions are selected by name as their "#func_begin#" lines are read.
+#
+# Races involving a filtered access are not found, the filters narrow the
+# check to the code and the data of interest.
+
+import bisect
+import fnmatch
+
+SPACES = {"shared": True, "global": False}
+
+
+class AccessFilter:
+    # function_patterns: fnmatch patterns of the function names,
+    # func_ids, inst_ids: (begin, end) ranges of ids, space: "shared" or "global",
+    # addr_ranges: list of (begin, end) address ranges, None or empty keeps everything
+    def __init__(self, function_patterns=None, func_ids=None, inst_ids=None, space=None, addr_ranges=None):
+        self.function_patterns = function_patterns or []
+        self.func_ids = func_ids
+        self.inst_ids = inst_ids
+        self.is_shared_memory = SPACES[space] if space else None
+        self.selected_funcs = set() # func ids of the functions matching function_patterns
+
+        # merged ranges, searched with bisect
+        self.addr_begins = []
+        self.addr_ends = []
+        for begin, end in sorted(addr_ranges or []):
+            if self.addr_ends and begin <= self.addr_ends[-1]:
+                self.addr_ends[-1] = max(self.addr_ends[-1], end)
+            else:
+                self.addr_begins.append(begin)
+                self.addr_ends.append(end)
+
+    def __bool__(self):
+        return bool(self.function_patterns or self.func_ids or self.inst_ids
+                    or self.is_shared_memory is not None or self.addr_begins)
+
+    def __str__(self):
+        filters = []
+        if self.function_patterns:
+            filters.append("functions {}".format(", ".join(self.function_patterns)))
+        if self.func_ids:
+            filters.append("func ids [{}, {})".format(*self.func_ids))
+        if self.inst_ids:
+            filters.append("inst ids [{}, {})".format(*self.inst_ids))
+        if self.is_shared_memory is not None:
+            filters.append("shared memory" if self.is_shared_memory else "global memory")
+        if self.addr_begins:
+            filters.append("addresses " + ", ".join("[0x{:x}, 0x{:x})".format(begin, end)
+                                                    for begin, end in zip(self.addr_begins, self.addr_ends)))
+        return ", ".join(filters)
+
+    # a function of the trace is defined
+    def add_function(self, func_id, name):
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.function_patterns):
+            self.selected_funcs.add(func_id)
+
+    def keep(self, is_shared_memory, func_id, inst_id):
+        if self.is_shared_memory is not None and is_shared_memory != self.is_shared_memory:
+            return False
+        if self.function_patterns and func_id not in self.selected_funcs:
+            return False
+        if self.func_ids and not self.func_ids[0] <= func_id < self.func_ids[1]:
+            return False
+        if self.inst_ids and not self.inst_ids[0] <= inst_id < self.inst_ids[1]:
+            return False
+        return True
+
+    # header is a header of trace_parser
+    def keep_header(self, header):
+        return self.keep(header[1], header[4], header[5])
+
+    # None if every address is kept
+    def address_filter(self):
+        if not self.addr_begins:
+            return None
+        if len(self.addr_begins) == 1:
+            begin = self.addr_begins[0]
+            end = self.addr_ends[0]
+            return lambda addr: begin <= addr < end
+        begins = self.addr_begins
+        ends = self.addr_ends
+
+        def keep_addr(addr):
+            i = bisect.bisect_right(begins, addr) - 1
+            return i >= 0 and addr < ends[i]
+        return keep_addr
+
+    # addresses of a warp with the lanes out of the ranges set to 0 (inactive),
+    # None if no lane is left
+    def filter_addrs(self, addrs, keep_addr):
+        addrs = [addr if addr and keep_addr(addr) else 0 for addr in addrs]
+        return addrs if any(addrs) else None
+
+    # filter the records of binary_trace.access_array
+    def filter_array(self, records):
+        import numpy as np
+
+        mask = np.ones(len(records), dtype=bool)
+        if self.is_shared_memory is not None:
+            mask &= (records["is_shared_memory"] != 0) == self.is_shared_memory
+        if self.function_patterns:
+            mask &= np.isin(records["func_id"], np.fromiter(self.selected_funcs, dtype=np.int64))
+        for field, ids in (("func_id", self.func_ids), ("inst_id", self.inst_ids)):
+            if ids:
+                mask &= (records[field] >= ids[0]) & (records[field] < ids[1])
+        records = records[mask]
+        if self.addr_begins and len(records):
+            addrs = records["addrs"]
+            inside = np.zeros(addrs.shape, dtype=bool)
+            for begin, end in zip(self.addr_begins, self.addr_ends):
+                inside |= (addrs >= np.uint64(begin)) & (addrs < np.uint64(end))
+            records["addrs"][~inside] = 0
+            records = records[inside.any(axis=1)]
+        return records
+
+
+# parse "BEGIN:END" of addresses, decimal or hexadecimal with 0x
+def parse_addr_range(text):
+    begin, end = text.split(":")
+    begin = int(begin, 0) if begin else 0
+    end = int(end, 0) if end else 1 << 64
+    if begin >= end:
+        raise ValueError("empty range")
+    return begin, end
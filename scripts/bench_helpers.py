@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Benchmark of race_check_helper.py and race_check_helper_memaddr.py on
+# synthetic traces (see gen_trace.py), no GPU is needed.
+#
+# For every scenario and every helper, the time, the throughput in accesses
+# per second and the peak RSS are reported, and the races found are checked
+# against the races planted in the trace.
+#
+#   bench_helpers.py                                  # all the scenarios, default helpers
+#   bench_helpers.py --scale 4 --scenario tile        # bigger grids, one scenario
+#   bench_helpers.py --variant "numpy=--engine numpy" --variant "binary=--binary"
+#
+# A variant runs race_check_helper.py with extra arguments, "--binary" as the
+# last argument is completed with the binary trace of the scenario.
+# Exits with 1 if a helper does not find the planted races.
+
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import gen_trace
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name: arguments of gen_trace.KernelConfig, the grid is multiplied by --scale
+SCENARIOS = {
+    "coalesced": dict(pattern="coalesced", grid=(64,), block_size=256, sfrs=2, races=12),
+    "strided": dict(pattern="strided", grid=(64,), block_size=256, sfrs=2, stride=8, races=12),
+    "reduction": dict(pattern="reduction", grid=(64,), block_size=256, sfrs=9, races=12),
+    "tile": dict(pattern="tile", grid=(16, 4), block_size=256, sfrs=4, races=12),
+}
+
+# (name, script, trace format, extra arguments)
+DEFAULT_VARIANTS = [
+    ("helper", "race_check_helper.py", "text", []),
+    ("memaddr", "race_check_helper_memaddr.py", "memaddr", []),
+]
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+NO_RACE = re.compile(r"no data races found in (?:the )?(\d+)th")
+RACES = re.compile(r"There are (\d+) potential data races in (?:the )?(\d+)th")
+KIND = re.compile(r"(\d+) of them are (intra block shared|intra block global|inter block global) memory")
+KINDS = ("intra block shared", "intra block global", "inter block global")
+
+
+# return the races reported for every kernel, a list of
+# (intra shared, intra global, inter global). A kernel reported twice
+# (race_check_helper.py --report both) is listed twice if the reports differ
+def parse_summary(output):
+    reports = []
+    for line in ANSI_ESCAPE.sub("", output).splitlines():
+        m = NO_RACE.search(line) or RACES.search(line)
+        if m:
+            reports.append((int(m.groups()[-1]), [0, 0, 0]))
+        else:
+            m = KIND.search(line)
+            if m and reports:
+                reports[-1][1][KINDS.index(m.group(2))] = int(m.group(1))
+
+    found = {}
+    for kernel_id, counts in reports:
+        found.setdefault(kernel_id, set()).add(tuple(counts))
+    return [counts for kernel_id in sorted(found) for counts in sorted(found[kernel_id])]
+
+
+# run a helper, return (seconds, peak RSS in KiB, stdout)
+def run_helper(args, stdin_path):
+    with open(stdin_path, "rb") as stdin, tempfile.TemporaryFile() as stdout:
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        output = stdout.read().decode(errors="replace")
+    if proc.returncode != 0:
+        raise RuntimeError("{} exited with {}".format(" ".join(args), proc.returncode))
+    return seconds, rusage.ru_maxrss, output
+
+
+# return (planted races, number of accesses) of the trace written to path
+def write_trace(path, config, trace_format, kernels):
+    with open(path, "wb" if trace_format == "binary" else "w") as f:
+        if trace_format == "binary":
+            writer = gen_trace.BinaryWriter(f)
+        else:
+            writer = gen_trace.TextWriter(f, 8 if trace_format == "text" else 10)
+        expected = gen_trace.generate(writer, config, kernels)
+    return expected, writer.num_accesses
+
+
+def parse_variant(text):
+    name, _, args = text.partition("=")
+    if not name:
+        raise argparse.ArgumentTypeError("expected NAME=ARGS")
+    args = shlex.split(args)
+    trace_format = "binary" if args[-1:] == ["--binary"] else "text"
+    return name, "race_check_helper.py", trace_format, args
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the race check helpers on synthetic traces.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (default: all)")
+    parser.add_argument("--variant", action="append", type=parse_variant, default=[],
+                        help="NAME=ARGS, also run race_check_helper.py with ARGS")
+    parser.add_argument("--scale", type=int, default=1, help="multiply the number of blocks")
+    parser.add_argument("--kernels", type=int, default=2, help="number of kernel launches per trace")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    variants = DEFAULT_VARIANTS + args.variant
+    failed = False
+
+    print("{:<11}{:<10}{:>12}{:>9}{:>14}{:>11}  {}".format(
+        "scenario", "helper", "accesses", "seconds", "accesses/s", "peak RSS", "races"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            params = dict(SCENARIOS[scenario])
+            params["grid"] = (params["grid"][0] * args.scale,) + params["grid"][1:]
+            config = gen_trace.KernelConfig(seed=args.seed, **params)
+
+            traces = {}
+            for name, script, trace_format, extra in variants:
+                if trace_format not in traces:
+                    path = os.path.join(tmp, "{}.{}".format(scenario, trace_format))
+                    traces[trace_format] = (path,) + write_trace(path, config, trace_format, args.kernels)
+                path, expected, accesses = traces[trace_format]
+
+                command = [sys.executable, os.path.join(SCRIPTS_DIR, script)] + extra
+                if trace_format == "binary":
+                    command.append(path)
+                    stdin_path = os.devnull
+                else:
+                    stdin_path = path
+                seconds, max_rss, output = run_helper(command, stdin_path)
+
+                found = parse_summary(output)
+                correct = found == expected
+                failed |= not correct
+                print("{:<11}{:<10}{:>12}{:>9.2f}{:>14.0f}{:>8.1f} MB  {}".format(
+                    scenario, name, accesses, seconds, accesses / seconds, max_rss / 1024,
+                    "ok" if correct else "WRONG: found {}, planted {}".format(found, expected)))
+                sys.stdout.flush()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Throughput benchmark of the parsers of the "race_check_trace" text protocol
+# (trace_parser.py), in lines per second.
+#
+#   bench_parser.py [trace]               # a synthetic trace is used if no trace is given
+#   bench_parser.py --min-rate 1000000    # exit with 1 if the fast parser is slower
+
+import argparse
+import io
+import random
+import sys
+import time
+
+import trace_parser
+
+
+# a trace of fully coalesced warp accesses with a few control lines
+def synthetic_trace(num_lines, seed=0):
+    rand = random.Random(seed)
+    lines = ["#func_begin#kernel(float*)\n"]
+    lines += ["#SASS#LDG.E R{}, [R2] ;\n".format(i) for i in range(16)]
+    lines.append("#func_end#\n")
+    while len(lines) < num_lines:
+        kind = rand.choice(("ld", "st"))
+        block_id = rand.randrange(1024)
+        warp_id = rand.randrange(32)
+        inst_id = rand.randrange(16)
+        base = 0x7f0000000000 + 128 * rand.randrange(1 << 20)
+        for lane_id in range(32):
+            lines.append("\n#{}#0,{},{},{},0,{},0,0x{:016x}\n".format(
+                kind, block_id, warp_id, lane_id, inst_id, base + 4 * lane_id))
+        if rand.random() < 0.001:
+            lines.append("\n#kernelends#\n")
+    lines.append("\n#kernelends#\n")
+    return "".join(lines).encode()
+
+
+def bench_parse_line(data):
+    accesses = 0
+    start = time.perf_counter()
+    for line in io.TextIOWrapper(io.BytesIO(data)):
+        if line[0] != '#':
+            continue
+        if trace_parser.parse_line(line) is not None:
+            accesses += 1
+    return accesses, time.perf_counter() - start
+
+
+def bench_parse_stream(data):
+    accesses = 0
+    start = time.perf_counter()
+    for event, value in trace_parser.parse_stream(io.BytesIO(data)):
+        if event == trace_parser.ACCESSES:
+            accesses += len(value)
+    return accesses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of the race_check_trace text parsers.")
+    parser.add_argument("trace", nargs="?", help="text trace to parse (default: a synthetic trace)")
+    parser.add_argument("--lines", type=int, default=1000000,
+                        help="number of lines of the synthetic trace")
+    parser.add_argument("--min-rate", type=float, default=0,
+                        help="fail if the fast parser handles less lines per second")
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace, "rb") as f:
+            data = f.read()
+    else:
+        data = synthetic_trace(args.lines)
+    num_lines = data.count(b"\n")
+
+    results = [("parse_line", bench_parse_line(data)),
+               ("parse_stream", bench_parse_stream(data))]
+
+    for name, (accesses, seconds) in results:
+        print("{:<14}{:>12.0f} lines/s {:>10} accesses {:>8.2f} s".format(
+            name, num_lines / seconds, accesses, seconds))
+
+    if results[0][1][0] != results[1][1][0]:
+        print("the parsers do not agree on the number of accesses")
+        sys.exit(1)
+
+    rate = num_lines / results[1][1][1]
+    if rate < args.min_rate:
+        print("parse_stream is below {:.0f} lines/s".format(args.min_rate))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+#
+# Reader and writer of the binary trace of NVbit tool "race_check_trace"
+# (enabled by BINARY_TRACE=<path>, the format is described in
+# tools/race_check_trace/common.h).
+#
+# Records are kept in the mem_access_t layout and are read from
+# memoryview slices of the (mmap-ed) file, so no string is built per access.
+#
+# Run as a script, it converts a text trace read from stdin to a binary
+# trace written to stdout, which makes it possible to test the binary
+# path without a GPU:
+#   binary_trace.py < trace.txt > trace.bin
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+import sampling
+
+MAGIC = b"RCTRACE\0"
+VERSION = 3
+
+FRAME_FUNC = 1
+FRAME_ACCESS = 2
+FRAME_KERNEL_END = 3
+FRAME_SAMPLE = 4
+FRAME_FUNC_REF = 5
+FRAME_LAUNCH = 6
+
+# binary_trace_header_t: magic, version, record_size
+TRACE_HEADER = struct.Struct("<8sII")
+# binary_frame_header_t: type, length
+FRAME_HEADER = struct.Struct("<II")
+# mem_access_t: block_id, warp_id, opcode_id, func_id, inst_id,
+# is_shared_memory, is_load, SFR_id, addrs[32]
+MEM_ACCESS = struct.Struct("<8i32Q")
+# header of a FRAME_FUNC payload: func_id, number of instructions
+FUNC_HEADER = struct.Struct("<iI")
+# sample_config_t: mode, rate threshold, seed, block_begin, block_end
+SAMPLE_CONFIG = struct.Struct("<IIIii")
+
+# index of the fields in a record returned by iter_accesses
+BLOCK_ID = 0
+WARP_ID = 1
+OPCODE_ID = 2
+FUNC_ID = 3
+INST_ID = 4
+IS_SHARED_MEMORY = 5
+IS_LOAD = 6
+SFR_ID = 7
+ADDRS = 8
+
+# payload of a FRAME_KERNEL_END of a trace of concurrent launches: launch_id
+KERNEL_END = struct.Struct("<i")
+# payload of a FRAME_LAUNCH: launch_id of the FRAME_ACCESS frames that follow
+LAUNCH = struct.Struct("<i")
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+def check_header(data):
+    if len(data) < TRACE_HEADER.size:
+        raise TraceFormatError("trace is too short")
+    magic, version, record_size = TRACE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise TraceFormatError("not a binary race_check_trace trace")
+    if version != VERSION:
+        raise TraceFormatError("unsupported trace version {}".format(version))
+    if record_size != MEM_ACCESS.size:
+        raise TraceFormatError("record size {} does not match mem_access_t ({})".format(record_size, MEM_ACCESS.size))
+
+
+# yield (frame type, payload) of a trace held in a buffer,
+# payloads are memoryview slices of the buffer
+# offset is where to start reading frames, after the trace header by default
+def iter_frames(buf, offset=None):
+    view = memoryview(buf)
+    check_header(view)
+    offset = offset or TRACE_HEADER.size
+    end = len(view)
+    while offset < end:
+        if offset + FRAME_HEADER.size > end:
+            raise TraceFormatError("truncated frame header at offset {}".format(offset))
+        frame_type, length = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > end:
+            raise TraceFormatError("truncated frame at offset {}".format(offset))
+        yield frame_type, view[offset:offset + length]
+        offset += length
+
+
+# same as iter_frames, but for a stream that cannot be mapped (e.g. a pipe)
+def read_frames(stream, offset=None):
+    check_header(stream.read(TRACE_HEADER.size))
+    if offset:
+        stream.seek(offset)
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise TraceFormatError("truncated frame header")
+        frame_type, length = FRAME_HEADER.unpack(header)
+        payload = bytearray(length)
+        if stream.readinto(payload) != length:
+            raise TraceFormatError("truncated frame")
+        yield frame_type, memoryview(payload)
+
+
+# yield the frames of the trace in path ('-' for stdin), from offset
+# if given (a frame boundary, the stream must be seekable)
+def open_trace(path, offset=None):
+    if path == "-":
+        yield from read_frames(sys.stdin.buffer, offset)
+        return
+
+    with open(path, "rb") as f:
+        if not os.path.isfile(path):
+            # fifo or device, cannot be mapped
+            yield from read_frames(f, offset)
+            return
+        if os.fstat(f.fileno()).st_size == 0:
+            raise TraceFormatError("trace is too short")
+        # the mapping stays alive as long as a payload refers to it
+        yield from iter_frames(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), offset)
+
+
+# return (func_id, func_name, list of SASS) of a FRAME_FUNC payload
+def decode_function(payload):
+    func_id, num_insts = FUNC_HEADER.unpack_from(payload)
+    strings = bytes(payload[FUNC_HEADER.size:]).split(b"\0")
+    if len(strings) < num_insts + 1:
+        raise TraceFormatError("function {} has less than {} instructions".format(func_id, num_insts))
+    func_name = strings[0].decode()
+    insts = [sass.decode() for sass in strings[1:num_insts + 1]]
+    return func_id, func_name, insts
+
+
+# return (mode, threshold, seed, block_begin, block_end) of a FRAME_SAMPLE payload,
+# see sampling.Sampler.from_config
+def decode_sample(payload):
+    return SAMPLE_CONFIG.unpack_from(payload)
+
+
+# return func_id, key and name of a FRAME_FUNC_REF payload
+def decode_function_ref(payload):
+    (func_id,) = struct.unpack_from("<i", payload)
+    key, func_name = bytes(payload[4:]).split(b"\0")[:2]
+    return func_id, key.decode(), func_name.decode()
+
+
+# return the launch id of a FRAME_LAUNCH payload
+def decode_launch(payload):
+    return LAUNCH.unpack_from(payload)[0]
+
+
+# return the launch id of a FRAME_KERNEL_END payload,
+# None if the trace has no launch ids
+def decode_kernel_end(payload):
+    if len(payload) < KERNEL_END.size:
+        return None
+    return KERNEL_END.unpack_from(payload)[0]
+
+
+# yield the records of a FRAME_ACCESS payload as flat tuples,
+# see BLOCK_ID ... ADDRS for the index of the fields
+def iter_accesses(payload):
+    return MEM_ACCESS.iter_unpack(payload)
+
+
+# number of active lanes (non zero addresses) of a FRAME_ACCESS payload,
+# the zeros of the first 4 words of every record (the 8 int fields) are not counted
+def count_accesses(payload):
+    words = array.array('Q')
+    words.frombytes(payload)
+    record_words = MEM_ACCESS.size // 8
+    zero_lanes = words.count(0) - sum(words[i::record_words].count(0) for i in range(record_words - 32))
+    return len(words) // record_words * 32 - zero_lanes
+
+
+# numpy structured view of a FRAME_ACCESS payload (no copy)
+def access_array(payload):
+    import numpy as np
+
+    return np.frombuffer(payload, dtype=mem_access_dtype())
+
+
+def mem_access_dtype():
+    import numpy as np
+
+    return np.dtype([("block_id", "<i4"), ("warp_id", "<i4"), ("opcode_id", "<i4"),
+                     ("func_id", "<i4"), ("inst_id", "<i4"), ("is_shared_memory", "<i4"),
+                     ("is_load", "<i4"), ("SFR_id", "<i4"),
+                     ("addrs", "<u8", (32,))])
+
+
+class TraceWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.num_funcs = 0
+        stream.write(TRACE_HEADER.pack(MAGIC, VERSION, MEM_ACCESS.size))
+
+    def write_frame(self, frame_type, payload=b""):
+        self.stream.write(FRAME_HEADER.pack(frame_type, len(payload)))
+        self.stream.write(payload)
+
+    def write_function(self, func_name, insts):
+        strings = [func_name.encode()] + [sass.encode() for sass in insts]
+        payload = FUNC_HEADER.pack(self.num_funcs, len(insts)) + b"".join(s + b"\0" for s in strings)
+        self.num_funcs += 1
+        self.write_frame(FRAME_FUNC, payload)
+
+    # each record is (block_id, warp_id, opcode_id, func_id, inst_id,
+    # is_shared_memory, is_load, SFR_id, addrs), addrs
+    # has 32 addresses where 0 means the lane is inactive
+    def write_accesses(self, records):
+        payload = b"".join(MEM_ACCESS.pack(*record[:ADDRS], *record[ADDRS]) for record in records)
+        if payload:
+            self.write_frame(FRAME_ACCESS, payload)
+
+    # the accesses that follow are of launch_id (traces of concurrent launches)
+    def write_launch(self, launch_id):
+        self.write_frame(FRAME_LAUNCH, LAUNCH.pack(launch_id))
+
+    # launch_id is given for traces of concurrent launches
+    def write_kernel_end(self, launch_id=None):
+        self.write_frame(FRAME_KERNEL_END, b"" if launch_id is None else KERNEL_END.pack(launch_id))
+
+    # a function of the function cache, see func_cache.py
+    def write_function_ref(self, key, func_name):
+        payload = struct.pack("<i", self.num_funcs) + key.encode() + b"\0" + func_name.encode() + b"\0"
+        self.num_funcs += 1
+        self.write_frame(FRAME_FUNC_REF, payload)
+
+    def write_sample(self, mode, threshold, seed, block_begin, block_end):
+        self.write_frame(FRAME_SAMPLE, SAMPLE_CONFIG.pack(mode, threshold, seed, block_begin, block_end))
+
+
+# convert a text trace to a binary trace, every "#ld#"/"#st#" line
+# becomes a record with only the address of its lane set.
+# "#launch#" lines become FRAME_LAUNCH frames and "#sample#" lines FRAME_SAMPLE frames
+def text_to_binary(lines, writer):
+    func_name = None
+    insts = []
+    records = []
+    for line in lines:
+        line = line.strip('\n')
+        if line[:12] == "#func_begin#":
+            func_name = line[12:]
+            insts = []
+        elif line[:6] == "#SASS#" and func_name is not None:
+            insts.append(line[6:])
+        elif line == "#func_end#":
+            writer.write_function(func_name, insts)
+            func_name = None
+        elif line[:10] == "#func_ref#":
+            writer.write_function_ref(*line[10:].split(",", 1))
+        elif line[:12] == "#kernelends#":
+            writer.write_accesses(records)
+            records = []
+            writer.write_kernel_end(int(line[12:]) if line[12:] else None)
+        elif line[:8] == "#sample#":
+            sampler = sampling.Sampler.from_line(line[8:])
+            writer.write_sample(sampler.mode, sampler.threshold, sampler.seed, sampler.block_begin, sampler.block_end)
+        elif line[:8] == "#launch#":
+            writer.write_accesses(records)
+            records = []
+            writer.write_launch(int(line[8:]))
+        elif line[:4] in ("#ld#", "#st#"):
+            temp = line[4:].split(",")
+            if len(temp) != 8:
+                continue
+            addrs = [0] * 32
+            addrs[int(temp[3])] = int(temp[7], 16)
+            records.append((int(temp[1]), int(temp[2]), 0, int(temp[4]), int(temp[5]),
+                            int(temp[0]), line[:4] == "#ld#", int(temp[6]), addrs))
+    writer.write_accesses(records)
+
+
+if __name__ == "__main__":
+    text_to_binary(sys.stdin, TraceWriter(sys.stdout.buffer))
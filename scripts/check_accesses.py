@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+#
+# Check the addresses of a race_check_trace trace against the accesses a
+# kernel is expected to make, e.g. that thread i of vectoradd stores c[i]:
+#
+#   BLOCK_WARP_ID=1 LD_PRELOAD=tools/race_check_trace/race_check_trace.so ./vectoradd > trace.txt
+#   check_accesses.py --block-size 1024 --expect "st global c[gtid] size=8" < trace.txt
+#   check_accesses.py --binary trace.bin --spec kernel.spec
+#
+# A spec is one line "KIND SPACE NAME[INDEX] [OPTION=VALUE ...]":
+#   KIND    ld, st or any
+#   SPACE   global, shared or any
+#   NAME    name of the array, only used in reports
+#   INDEX   expression of the element a thread accesses, over the variables
+#           block, warp, lane, tid (warp * 32 + lane), gtid
+#           (block * --block-size + tid), cta_x, cta_y, cta_z, func, inst, SFR
+#           and the functions min, max, abs and where. warp is the warp_id
+#           of the trace, which must be the index of the warp in its block
+#           (the linear index of the thread in the block / 32) for tid and
+#           gtid to be thread indexes: race_check_trace records it with
+#           BLOCK_WARP_ID=1, otherwise it records %warpid, the slot of the
+#           warp on its SM. gen_trace.py traces have it too
+# and the options
+#   size=N          size of an element in bytes (default: 4)
+#   base=ADDR|auto  address of element 0, auto (default) takes the base most
+#                   accesses of the kernel agree with, once the kernel ends
+#   func=PATTERN    only the accesses of the functions matching PATTERN (fnmatch)
+#   inst=N          only the accesses of instruction N of the function
+# A spec file (--spec) has one spec per line, with "#" comments.
+#
+# An access must be at the expected address of at least one of the specs
+# of its kind, space, function and instruction. Accesses no spec applies to
+# are not checked, unless --strict. Accesses are read in chunks converted
+# to NumPy columns, and every spec is checked with a few array operations
+# per chunk, so the Python overhead does not depend on the number of threads.
+# The mismatches of every kernel are reported when it ends, the exit status
+# is 1 if any access does not match. --self-test checks the validator itself.
+
+import argparse
+import fnmatch
+import re
+import sys
+
+import numpy as np
+
+import binary_trace
+import trace_parser
+
+# format: "KIND SPACE NAME[INDEX] OPTION=VALUE ..."
+SPEC_LINE = re.compile(r"^(ld|st|any)\s+(global|shared|any)\s+(\w+)\[(.+)\]((?:\s+\w+=\S+)*)$")
+SPEC_OPTIONS = ("size", "base", "func", "inst")
+
+INDEX_VARIABLES = ("block", "warp", "lane", "tid", "gtid", "cta_x", "cta_y", "cta_z", "func", "inst", "SFR")
+INDEX_FUNCTIONS = {"min": np.minimum, "max": np.maximum, "abs": np.abs, "where": np.where}
+
+# value of an hexadecimal digit, by ASCII code
+HEX_DIGITS = np.zeros(256, dtype=np.uint64)
+for digit, char in enumerate(b"0123456789abcdef"):
+    HEX_DIGITS[char] = digit
+    HEX_DIGITS[bytes([char]).upper()[0]] = digit
+
+BLOCK_SIZE = 0 # --block-size, threads per block of gtid
+GRID = None # --grid, (X, Y, Z) blocks, to convert between block and cta ids
+MAX_REPORTS = 10 # --max-reports, mismatches printed per kernel
+STRICT = False # --strict, accesses no spec applies to are mismatches
+
+# distinct keys of the accesses of automatic specs kept before they are first merged,
+# and keys whose first accesses are kept as examples of mismatches, see Kernel
+MAX_PENDING_KEYS = 1 << 16
+MAX_EXAMPLE_KEYS = 64
+# automatic specs are bits of an int64
+MAX_AUTO_SPECS = 62
+
+
+class SpecError(Exception):
+    pass
+
+
+class Spec:
+    def __init__(self, text):
+        m = SPEC_LINE.match(text.strip())
+        if m is None:
+            raise SpecError("bad spec \"{}\", expected \"KIND SPACE NAME[INDEX] OPTION=VALUE ...\"".format(text))
+        self.text = " ".join(text.split())
+        self.kind, self.space, self.name, self.index = m.group(1, 2, 3, 4)
+        options = dict(option.split("=", 1) for option in m.group(5).split())
+        for option in options:
+            if option not in SPEC_OPTIONS:
+                raise SpecError("unknown option {} in spec \"{}\"".format(option, text))
+        try:
+            self.size = int(options.get("size", "4"), 0)
+            self.base = None if options.get("base", "auto") == "auto" else int(options["base"], 0)
+            self.inst = int(options["inst"], 0) if "inst" in options else None
+        except ValueError:
+            raise SpecError("bad option value in spec \"{}\"".format(text))
+        if self.size < 1:
+            raise SpecError("size must be positive in spec \"{}\"".format(text))
+        self.func = options.get("func")
+
+        try:
+            self.code = compile(self.index, "<spec>", "eval")
+        except SyntaxError:
+            raise SpecError("bad index expression in spec \"{}\"".format(text))
+        for name in self.code.co_names:
+            if name not in INDEX_VARIABLES and name not in INDEX_FUNCTIONS:
+                raise SpecError("unknown name {} in spec \"{}\"".format(name, text))
+        if "gtid" in self.code.co_names and BLOCK_SIZE < 1:
+            raise SpecError("gtid needs --block-size in spec \"{}\"".format(text))
+
+    # mask of the accesses of columns the spec applies to
+    def applies(self, columns, func_names):
+        mask = np.ones(len(columns["addr"]), dtype=bool)
+        if self.kind != "any":
+            mask &= columns["is_load"] == (self.kind == "ld")
+        if self.space != "any":
+            mask &= columns["is_shared"] == (self.space == "shared")
+        if self.func is not None:
+            func_ids = [func_id for func_id, func_name in enumerate(func_names)
+                        if func_name is not None and fnmatch.fnmatchcase(func_name, self.func)]
+            mask &= np.isin(columns["func"], func_ids)
+        if self.inst is not None:
+            mask &= columns["inst"] == self.inst
+        return mask
+
+    # element index of every access of columns
+    def element(self, columns):
+        variables = dict(columns)
+        variables.update(INDEX_FUNCTIONS)
+        index = eval(self.code, {"__builtins__": {}}, variables)
+        return np.broadcast_to(np.asarray(index, dtype=np.int64), columns["addr"].shape)
+
+
+# distinct rows of keys, with their counts (the sum of counts if given),
+# their first row and the distinct row of every row. Rows are sorted
+# with lexsort, much faster than np.unique(axis=0) which sorts them as bytes
+def unique_rows(keys, counts=None):
+    order = np.lexsort(keys.T[::-1])
+    ordered = keys[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = np.cumsum(starts) - 1
+    if counts is None:
+        counts = np.ones(len(keys), dtype=np.int64)
+    unique_counts = np.add.reduceat(counts[order], np.flatnonzero(starts))
+    # lexsort is stable, the first row of a group is its first row in keys
+    return ordered[starts], unique_counts, order[starts], inverse
+
+
+# accesses and mismatches of a kernel. The accesses a spec with an
+# automatic base applies to are checked when the kernel ends, once the base
+# most of them agree with is known. Until then they are kept as the counts
+# of their distinct keys:
+#   (automatic specs applying as bits, matched by a spec with a base,
+#    address - size * index for every automatic spec)
+# which are few when the accesses follow the specs
+class Kernel:
+    def __init__(self, specs):
+        self.specs = specs
+        self.auto = [i for i, spec in enumerate(specs) if spec.base is None]
+        self.bases = [spec.base for spec in specs]
+        self.checked = [0] * len(specs) # accesses each spec applies to
+        self.accesses = 0
+        self.unchecked = 0
+        self.mismatches = 0
+        self.examples = [] # (access number, access, spec_id, index) of the mismatches
+        self.pending = [] # (keys, counts) of the accesses of automatic specs
+        self.pending_keys = 0
+        self.merge_limit = MAX_PENDING_KEYS
+        self.pending_examples = {} # key: key, val: examples of its first accesses
+
+    def add(self, columns, func_names):
+        n = len(columns["addr"])
+        if n == 0:
+            return
+        addr = columns["addr"]
+        applied = np.zeros(n, dtype=bool)
+        matched = np.zeros(n, dtype=bool) # by a spec with a base
+        auto_specs = np.zeros(n, dtype=np.int64)
+        deltas = np.zeros((n, len(self.auto)), dtype=np.int64)
+        first = np.full(n, -1, dtype=np.int64) # first spec applying to an access
+        first_index = np.zeros(n, dtype=np.int64) # and the element it expects
+        for i, spec in enumerate(self.specs):
+            mask = spec.applies(columns, func_names)
+            if not mask.any():
+                continue
+            index = spec.element(columns)
+            new = mask & ~applied
+            first[new] = i
+            first_index[new] = index[new]
+            applied |= mask
+            self.checked[i] += int(np.count_nonzero(mask))
+            if spec.base is None:
+                j = self.auto.index(i)
+                auto_specs |= mask.astype(np.int64) << j
+                deltas[:, j] = np.where(mask, addr - spec.size * index, 0)
+            else:
+                matched |= mask & (addr == spec.base + spec.size * index)
+
+        pending = auto_specs != 0
+        bad = applied & ~matched & ~pending
+        if STRICT:
+            bad |= ~applied
+        else:
+            self.unchecked += n - int(np.count_nonzero(applied))
+        num_bad = int(np.count_nonzero(bad))
+        self.mismatches += num_bad
+        if num_bad and len(self.examples) < MAX_REPORTS:
+            for row in np.flatnonzero(bad)[:MAX_REPORTS - len(self.examples)].tolist():
+                self.examples.append(self.example(columns, row, first, first_index))
+        if pending.any():
+            keys = np.column_stack([auto_specs, matched, deltas])[pending]
+            self.add_pending(keys, np.flatnonzero(pending), columns, first, first_index)
+        self.accesses += n
+
+    def example(self, columns, row, first, first_index):
+        access = tuple(int(columns[name][row]) for name in ("is_load", "block", "warp", "lane", "func", "inst", "addr"))
+        return self.accesses + row, access, int(first[row]), int(first_index[row])
+
+    # keys of the accesses at rows of columns
+    def add_pending(self, keys, rows, columns, first, first_index):
+        unique, counts, first_rows, inverse = unique_rows(keys)
+        self.pending.append((unique, counts))
+        self.pending_keys += len(unique)
+        if self.pending_keys > self.merge_limit:
+            self.merge_pending()
+            # at least twice as many keys before the next merge
+            self.merge_limit = max(MAX_PENDING_KEYS, 2 * self.pending_keys)
+
+        # the first accesses of the first keys of the kernel, the keys of
+        # mismatches are known only at the end. At most MAX_EXAMPLE_KEYS
+        # keys are stored and as many are found stored before
+        room = MAX_EXAMPLE_KEYS - len(self.pending_examples)
+        if room <= 0:
+            return
+        for j in np.argsort(first_rows)[:2 * MAX_EXAMPLE_KEYS].tolist():
+            key = tuple(unique[j].tolist())
+            if key in self.pending_examples:
+                continue
+            self.pending_examples[key] = [self.example(columns, row, first, first_index)
+                                          for row in rows[np.flatnonzero(inverse == j)[:MAX_REPORTS]].tolist()]
+            room -= 1
+            if room == 0:
+                break
+
+    def merge_pending(self):
+        keys = np.concatenate([keys for keys, counts in self.pending])
+        counts = np.concatenate([counts for keys, counts in self.pending])
+        unique, counts, first_rows, inverse = unique_rows(keys, counts)
+        self.pending = [(unique, counts)]
+        self.pending_keys = len(unique)
+
+    # whether the accesses of a key match, once the bases are known
+    def key_matches(self, key):
+        return key[1] != 0 or any(key[0] >> j & 1 and key[2 + j] == self.bases[i]
+                                  for j, i in enumerate(self.auto))
+
+    # the kernel ended, choose the automatic bases and check their accesses
+    def finish(self):
+        if self.pending:
+            self.merge_pending()
+            keys, counts = self.pending[0]
+            matched = keys[:, 1] != 0
+            for j, i in enumerate(self.auto):
+                applies = (keys[:, 0] >> j) & 1 != 0
+                if not applies.any():
+                    continue
+                bases, inverse = np.unique(keys[applies, 2 + j], return_inverse=True)
+                votes = np.bincount(inverse.reshape(-1), weights=counts[applies])
+                self.bases[i] = int(bases[np.argmax(votes)])
+                matched |= applies & (keys[:, 2 + j] == self.bases[i])
+            self.mismatches += int(counts[~matched].sum())
+            for key, examples in self.pending_examples.items():
+                if not self.key_matches(key):
+                    self.examples += examples
+            self.pending = []
+        self.examples = sorted(self.examples)[:MAX_REPORTS]
+
+    def mismatch(self, access, spec_id, index):
+        is_load, block, warp, lane, func, inst, addr = access
+        where = "{} block {} warp {} lane {} (func {} inst {})".format(
+            "ld" if is_load else "st", block, warp, lane, func, inst)
+        if spec_id < 0:
+            return "{} accessed {:#x}, no spec applies".format(where, addr)
+        spec = self.specs[spec_id]
+        base = self.bases[spec_id]
+        expected = base + spec.size * index
+        offset, rest = divmod(addr - base, spec.size)
+        actual = "{}[{}]".format(spec.name, offset) if rest == 0 else "{}[{}] + {}".format(spec.name, offset, rest)
+        return "{} accessed {:#x} ({}), expected {:#x} ({}[{}]) by \"{}\"".format(
+            where, addr, actual, expected, spec.name, index, spec.text)
+
+    # print the result of the kernel, return True if every access matches
+    def report(self, kernel_id):
+        self.finish()
+        for spec, base, checked in zip(self.specs, self.bases, self.checked):
+            if checked:
+                print("kernel {}: {} accesses of \"{}\", base {:#x}".format(kernel_id, checked, spec.text, base))
+            else:
+                print("kernel {}: no access of \"{}\"".format(kernel_id, spec.text))
+        if self.unchecked:
+            print("kernel {}: {} accesses no spec applies to".format(kernel_id, self.unchecked))
+        if self.mismatches == 0:
+            print("kernel {}: all {} accesses match".format(kernel_id, self.accesses))
+            return True
+        print("kernel {}: {} of {} accesses do not match".format(kernel_id, self.mismatches, self.accesses))
+        for number, access, spec_id, index in self.examples:
+            print("  " + self.mismatch(access, spec_id, index))
+        if self.mismatches > len(self.examples):
+            print("  ... {} more".format(self.mismatches - len(self.examples)))
+        return False
+
+
+# the kernels of a trace, a trace of concurrent launches
+# has one kernel in flight for every launch
+class Checker:
+    def __init__(self, specs):
+        self.specs = specs
+        self.in_flight = {}
+        self.func_names = [] # by func_id
+        self.kernel_counter = 0
+        self.failed = 0
+        self.mismatches = 0
+
+    def add(self, launch_id, columns):
+        kernel = self.in_flight.get(launch_id)
+        if kernel is None:
+            kernel = self.in_flight[launch_id] = Kernel(self.specs)
+        kernel.add(columns, self.func_names)
+
+    def add_function(self, func_id, func_name):
+        if func_id >= len(self.func_names):
+            self.func_names.extend([None] * (func_id + 1 - len(self.func_names)))
+        self.func_names[func_id] = func_name
+
+    def end(self, launch_id):
+        kernel = self.in_flight.pop(launch_id, None) or Kernel(self.specs)
+        self.kernel_counter += 1
+        if not kernel.report(self.kernel_counter):
+            self.failed += 1
+        self.mismatches += kernel.mismatches
+
+
+# parse the hexadecimal addresses "0x..." of a column of bytes
+def parse_hex(column):
+    digits = np.array(column)
+    digits = digits.view(np.uint8).reshape(len(digits), digits.itemsize)[:, 2:]
+    addr = np.zeros(len(digits), dtype=np.uint64)
+    for i in range(digits.shape[1]):
+        # strings shorter than the longest are padded with zeros
+        valid = digits[:, i] != 0
+        addr = np.where(valid, addr * np.uint64(16) + HEX_DIGITS[digits[:, i]], addr)
+    return addr.astype(np.int64)
+
+
+def int_column(column):
+    return np.fromstring(b" ".join(column), dtype=np.int64, sep=" ")
+
+
+def block_of_cta_columns(x, y, z):
+    if GRID is None:
+        return x
+    return x + GRID[0] * (y + GRID[1] * z)
+
+
+def add_thread_columns(columns):
+    columns["tid"] = columns["warp"] * 32 + columns["lane"]
+    columns["gtid"] = columns["block"] * BLOCK_SIZE + columns["tid"]
+    if "cta_x" not in columns:
+        if GRID is None:
+            columns["cta_x"] = columns["block"]
+            columns["cta_y"] = columns["cta_z"] = np.zeros_like(columns["block"])
+        else:
+            columns["cta_x"] = columns["block"] % GRID[0]
+            columns["cta_y"] = columns["block"] // GRID[0] % GRID[1]
+            columns["cta_z"] = columns["block"] // (GRID[0] * GRID[1])
+    return columns
+
+
+# columns of the "#ld#"/"#st#" fields of a run of lines, 8 or 10 fields
+def text_columns(fields):
+    kind = np.array(fields[0])
+    kind = kind.view(np.uint8).reshape(len(kind), kind.itemsize)
+    columns = {"is_load": kind[:, 1] == ord("l"), "is_shared": kind[:, 4] == ord("1")}
+    if len(fields) == 10:
+        for name, column in zip(("cta_x", "cta_y", "cta_z"), fields[1:4]):
+            columns[name] = int_column(column)
+        columns["block"] = block_of_cta_columns(columns["cta_x"], columns["cta_y"], columns["cta_z"])
+        fields = fields[:2] + fields[4:] # the warp and following fields at the same place
+    else:
+        columns["block"] = int_column(fields[1])
+    for name, column in zip(("warp", "lane", "func", "inst", "SFR"), fields[2:7]):
+        columns[name] = int_column(column)
+    columns["addr"] = parse_hex(fields[7])
+    return add_thread_columns(columns)
+
+
+# return the columns of the access lines in chunk[start:end], None if there is none
+def parse_text_accesses(chunk, start, end):
+    tokens = chunk[start:end].split()
+    if not tokens:
+        return None
+    fields = b",".join(tokens).split(b",")
+    for width in (8, 10):
+        if len(fields) != width * len(tokens):
+            continue
+        columns = [fields[i::width] for i in range(width)]
+        if all(kind[:4] in (b"#ld#", b"#st#") for kind in set(columns[0])):
+            return text_columns(columns)
+
+    # other output is mixed with the access lines
+    found = trace_parser.ACCESS_LINE.findall(chunk, start, end) or trace_parser.ACCESS_LINE_CTA.findall(chunk, start, end)
+    if not found:
+        return None
+    return text_columns(list(zip(*found)))
+
+
+def check_text(stream, checker, chunk_size=trace_parser.CHUNK_SIZE):
+    launch_id = None
+    for chunk in trace_parser.read_chunks(stream, chunk_size):
+        pos = 0
+        for m in list(trace_parser.CONTROL_LINE.finditer(chunk)) + [None]:
+            end = len(chunk) if m is None else m.start()
+            if end > pos:
+                columns = parse_text_accesses(chunk, pos, end)
+                if columns is not None:
+                    checker.add(launch_id, columns)
+            if m is None:
+                break
+            pos = m.end()
+            control = trace_parser.control_event(m)
+            if control is None:
+                continue
+            event, value = control
+            if event == trace_parser.FUNC_BEGIN:
+                checker.add_function(len(checker.func_names), value)
+            elif event == trace_parser.FUNC_REF:
+                checker.add_function(len(checker.func_names), value.split(",", 1)[1])
+            elif event == trace_parser.LAUNCH:
+                launch_id = value
+            elif event == trace_parser.KERNEL_END:
+                checker.end(value if value is not None else launch_id)
+
+
+# columns of the active lanes of the records of a FRAME_ACCESS payload
+def binary_columns(payload):
+    records = binary_trace.access_array(payload)
+    rows, lanes = np.nonzero(records["addrs"])
+    columns = {"is_load": records["is_load"][rows] != 0, "is_shared": records["is_shared_memory"][rows] != 0,
+               "block": records["block_id"][rows].astype(np.int64), "warp": records["warp_id"][rows].astype(np.int64),
+               "lane": lanes.astype(np.int64), "func": records["func_id"][rows].astype(np.int64),
+               "inst": records["inst_id"][rows].astype(np.int64), "SFR": records["SFR_id"][rows].astype(np.int64),
+               "addr": records["addrs"][rows, lanes].astype(np.int64)}
+    return add_thread_columns(columns)
+
+
+def check_binary(path, checker):
+    launch_id = None
+    for frame_type, payload in binary_trace.open_trace(path):
+        if frame_type == binary_trace.FRAME_ACCESS:
+            checker.add(launch_id, binary_columns(payload))
+        elif frame_type == binary_trace.FRAME_LAUNCH:
+            launch_id = binary_trace.decode_launch(payload)
+        elif frame_type == binary_trace.FRAME_KERNEL_END:
+            end_id = binary_trace.decode_kernel_end(payload)
+            checker.end(end_id if end_id is not None else launch_id)
+        elif frame_type == binary_trace.FRAME_FUNC:
+            func_id, func_name, insts = binary_trace.decode_function(payload)
+            checker.add_function(func_id, func_name)
+        elif frame_type == binary_trace.FRAME_FUNC_REF:
+            func_id, key, func_name = binary_trace.decode_function_ref(payload)
+            checker.add_function(func_id, func_name)
+
+
+# address of c in the traces of --self-test
+SELF_TEST_BASE = 0x7f1000000000
+
+
+# stores of 32 threads to c[thread], the store of wrong_lane is elsewhere
+def store_lines(wrong_lane=None):
+    lines = []
+    for lane in range(32):
+        element = lane + 100 if lane == wrong_lane else lane
+        lines.append("#st#0,0,0,{},0,1,0,0x{:016x}".format(lane, SELF_TEST_BASE + 4 * element))
+    return lines
+
+
+# cases of --self-test: (name, spec, trace lines, chunk size, expected mismatches)
+def self_test_cases():
+    bad = store_lines(wrong_lane=0)
+    return [
+        ("matching stores", "st global c[gtid]", store_lines() + ["#kernelends#"], None, 0),
+        ("one wrong store", "st global c[gtid]", bad + ["#kernelends#"], None, 1),
+        # the wrong store alone before a control line, the base is chosen over the kernel
+        ("control line after the wrong store", "st global c[gtid]",
+         ["#launch#1"] + bad[:1] + ["#launch#1"] + bad[1:] + ["#kernelends#1"], None, 1),
+        ("chunk boundary in the kernel", "st global c[gtid]", bad + ["#kernelends#"], 128, 1),
+        ("explicit base", "st global c[gtid + 1] base={:#x}".format(SELF_TEST_BASE), store_lines() + ["#kernelends#"],
+         None, 32),
+    ]
+
+
+# check the validator on small traces, return True if every case passes
+def self_test():
+    global BLOCK_SIZE
+
+    import contextlib
+    import io
+
+    BLOCK_SIZE = 32
+    passed = True
+    for name, text, lines, chunk_size, expected in self_test_cases():
+        checker = Checker([Spec(text)])
+        stream = io.BytesIO(("\n".join(lines) + "\n").encode())
+        with contextlib.redirect_stdout(io.StringIO()):
+            check_text(stream, checker, chunk_size or trace_parser.CHUNK_SIZE)
+        ok = checker.kernel_counter == 1 and checker.mismatches == expected
+        print("{}: {} ({} mismatches, expected {})".format(name, "ok" if ok else "FAILED", checker.mismatches, expected))
+        passed = passed and ok
+    return passed
+
+
+def read_spec_file(path):
+    with open(path) as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def parse_dims(text):
+    dims = tuple(int(d) for d in text.split(","))
+    if not 1 <= len(dims) <= 3 or min(dims) < 1:
+        raise argparse.ArgumentTypeError("expected X[,Y[,Z]]")
+    return dims + (1,) * (3 - len(dims))
+
+
+def main(argv=None):
+    global BLOCK_SIZE, GRID, MAX_REPORTS, STRICT
+
+    parser = argparse.ArgumentParser(description="Check the addresses of a race_check_trace trace against the expected accesses.")
+    parser.add_argument("--expect", action="append", default=[], metavar="SPEC",
+                        help="expected accesses \"KIND SPACE NAME[INDEX] OPTION=VALUE ...\", may be repeated")
+    parser.add_argument("--spec", action="append", default=[], metavar="FILE",
+                        help="file of specs, one per line")
+    parser.add_argument("--block-size", type=int, default=0, metavar="N",
+                        help="threads per block, for gtid")
+    parser.add_argument("--grid", type=parse_dims, default=None, metavar="X[,Y[,Z]]",
+                        help="blocks of the grid, to convert between block and cta_x, cta_y, cta_z "
+                             "(default: a 1D grid)")
+    parser.add_argument("--strict", action="store_true",
+                        help="accesses no spec applies to are mismatches")
+    parser.add_argument("--max-reports", type=int, default=10, metavar="N",
+                        help="mismatches printed per kernel (default: 10)")
+    parser.add_argument("--binary", metavar="FILE",
+                        help="read a binary trace ('-' for stdin)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="read the text trace from FILE instead of stdin")
+    parser.add_argument("--self-test", action="store_true",
+                        help="check the validator itself on small built-in traces")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        return 0 if self_test() else 1
+
+    BLOCK_SIZE = args.block_size
+    GRID = args.grid
+    MAX_REPORTS = args.max_reports
+    STRICT = args.strict
+
+    texts = list(args.expect)
+    try:
+        for path in args.spec:
+            texts += read_spec_file(path)
+        specs = [Spec(text) for text in texts]
+    except (OSError, SpecError) as e:
+        parser.error(str(e))
+    if not specs:
+        parser.error("no spec, use --expect or --spec")
+    if sum(spec.base is None for spec in specs) > MAX_AUTO_SPECS:
+        parser.error("more than {} specs with base=auto".format(MAX_AUTO_SPECS))
+
+    checker = Checker(specs)
+    try:
+        if args.binary:
+            check_binary(args.binary, checker)
+        elif args.trace:
+            with open(args.trace, "rb") as f:
+                check_text(f, checker)
+        else:
+            check_text(sys.stdin.buffer, checker)
+    except binary_trace.TraceFormatError as e:
+        parser.exit(2, "{}: error: {}\n".format(parser.prog, e))
+    for launch_id in list(checker.in_flight):
+        checker.end(launch_id) # trace without "#kernelends#"
+
+    if checker.kernel_counter == 0:
+        print("no kernel in the trace")
+    elif checker.failed:
+        print("{} of {} kernels do not match".format(checker.failed, checker.kernel_counter))
+    else:
+        print("all {} kernels match".format(checker.kernel_counter))
+    return 1 if checker.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
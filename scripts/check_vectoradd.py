@@ -1,48 +1,22 @@
 #!/usr/bin/env python3
 #
 # Yineng Yan (yinengy@umich.edu, 2020
+#
+# Check that thread i of the vectoradd test app writes c[i] (doubles,
+# blocks of 1024 threads). i is gtid, blockIdx.x * 1024 + threadIdx.x, so
+# the trace must record the index of the warp in its block (BLOCK_WARP_ID=1).
+# See check_accesses.py for other kernels:
+#
+#   BLOCK_WARP_ID=1 LD_PRELOAD=tools/race_check_trace/race_check_trace.so ./vectoradd | scripts/check_vectoradd.py
+#
+# Other options are passed to check_accesses.py.
 
 import sys
 
-base_addr = 0
-
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
-map_thread_addr = {}
-
-# read input and build dict
-for line in sys.stdin:
-    if "#ld#" in line: # format: "#ld#is_shared_memory, blockid, threadid, addr\n"
-        temp = line[4:-1].split(",")
-        tid = int(temp[-2])
-        addr = int(temp[-1], 0)       
-
-
-    if "#st#" in line: # format: "#ld#is_shared_memory, blockid, threadid, addr\n"
-        temp = line[4:-1].split(",")
-        tid = int(temp[-2])
-        addr = int(temp[-1], 0)  
-
-        map_thread_addr[tid] = addr
-
-        if (tid == 1):
-            base_addr = addr - 8
+import check_accesses
 
-for tid in map_thread_addr:
-    c_idx = (map_thread_addr[tid] - base_addr) // 8
+VECTORADD_SPEC = "st global c[gtid] size=8"
+BLOCK_SIZE = 1024
 
-    if (c_idx != tid):
-        print("Base addr is " + str(base_addr))
-        print("Thread " + str(tid) + " write to c[" + str(c_idx) + "]" + "and address is " + str(map_thread_addr[tid]))
-        print("Thread " + str(0) + " write to  address is " + str(map_thread_addr[0]))
-        print("Thread " + str(1) + " write to  address is " + str(map_thread_addr[1]))
-        raise Exception("Error")
-    print("Thread " + str(tid) + " write to c[" + str(c_idx) + "]")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(check_accesses.main(["--expect", VECTORADD_SPEC, "--block-size", str(BLOCK_SIZE)] + sys.argv[1:]))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# Checkpoints of race_check_helper.py (--checkpoint FILE, --resume).
+#
+# A checkpoint is written at the end of a kernel, every --checkpoint-every
+# kernels, once the reports of the kernels read so far are printed. It
+# holds what the helper needs to go on reading the trace from there:
+#   source          ("trace", "binary" or "capture", path) of the trace
+#   position        offset in the trace file after the end of the kernel,
+#                   None for a capture (it is replayed from the next launch)
+#   kernel_counter, kernels_ended
+#   functions       the function table, and the functions selected by --function
+#   trace_sampler   sampling of the trace
+#   block_cta_ids   numbering of the blocks of traces with 10 fields
+#   launch_cache    launches remembered by --memoize, with their race counts
+#   metrics         totals of --metrics
+#   launches        in a trace of concurrent launches, the launches still in
+#                   flight at the end of the kernel (their shadow memory and
+#                   the launch of the accesses that follow), pickled
+# Launches in flight that cannot be saved (in a capture, or spilled to disk
+# by --max-memory) hold the checkpoint back until a kernel ends with no other
+# launch running, the helper warns when a whole interval passes without one.
+#
+# The state is pickled and compressed with zlib, and the file is replaced
+# as a whole so a crash while writing leaves the previous checkpoint.
+
+import os
+import pickle
+import tempfile
+import zlib
+
+MAGIC = b"RCCHECK"
+VERSION = 2
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def write(path, state):
+    data = MAGIC + bytes([VERSION]) + zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# return the state of the checkpoint in path
+def read(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise CheckpointError("{} is not a checkpoint".format(path))
+    if data[len(MAGIC)] != VERSION:
+        raise CheckpointError("checkpoint {} has version {}, expected {}".format(path, data[len(MAGIC)], VERSION))
+    return pickle.loads(zlib.decompress(data[len(MAGIC) + 1:]))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# On-disk cache of the function tables of race_check_trace (the name and
+# the SASS of every instruction of a function), shared by the NVbit tool
+# (FUNC_CACHE=DIR) and race_check_helper.py (--func-cache DIR).
+#
+# A function is keyed by a hash of its name and SASS: the first 128 bits of
+# the SHA-1 of the name and of every SASS line, each followed by '\0' (the
+# strings of a FRAME_FUNC payload), as 32 hexadecimal digits.
+# The helper writes every function it reads in full to DIR/KEY.func, the
+# name on the first line and one SASS per line. Once a function is in the
+# cache, the tool sends "#func_ref#KEY,NAME" (or a FRAME_FUNC_REF frame)
+# instead of its "#func_begin#"/"#SASS#"/"#func_end#" dump. The helper
+# checks that the name of a referenced function is the name in the cache.
+# The SASS of a cached function is read only when one of its instructions
+# is reported.
+
+import hashlib
+import os
+import tempfile
+
+SUFFIX = ".func"
+
+
+# key of a function, insts are the SASS of its instructions
+def function_key(func_name, insts):
+    sha1 = hashlib.sha1()
+    for text in [func_name] + insts:
+        sha1.update(text.encode() + b"\0")
+    return sha1.hexdigest()[:32]
+
+
+class FuncCache:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self.file(key))
+
+    # write a function unless it is cached, return its key
+    def store(self, func_name, insts):
+        key = function_key(func_name, insts)
+        path = self.file(key)
+        if not os.path.exists(path):
+            # written whole then renamed, a tool may look for it meanwhile
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(func_name + "\n")
+                f.writelines(sass + "\n" for sass in insts)
+            os.replace(tmp, path)
+        return key
+
+    # return the name of a cached function
+    def name(self, key):
+        with open(self.file(key)) as f:
+            return f.readline().rstrip("\n")
+
+    # return the name and the SASS of the instructions of a cached function
+    def load(self, key):
+        with open(self.file(key)) as f:
+            lines = f.read().split("\n")
+        return lines[0], lines[1:-1]
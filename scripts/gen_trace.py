@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+#
+# Generator of synthetic traces of NVbit tool "race_check_trace", so that
+# the helpers can be run and benchmarked without a GPU.
+#
+# A kernel is a grid of blocks running one access pattern:
+#   coalesced  thread i loads in[i] and stores out[i], once per SFR
+#   strided    same as coalesced with addresses i * stride
+#   reduction  shared memory tree reduction, one halving step per SFR
+#   tile       shared memory tile written by every thread and read back
+#              transposed after a barrier, two SFRs per tile
+# The patterns are race free. A number of races is planted on top of them,
+# each one on its own address with its own pair of instructions, so each one
+# is reported exactly once by race_check_helper.py (races of instructions)
+# and by race_check_helper_memaddr.py (races of addresses). Planted races
+# cycle through intra block shared, intra block global and inter block global
+# memory races.
+#
+# Warps of a few resident blocks are interleaved at random, and the warps of
+# a block wait for each other at the end of a SFR, like on a GPU.
+#
+#   gen_trace.py --pattern tile --grid 64 --block 256 --sfrs 4 --races 10 > trace.txt
+#   gen_trace.py --format memaddr ...    # 10 fields lines of race_check_helper_memaddr.py
+#   gen_trace.py --format binary ...     # binary trace, see binary_trace.py
+#   gen_trace.py --sample block --sample-rate 0.25 ...   # as race_check_trace with SAMPLE=block
+#   gen_trace.py --kernels 8 --streams 4 ...   # as race_check_trace with CONCURRENT_LAUNCHES=1
+#
+# The number of planted races of every kernel is printed to stderr.
+
+import argparse
+import random
+import sys
+
+import binary_trace
+import sampling
+
+PATTERNS = ("coalesced", "strided", "reduction", "tile")
+FORMATS = ("text", "memaddr", "binary")
+
+# planted races, in the order of the summary of the helpers
+INTRA_SHARED = 0
+INTRA_GLOBAL = 1
+INTER_GLOBAL = 2
+
+# base addresses of the arrays
+IN_BASE = 0x7f0000000000
+OUT_BASE = 0x7f1000000000
+RACE_GLOBAL_BASE = 0x7f2000000000
+SHARED_BASE = 0x7ffe00000000
+RACE_SHARED_BASE = 0x7ffe00100000
+
+LDG = "LDG.E R0, [R2] ;"
+STG = "STG.E [R4], R0 ;"
+LDS = "LDS R0, [R6] ;"
+STS = "STS [R6], R0 ;"
+
+# SASS of the instructions of every pattern, inst_id is the index
+PATTERN_SASS = {
+    "coalesced": [LDG, STG],
+    "strided": [LDG, STG],
+    "reduction": [LDG, STS, LDS, "LDS R1, [R6+0x4] ;", "STS [R6], R1 ;", STG],
+    "tile": [LDG, STS, "LDS R1, [R8] ;", "STG.E [R4], R1 ;"],
+}
+
+
+# an instruction of a warp: (is_load, is_shared_memory, inst_id, SFR_id, addrs)
+# where addrs has 32 addresses, 0 for the inactive lanes
+class KernelConfig:
+    def __init__(self, pattern="coalesced", grid=(1, 1, 1), block_size=128, sfrs=1,
+                 stride=4, races=0, seed=0):
+        if pattern not in PATTERNS:
+            raise ValueError("unknown pattern {}".format(pattern))
+        if block_size < 2 or block_size > 1024:
+            raise ValueError("block size must be between 2 and 1024")
+        if sfrs < 1:
+            raise ValueError("a kernel has at least one SFR")
+        self.pattern = pattern
+        self.grid = tuple(grid) + (1,) * (3 - len(grid))
+        self.block_size = block_size
+        self.sfrs = sfrs
+        self.stride = stride
+        self.races = races
+        self.seed = seed
+
+    @property
+    def num_blocks(self):
+        return self.grid[0] * self.grid[1] * self.grid[2]
+
+    @property
+    def num_warps(self):
+        return (self.block_size + 31) // 32
+
+    # cta_id_x, cta_id_y, cta_id_z of a linear block id
+    def cta_id(self, block_id):
+        x = block_id % self.grid[0]
+        y = block_id // self.grid[0] % self.grid[1]
+        z = block_id // (self.grid[0] * self.grid[1])
+        return x, y, z
+
+    def sass(self):
+        insts = list(PATTERN_SASS[self.pattern])
+        for race in range(self.races):
+            insts.append("STS [R10], R0 ;" if self.race_kind(race) == INTRA_SHARED else "STG.E [R10], R0 ;")
+            if race % 2 == 0:
+                insts.append("LDS R1, [R10] ;" if self.race_kind(race) == INTRA_SHARED else "LDG.E R1, [R10] ;")
+            else:
+                insts.append("STS [R10], R1 ;" if self.race_kind(race) == INTRA_SHARED else "STG.E [R10], R1 ;")
+        return insts
+
+    def race_kind(self, race):
+        kinds = (INTRA_SHARED, INTRA_GLOBAL, INTER_GLOBAL) if self.num_blocks > 1 else (INTRA_SHARED, INTRA_GLOBAL)
+        return kinds[race % len(kinds)]
+
+    # number of planted races of every kind, those with an access
+    # in a block or warp dropped by sampler are not counted
+    def expected_races(self, sampler=None):
+        counts = [0, 0, 0]
+        for kind, first, second in planted_races(self)[1]:
+            if sampler is None or (sampler.keep(*first) and sampler.keep(*second)):
+                counts[kind] += 1
+        return tuple(counts)
+
+
+# addresses of the threads of a warp, 0 for the threads out of the block
+def warp_addrs(config, warp_id, address_of):
+    first = warp_id * 32
+    return [address_of(first + lane_id) if first + lane_id < config.block_size else 0
+            for lane_id in range(32)]
+
+
+# return the program of a block, a list of SFRs where every SFR is a list of
+# the instructions of every warp
+def block_program(config, block_id):
+    bs = config.block_size
+    base = block_id * bs
+    sfrs = []
+
+    def new_sfr():
+        sfrs.append([[] for _ in range(config.num_warps)])
+        return len(sfrs) - 1
+
+    if config.pattern in ("coalesced", "strided"):
+        step = 4 * (config.stride if config.pattern == "strided" else 1)
+        for _ in range(config.sfrs):
+            SFR_id = new_sfr()
+            for warp_id, insts in enumerate(sfrs[SFR_id]):
+                insts.append((True, False, 0, SFR_id,
+                              warp_addrs(config, warp_id, lambda t: IN_BASE + step * (base + t))))
+                insts.append((False, False, 1, SFR_id,
+                              warp_addrs(config, warp_id, lambda t: OUT_BASE + step * (base + t))))
+
+    elif config.pattern == "reduction":
+        sdata = lambda t: SHARED_BASE + 4 * t
+        steps = min(config.sfrs - 1, bs.bit_length() - 1)
+        SFR_id = new_sfr()
+        for warp_id, insts in enumerate(sfrs[SFR_id]):
+            insts.append((True, False, 0, SFR_id, warp_addrs(config, warp_id, lambda t: IN_BASE + 4 * (base + t))))
+            insts.append((False, True, 1, SFR_id, warp_addrs(config, warp_id, sdata)))
+        s = bs
+        for _ in range(steps):
+            s //= 2
+            SFR_id = new_sfr()
+            for warp_id, insts in enumerate(sfrs[SFR_id]):
+                if warp_id * 32 >= s:
+                    continue # the whole warp is idle
+                active = lambda f: (lambda t: f(t) if t < s else 0)
+                insts.append((True, True, 2, SFR_id, warp_addrs(config, warp_id, active(sdata))))
+                insts.append((True, True, 3, SFR_id, warp_addrs(config, warp_id, active(lambda t: sdata(t + s)))))
+                insts.append((False, True, 4, SFR_id, warp_addrs(config, warp_id, active(sdata))))
+        # the threads left write the partial sums
+        for warp_id, insts in enumerate(sfrs[-1]):
+            if warp_id * 32 < s:
+                insts.append((False, False, 5, len(sfrs) - 1, warp_addrs(
+                    config, warp_id, lambda t: OUT_BASE + 4 * (block_id * s + t) if t < s else 0)))
+
+    elif config.pattern == "tile":
+        tile = lambda t: SHARED_BASE + 4 * t
+        for _ in range(max(1, config.sfrs // 2)):
+            SFR_id = new_sfr()
+            for warp_id, insts in enumerate(sfrs[SFR_id]):
+                insts.append((True, False, 0, SFR_id, warp_addrs(config, warp_id, lambda t: IN_BASE + 4 * (base + t))))
+                insts.append((False, True, 1, SFR_id, warp_addrs(config, warp_id, tile)))
+            SFR_id = new_sfr()
+            for warp_id, insts in enumerate(sfrs[SFR_id]):
+                insts.append((True, True, 2, SFR_id, warp_addrs(config, warp_id, lambda t: tile(bs - 1 - t))))
+                insts.append((False, False, 3, SFR_id, warp_addrs(config, warp_id, lambda t: OUT_BASE + 4 * (base + t))))
+
+    return sfrs
+
+
+# return the accesses of the planted races, a dict of block_id to a list of
+# (warp_id, instruction), all in SFR 0, and a list of the planted races
+# (kind, (block_id, warp_id) of the first access, (block_id, warp_id) of the second)
+def planted_races(config):
+    rand = random.Random(config.seed)
+    first_inst = len(PATTERN_SASS[config.pattern])
+    races = {}
+    pairs = []
+    for race in range(config.races):
+        kind = config.race_kind(race)
+        first = (False, kind == INTRA_SHARED, first_inst + 2 * race)
+        second = (race % 2 == 0, kind == INTRA_SHARED, first_inst + 2 * race + 1)
+        addr = (RACE_SHARED_BASE if kind == INTRA_SHARED else RACE_GLOBAL_BASE) + 4 * race
+
+        block_id = rand.randrange(config.num_blocks)
+        if kind == INTER_GLOBAL:
+            other_block = (block_id + rand.randrange(1, config.num_blocks)) % config.num_blocks
+        else:
+            other_block = block_id
+        threads = rand.sample(range(config.block_size), 2)
+
+        for (is_load, is_shared, inst_id), b, t in ((first, block_id, threads[0]), (second, other_block, threads[1])):
+            addrs = [0] * 32
+            addrs[t % 32] = addr
+            races.setdefault(b, []).append((t // 32, (is_load, is_shared, inst_id, 0, addrs)))
+        pairs.append((kind, (block_id, threads[0] // 32), (other_block, threads[1] // 32)))
+    return races, pairs
+
+
+# yield (block_id, warp_id, instruction) of a kernel in the order a GPU could
+# run them, with `resident` blocks running at the same time
+def schedule(config, resident=4, seed=0):
+    rand = random.Random(seed)
+    races = planted_races(config)[0]
+    next_block = 0
+    running = [] # [block_id, program, SFR_id, warps with instructions left]
+
+    while running or next_block < config.num_blocks:
+        while len(running) < resident and next_block < config.num_blocks:
+            program = block_program(config, next_block)
+            for warp_id, inst in races.get(next_block, ()):
+                program[0][warp_id].append(inst)
+            running.append([next_block, program, -1, []])
+            next_block += 1
+
+        i = rand.randrange(len(running))
+        block = running[i]
+        block_id, program, SFR_id, warps = block
+        while not warps:
+            # all the warps reached the barrier, go on with the next SFR
+            SFR_id += 1
+            if SFR_id == len(program):
+                break
+            warps = [[warp_id, insts, 0] for warp_id, insts in enumerate(program[SFR_id]) if insts]
+            block[2] = SFR_id
+            block[3] = warps
+        if not warps:
+            running[i] = running[-1]
+            running.pop()
+            continue
+
+        w = rand.randrange(len(warps))
+        warp = warps[w]
+        warp_id, insts, pc = warp
+        yield block_id, warp_id, insts[pc]
+        if pc + 1 == len(insts):
+            warps[w] = warps[-1]
+            warps.pop()
+        else:
+            warp[2] = pc + 1
+
+
+class TextWriter:
+    def __init__(self, stream, fields=8):
+        self.stream = stream
+        self.fields = fields
+        self.num_funcs = 0
+        self.num_accesses = 0
+        self.launch_id = None # launch of the last accesses written
+
+    # the accesses that follow are those of launch_id,
+    # the line is only written when the launch changes
+    def write_launch(self, launch_id):
+        if launch_id != self.launch_id:
+            self.stream.write("\n#launch#{}\n".format(launch_id))
+            self.launch_id = launch_id
+
+    def write_function(self, func_name, insts):
+        write = self.stream.write
+        write("\n#func_begin#{}\n".format(func_name))
+        for sass in insts:
+            write("\n#SASS#{}\n".format(sass))
+        write("\n#func_end#\n")
+        self.num_funcs += 1
+
+    def write_accesses(self, config, func_id, accesses):
+        lines = []
+        append = lines.append
+        for block_id, warp_id, (is_load, is_shared, inst_id, SFR_id, addrs) in accesses:
+            kind = "#ld#" if is_load else "#st#"
+            if self.fields == 8:
+                prefix = "\n{}{},{},{},".format(kind, int(is_shared), block_id, warp_id)
+            else:
+                prefix = "\n{}{},{},{},{},{},".format(kind, int(is_shared), *config.cta_id(block_id), warp_id)
+            suffix = ",{},{},{},".format(func_id, inst_id, SFR_id)
+            for lane_id, addr in enumerate(addrs):
+                if addr:
+                    append("{}{}{}0x{:016x}\n".format(prefix, lane_id, suffix, addr))
+        self.num_accesses += len(lines)
+        self.stream.write("".join(lines))
+
+    def write_kernel_end(self, launch_id=None):
+        self.stream.write("\n#kernelends#{}\n".format("" if launch_id is None else launch_id))
+        self.launch_id = None
+
+    def write_sample(self, sampler):
+        self.stream.write("\n#sample#{}\n".format(sampler.to_line()))
+
+
+class BinaryWriter:
+    def __init__(self, stream):
+        self.writer = binary_trace.TraceWriter(stream)
+        self.num_accesses = 0
+        self.launch_id = None # launch of the last accesses written
+
+    @property
+    def num_funcs(self):
+        return self.writer.num_funcs
+
+    def write_function(self, func_name, insts):
+        self.writer.write_function(func_name, insts)
+
+    def write_accesses(self, config, func_id, accesses):
+        self.num_accesses += sum(32 - inst[4].count(0) for _, _, inst in accesses)
+        self.writer.write_accesses((block_id, warp_id, 0, func_id, inst_id, int(is_shared), int(is_load), SFR_id, addrs)
+                                   for block_id, warp_id, (is_load, is_shared, inst_id, SFR_id, addrs) in accesses)
+
+    def write_launch(self, launch_id):
+        if launch_id != self.launch_id:
+            self.writer.write_launch(launch_id)
+            self.launch_id = launch_id
+
+    def write_kernel_end(self, launch_id=None):
+        self.writer.write_kernel_end(launch_id)
+        self.launch_id = None
+
+    def write_sample(self, sampler):
+        self.writer.write_sample(sampler.mode, sampler.threshold, sampler.seed, sampler.block_begin, sampler.block_end)
+
+
+# write `kernels` launches of config to writer (TextWriter or BinaryWriter),
+# return the planted races of every kernel (intra shared, intra global, inter global).
+# With a sampling.Sampler, only the blocks or warps it keeps are written,
+# as race_check_trace does with SAMPLE=block|warp.
+# With streams > 1, launches run `streams` at a time and their accesses are
+# interleaved in batches of random size, with launch ids (from 1) as
+# race_check_trace writes them with CONCURRENT_LAUNCHES=1
+def generate(writer, config, kernels=1, resident=4, batch=4096, sampler=None, streams=1):
+    if sampler is not None:
+        writer.write_sample(sampler)
+    func_id = writer.num_funcs
+    writer.write_function("{}_kernel(float*, float*)".format(config.pattern), config.sass())
+    expected = [config.expected_races(sampler) for kernel in range(kernels)]
+    if streams > 1:
+        generate_concurrent(writer, config, func_id, kernels, resident, batch, sampler, streams)
+        return expected
+    for kernel in range(kernels):
+        accesses = []
+        for access in schedule(config, resident, config.seed + kernel):
+            if sampler is not None and not sampler.keep(access[0], access[1]):
+                continue
+            accesses.append(access)
+            if len(accesses) == batch:
+                writer.write_accesses(config, func_id, accesses)
+                accesses = []
+        writer.write_accesses(config, func_id, accesses)
+        writer.write_kernel_end()
+    return expected
+
+
+def generate_concurrent(writer, config, func_id, kernels, resident, batch, sampler, streams):
+    rand = random.Random(config.seed)
+    running = [] # [launch id, schedule]
+    next_kernel = 0
+    while running or next_kernel < kernels:
+        while len(running) < streams and next_kernel < kernels:
+            running.append([next_kernel + 1, schedule(config, resident, config.seed + next_kernel)])
+            next_kernel += 1
+
+        i = rand.randrange(len(running))
+        launch_id, accesses = running[i]
+        part = []
+        for access in accesses:
+            if sampler is not None and not sampler.keep(access[0], access[1]):
+                continue
+            part.append(access)
+            if len(part) == batch or rand.random() < 1 / 64:
+                break
+        else:
+            # the launch has no accesses left
+            if part:
+                writer.write_launch(launch_id)
+                writer.write_accesses(config, func_id, part)
+            writer.write_kernel_end(launch_id)
+            running[i] = running[-1]
+            running.pop()
+            continue
+        writer.write_launch(launch_id)
+        writer.write_accesses(config, func_id, part)
+
+
+def parse_dims(text):
+    dims = tuple(int(d) for d in text.split(","))
+    if not 1 <= len(dims) <= 3 or min(dims) < 1:
+        raise argparse.ArgumentTypeError("expected X[,Y[,Z]]")
+    return dims
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic race_check_trace trace with planted races.")
+    parser.add_argument("--pattern", choices=PATTERNS, default="coalesced")
+    parser.add_argument("--grid", type=parse_dims, default=(16,), help="number of blocks, X[,Y[,Z]]")
+    parser.add_argument("--block", type=int, default=128, help="number of threads per block")
+    parser.add_argument("--sfrs", type=int, default=2, help="number of SFRs per block")
+    parser.add_argument("--stride", type=int, default=4, help="stride of the strided pattern, in elements")
+    parser.add_argument("--races", type=int, default=0, help="number of races planted in every kernel")
+    parser.add_argument("--kernels", type=int, default=1, help="number of kernel launches")
+    parser.add_argument("--resident", type=int, default=4, help="number of blocks running at the same time")
+    parser.add_argument("--streams", type=int, default=1,
+                        help="number of launches running at the same time, their accesses are interleaved")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample", choices=sorted(sampling.MODES),
+                        help="keep only a sample of the blocks or warps, as race_check_trace with SAMPLE=block|warp")
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument("--format", choices=FORMATS, default="text")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.streams < 1:
+        parser.error("--streams must be at least 1")
+
+    try:
+        config = KernelConfig(args.pattern, args.grid, args.block, args.sfrs, args.stride, args.races, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.format == "binary":
+        stream = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        writer = BinaryWriter(stream)
+    else:
+        stream = sys.stdout if args.output == "-" else open(args.output, "w")
+        writer = TextWriter(stream, 8 if args.format == "text" else 10)
+
+    sampler = None
+    if args.sample:
+        sampler = sampling.Sampler(sampling.MODES[args.sample], args.sample_rate, args.sample_seed)
+
+    expected = generate(writer, config, args.kernels, args.resident, sampler=sampler, streams=args.streams)
+    stream.flush()
+    if stream not in (sys.stdout, sys.stdout.buffer):
+        stream.close()
+
+    for kernel, counts in enumerate(expected):
+        print("kernel {}: {} intra block shared, {} intra block global, {} inter block global races planted".format(
+            kernel + 1, *counts), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Metrics of race_check_helper.py (--metrics FILE), written as JSON lines.
+#
+# One object is written for every kernel checked:
+#   kernel               id of the kernel in the race report
+#   accesses             accesses read (one per lane)
+#   parse_seconds        time parsing the lines of the accesses of the kernel,
+#                        not counting the time waiting for the trace (0 for a
+#                        binary trace, its records are decoded as they are added)
+#   ingest_seconds       time adding the accesses to the shadow memory
+#   check_seconds        time finding the races once the kernel ended
+#   report_seconds       time printing the report
+#   accesses_per_second  accesses / (parse_seconds + ingest_seconds)
+#   races                races reported
+#   memoized             the launch was not checked again (--memoize)
+#   peak_rss_kib         peak resident memory of the process so far
+#   shadow               what the shadow memory tracked (SFRs, distinct
+#                        addresses, ...), the fields depend on the engine
+# and a last object with "total": true and the totals of the run.
+#
+# Nothing is measured when --metrics is not given, race_check_helper.py
+# only checks whether the KernelMetrics of the kernel is None.
+
+import json
+import os
+import resource
+import sys
+import time
+
+
+def peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class KernelMetrics:
+    def __init__(self):
+        self.accesses = 0
+        self.parse_seconds = 0.0
+        self.ingest_seconds = 0.0
+        self.check_seconds = 0.0
+        self.report_seconds = 0.0
+
+    def parsed(self, seconds):
+        self.parse_seconds += seconds
+
+    def ingested(self, accesses, seconds):
+        self.accesses += accesses
+        self.ingest_seconds += seconds
+
+
+class MetricsWriter:
+    # path '-' writes to stderr, state is the state of the writer of an
+    # earlier run resumed from a checkpoint, the file is appended to from
+    # where it was at the checkpoint
+    def __init__(self, path, state=None):
+        if path != "-" and state and state["size"] is not None and os.path.exists(path):
+            os.truncate(path, state["size"])
+        self.file = sys.stderr if path == "-" else open(path, "a" if state else "w")
+        self.start = time.perf_counter()
+        self.kernels = 0
+        self.accesses = 0
+        self.races = 0
+        if state:
+            self.start -= state["seconds"]
+            self.kernels = state["kernels"]
+            self.accesses = state["accesses"]
+            self.races = state["races"]
+
+    # totals so far, for a checkpoint
+    def state(self):
+        return {"seconds": time.perf_counter() - self.start, "kernels": self.kernels,
+                "accesses": self.accesses, "races": self.races,
+                "size": None if self.file is sys.stderr else self.file.tell()}
+
+    def write(self, kernel_id, kernel_metrics, races, memoized, shadow_stats):
+        read_seconds = kernel_metrics.parse_seconds + kernel_metrics.ingest_seconds
+        self.kernels += 1
+        self.accesses += kernel_metrics.accesses
+        self.races += races
+        self.dump({
+            "kernel": kernel_id,
+            "accesses": kernel_metrics.accesses,
+            "parse_seconds": round(kernel_metrics.parse_seconds, 6),
+            "ingest_seconds": round(kernel_metrics.ingest_seconds, 6),
+            "check_seconds": round(kernel_metrics.check_seconds, 6),
+            "report_seconds": round(kernel_metrics.report_seconds, 6),
+            "accesses_per_second": round(kernel_metrics.accesses / read_seconds) if read_seconds else None,
+            "races": races,
+            "memoized": memoized,
+            "peak_rss_kib": peak_rss_kib(),
+            "shadow": shadow_stats,
+        })
+
+    def close(self):
+        seconds = time.perf_counter() - self.start
+        self.dump({
+            "total": True,
+            "kernels": self.kernels,
+            "accesses": self.accesses,
+            "races": self.races,
+            "seconds": round(seconds, 6),
+            "accesses_per_second": round(self.accesses / seconds) if seconds else None,
+            "peak_rss_kib": peak_rss_kib(),
+        })
+        if self.file is not sys.stderr:
+            self.file.close()
+
+    def dump(self, obj):
+        self.file.write(json.dumps(obj) + "\n")
+        self.file.flush()
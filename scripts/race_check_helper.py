@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 #
-# The script will read stdin 
+# The script will read stdin
 # (which should be output of NVbit tool "race_check_trace").
-# And it will grep load and store. 
+# And it will grep load and store.
 # Will check if there are conflicting memory accesses (data races)
 # A warning will be printed
 #
@@ -12,15 +12,127 @@
 #
 # Yineng Yan (yinengy@umich.edu), 2020
 
+import argparse
+import array
+import collections
+import contextlib
+import functools
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
 import sys
+import tempfile
+import threading
+import time
 
-kernel_counter = 0
+import access_filter as filters
+import checkpoint
+import func_cache as func_caches
+import metrics
+import sampling
+from sizes import parse_size
+import trace_capture
+import trace_parser
+
+kernel_counter = 0 # kernels checked
+kernels_ended = 0 # kernels read, ahead of kernel_counter in pipelined mode
+# ids of the kernel launches replayed from a capture (--capture), in order.
+# None if the kernels are numbered as they are read
+kernel_ids = None
 
 functions = []
 
+# writes a checkpoint every few kernels (--checkpoint), None if there are no checkpoints
+checkpointer = None
+
+# cache of the function tables shared with race_check_trace (--func-cache,
+# FUNC_CACHE), None if there is none. See func_cache.py
+func_cache = None
+
 OUTPUT_ID_ONLY = True
 OUTPUT_VERBOSE = True
 
+# reports printed when a kernel ends (--report): races of instructions,
+# and races of addresses with the threads accessing them (the report of
+# race_check_helper_memaddr.py). Both come from the same shadow memory
+REPORT_INSTS = True
+REPORT_ADDRS = False
+
+# print races as soon as they are found (--online)
+ONLINE_REPORT = False
+# drop the state of a SFR when its block moves to the next SFR (--drop-closed-sfr)
+DROP_CLOSED_SFR = False
+
+# engine finding races: "dict" (shadow memory updated as accesses arrive),
+# "numpy" (accesses are stored in columns and sorted when the kernel ends)
+# or "ranges" (warp accesses are stored as strided address ranges, only the
+# ranges overlapping another one are expanded when the kernel ends)
+ENGINE = "dict"
+
+# number of worker processes analysing shards of the addresses (--jobs)
+JOBS = 1
+# pool of the worker processes, started by main() if JOBS > 1
+shard_pool = None
+
+# check and report a kernel in the background while the next one is read (--pipeline)
+PIPELINE = False
+# max number of finished kernels waiting to be checked in pipelined mode
+PIPELINE_DEPTH = 2
+# thread checking finished kernels, started by main() if PIPELINE is set
+kernel_pipeline = None
+# held while a report is printed, so online reports of the kernel being
+# read are not printed in the middle of the report of a finished kernel
+print_lock = threading.Lock()
+
+# memory budget of the accesses of a kernel in bytes, 0 means no budget (--max-memory).
+# Accesses beyond the budget are spilled to temporary files in SPILL_DIR
+# (default: the system temporary directory)
+MAX_MEMORY = 0
+SPILL_DIR = None
+
+# sampling.Sampler of the blocks or warps analysed, None means all (--sample)
+sampler = None
+# sampling done by race_check_trace, read from the trace
+trace_sampler = None
+
+# access_filter.AccessFilter of the accesses checked, None means all
+# (--function, --func-ids, --inst-ids, --space, --addrs), the parser applies it
+access_filter = None
+
+# number of kernel launches remembered to skip the analysis of launches with
+# the same accesses as an earlier one, 0 means no memoization (--memoize)
+MEMO_CACHE_SIZE = 0
+# launches remembered, created by main() if MEMO_CACHE_SIZE is set
+launch_cache = None
+
+# writer of the metrics of every kernel (--metrics), None means nothing is measured
+metrics_writer = None
+
+# number of worker processes checking whole kernels of a trace file or a
+# capture in parallel (--kernel-jobs)
+KERNEL_JOBS = 1
+# in a kernel worker, the KernelTraceFile or KernelCapture the kernels are read from
+kernel_source = None
+# in a kernel worker, whether the metrics of the kernels are measured
+measure_kernels = False
+
+# max number of launches read at the same time in a trace of concurrent
+# launches (--max-launches), every launch in flight has its own shadow memory
+MAX_LAUNCHES = 64
+
+# max number of instructions kept per address (--max-insts-per-address, 0 means
+# no cap), instructions beyond the cap are not listed in the race report
+MAX_INSTS_PER_ADDRESS = 256
+
+# the trace cannot be checked with the options given
+class TraceError(Exception):
+    pass
+
+
 class bcolors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
@@ -32,21 +144,166 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
+# kinds of races, index into RACE_KINDS
+INTRA_SHARED = 0
+INTRA_GLOBAL = 1
+INTER_GLOBAL = 2
+RACE_KINDS = ("intra block shared memory", "intra block global memory", "inter block global memory")
+# index of the races of addresses in the tuple returned by find_races of the shadow memories
+ADDRESS_RACES = 3
+
+
+# identities are packed into plain ints so the shadow memory does not
+# allocate a Python object per access:
+#   thread      = warp_id << 5 | lane_id   (unique inside a block)
+#   SFR         = block_id << 32 | SFR_id
+#   instruction = func_id << 32 | inst_id
+# addresses are the parsed integer value of the hex string
+def pack_thread(warp_id, lane_id):
+    return (warp_id << 5) | lane_id
+
+
+def pack_SFR(block_id, SFR_id):
+    return (block_id << 32) | SFR_id
+
+
+def pack_inst(func_id, inst_id):
+    return (func_id << 32) | inst_id
+
+
+def unpack_inst(inst):
+    return inst >> 32, inst & 0xffffffff
+
+
+# id of the nth kernel read, as printed in the reports
+def kernel_id_of(n):
+    if kernel_ids is None:
+        return n
+    return kernel_ids[n - 1]
+
+
+# frozenset of the packed threads of a bitmask of threads
+def threads_of(mask):
+    threads = []
+    while mask:
+        low = mask & -mask
+        threads.append(low.bit_length() - 1)
+        mask ^= low
+    return frozenset(threads)
+
+
+def format_thread(t):
+    return "({} {})".format(t >> 5, t & 31)
+
+
+# blocks of 10 fields traces are printed as (cta_id_x cta_id_y cta_id_z)
+def format_block(block_id):
+    if block_id < len(trace_parser.block_cta_ids):
+        return "({} {} {})".format(*trace_parser.block_cta_ids[block_id])
+    return str(block_id)
+
+
+# order of the blocks in reports. Blocks of 10 fields traces are numbered
+# in order of appearance, which depends on the process reading them
+# (--kernel-jobs), they are ordered as their linear block id instead
+def block_order(block_id):
+    if block_id < len(trace_parser.block_cta_ids):
+        x, y, z = trace_parser.block_cta_ids[block_id]
+        return z, y, x
+    return (block_id,)
+
+
+# summary state of an address, the race decision is made as accesses arrive.
+# It is a race if there are more than one writer, or one writer and
+# a reader that is not the writer, so the first writer/reader and
+# whether a second distinct reader was seen is all that has to be kept.
+# The instructions of the first writer/readers are kept to report the pair
+# of conflicting instructions in online mode
 class Address:
+    __slots__ = ('writer', 'writer_inst', 'reader', 'reader_inst',
+                 'multi_reader', 'foreign_reader_inst', 'racy', 'insts')
+
     def __init__(self):
-        self.load = set() # set of Thread(or Block for inter block races) that read from this address
-        self.store = set() # set of Thread(or Block for inter block races) that write to this address
-        self.insts = set() # set of Inst wrt to Thread in self.load and self.store
+        self.writer = None # first packed thread (or block id for inter block races) that write to this address
+        self.writer_inst = None
+        self.reader = None # first packed thread (or block id for inter block races) that read from this address
+        self.reader_inst = None
+        self.multi_reader = False # a reader other than self.reader has been seen
+        self.foreign_reader_inst = None # instruction of that reader
+        self.racy = False # another writer, or a reader other than the writer has been seen
+        self.insts = set() # packed instructions that access this address
+
+    def add_inst(self, inst):
+        if MAX_INSTS_PER_ADDRESS and len(self.insts) >= MAX_INSTS_PER_ADDRESS:
+            return
+        self.insts.add(inst)
+
+    # the access methods return the conflicting instruction
+    # when the address just becomes racy, otherwise None
+    def load_from(self, t, inst):
+        self.add_inst(inst)
+        if self.racy:
+            return None
+        if self.reader is None:
+            self.reader = t
+            self.reader_inst = inst
+        elif self.reader != t and not self.multi_reader:
+            self.multi_reader = True
+            self.foreign_reader_inst = inst
+        if self.writer is not None and (self.multi_reader or self.reader != self.writer):
+            self.racy = True
+            return self.writer_inst
+        return None
+
+    def store_from(self, t, inst):
+        self.add_inst(inst)
+        if self.racy:
+            return None
+        if self.writer is None:
+            self.writer = t
+            self.writer_inst = inst
+        elif self.writer != t: # multiple writers
+            self.racy = True
+            return self.writer_inst
+        else:
+            return None
+        if self.reader is not None and (self.multi_reader or self.reader != t):
+            self.racy = True
+            return self.reader_inst if self.reader != t else self.foreign_reader_inst
+        return None
+
+
+# Address that also keeps all the threads accessing it, for the races of
+# addresses. load and store are bitmasks of packed threads, bit t is set
+# if thread t accessed the address (see threads_of)
+class ThreadAddress(Address):
+    __slots__ = ('load', 'store')
+
+    def __init__(self):
+        Address.__init__(self)
+        self.load = 0
+        self.store = 0
+
+
+# same as ThreadAddress for inter block races,
+# load and store are dicts of block id : bitmask of packed threads
+class BlockAddress(Address):
+    __slots__ = ('load', 'store')
+
+    def __init__(self):
+        Address.__init__(self)
+        self.load = {}
+        self.store = {}
 
 
 class instruction:
     def __init__(self, func_id, inst_id):
         self.func_id = func_id
         self.inst_id = inst_id
-    
+
     def __hash__(self):
         return hash((self.func_id, self.inst_id))
-    
+
     def __eq__(self, other):
         return self.func_id == other.func_id and \
         self.inst_id == other.inst_id
@@ -57,249 +314,1704 @@ class instruction:
         if (OUTPUT_ID_ONLY):
             return "{},{}".format(self.func_id, self.inst_id)
         else:
-            return "at {}, {}".format(func.func_name, func.insts[self.inst_id][:-2])
+            return "at {}, {}".format(func.func_name, func.sass(self.inst_id)[:-2])
 
-# Thread in a block
-class Thread:
-    def __init__(self, warp_id, lane_id):
-        self.warp_id = warp_id
-        self.lane_id = lane_id
 
-    def __hash__(self):
-         return hash((self.warp_id, self.lane_id))
-    
-    def __eq__(self, other):
-        return self.warp_id == other.warp_id and \
-        self.lane_id == other.lane_id
+class Function:
+    # a function of the function cache has a key, its insts
+    # are read from the cache when an instruction is reported
+    def __init__(self, func_name, key=None):
+        self.func_name = func_name
+        self.key = key
+        self.insts = [] if key is None else None
 
-    def __str__(self):
-        # (warp ID, lane ID)
-        return "({} {})".format(self.warp_id, self.lane_id)
+    def sass(self, inst_id):
+        if self.insts is None:
+            self.insts = func_cache.load(self.key)[1]
+        return self.insts[inst_id]
 
+    # the whole function has been read, it is written to the function
+    # cache and its insts are dropped until they are reported
+    def cache(self):
+        if func_cache is not None and self.key is None:
+            self.key = func_cache.store(self.func_name, self.insts)
+            self.insts = None
 
-# SFR in a block
-class SFR:
-    def __init__(self, block_id, SFR_id):
-        self.block_id = block_id
-        self.SFR_id = SFR_id
 
-    def __hash__(self):
-         return hash((self.block_id, self.SFR_id))
-    
-    def __eq__(self, other):
-        return self.block_id == other.block_id and \
-        self.SFR_id == other.SFR_id
+class ShadowMemory:
+    # on_race(kind, where, addr, inst, other_inst) is called when an address
+    # becomes racy, where is the packed SFR for intra block races and
+    # the block id for inter block races.
+    # if drop_closed_SFR is set, the state of a SFR is dropped once
+    # the SFR_id of its block moves forward, only its races are kept.
+    # if track_threads is set, the threads accessing every address are kept
+    # for the races of addresses
+    def __init__(self, on_race=None, drop_closed_SFR=False, track_threads=False):
+        self.SFR_shared_mem = {} # key: packed SFR, val: shared_mem (a dic of addr : Address (tracks packed threads))
+        self.SFR_global_mem = {} # key: packed SFR, val: global_mem (a dic of addr : Address (tracks packed threads))
 
-    def __str__(self):
-        # "Block_id: block_id, SFR_id: SFR ID"
-        return "Block_id: ({}), SFR_id: {}".format(self.block_id, self.SFR_id)
+        self.GLOBAL_mem = {} # key: addr, val: Address (tracks block ids)
 
+        self.on_race = on_race
+        self.drop_closed_SFR = drop_closed_SFR
+        self.block_SFR = {} # key: block id, val: SFR_id currently open
+        self.closed_shared_races = set() # races found in dropped SFRs
+        self.closed_global_races = set()
+        self.closed_address_races = set()
 
-class Block:
-    def __init__(self, block_id):
-        self.block_id = block_id
+        self.track_threads = track_threads
+        self.new_address = ThreadAddress if track_threads else Address
+        self.new_block_address = BlockAddress if track_threads else Address
 
-    def __hash__(self):
-         return hash((self.block_id))
-    
-    def __eq__(self, other):
-        return self.block_id == other.block_id
+    def close_SFR(self, s):
+        shared_mem = self.SFR_shared_mem.pop(s, None)
+        if shared_mem is not None:
+            collect_races(shared_mem, self.closed_shared_races)
+            if self.track_threads:
+                collect_address_races(shared_mem, INTRA_SHARED, s, self.closed_address_races)
+        global_mem = self.SFR_global_mem.pop(s, None)
+        if global_mem is not None:
+            collect_races(global_mem, self.closed_global_races)
+            if self.track_threads:
+                collect_address_races(global_mem, INTRA_GLOBAL, s, self.closed_address_races)
 
-    def __str__(self):
-        # (block_id)
-        return "({})".format(self.block_id)
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        t = (warp_id << 5) | lane_id
+        s = (block_id << 32) | SFR_id
+        inst = (func_id << 32) | inst_id
 
+        if self.drop_closed_SFR:
+            open_SFR = self.block_SFR.get(block_id)
+            if open_SFR is None or SFR_id > open_SFR:
+                if open_SFR is not None:
+                    self.close_SFR((block_id << 32) | open_SFR)
+                self.block_SFR[block_id] = SFR_id
 
-class Function:
-    def __init__(self, func_name):
-        self.func_name = func_name
-        self.insts = []
+        if is_shared_memory:
+            shared_mem = self.SFR_shared_mem.get(s)
+            if shared_mem is None:
+                shared_mem = self.SFR_shared_mem[s] = {}
+
+            a = shared_mem.get(addr)
+            if a is None:
+                a = shared_mem[addr] = self.new_address()
+            if is_load:
+                other = a.load_from(t, inst)
+                if self.track_threads:
+                    a.load |= 1 << t
+            else:
+                other = a.store_from(t, inst)
+                if self.track_threads:
+                    a.store |= 1 << t
+            if other is not None and self.on_race is not None:
+                self.on_race(INTRA_SHARED, s, addr, inst, other)
+            return
+
+        # intra block
+        global_mem = self.SFR_global_mem.get(s)
+        if global_mem is None:
+            global_mem = self.SFR_global_mem[s] = {}
+
+        a = global_mem.get(addr)
+        if a is None:
+            a = global_mem[addr] = self.new_address()
+        if is_load:
+            other = a.load_from(t, inst)
+            if self.track_threads:
+                a.load |= 1 << t
+        else:
+            other = a.store_from(t, inst)
+            if self.track_threads:
+                a.store |= 1 << t
+        if other is not None and self.on_race is not None:
+            self.on_race(INTRA_GLOBAL, s, addr, inst, other)
+
+        # inter block, add block rather than thread
+        a = self.GLOBAL_mem.get(addr)
+        if a is None:
+            a = self.GLOBAL_mem[addr] = self.new_block_address()
+        if is_load:
+            other = a.load_from(block_id, inst)
+        else:
+            other = a.store_from(block_id, inst)
+        if self.track_threads:
+            threads = a.load if is_load else a.store
+            threads[block_id] = threads.get(block_id, 0) | (1 << t)
+        if other is not None and self.on_race is not None:
+            self.on_race(INTER_GLOBAL, block_id, addr, inst, other)
+
+    # add the accesses of a warp instruction, addrs has the address of every
+    # lane, 0 for lanes that are inactive (it is the lane mask of mem_access_t).
+    # Lanes are deduplicated by address first, the first two distinct threads
+    # accessing an address bring it to the same state as all of them would,
+    # and for inter block races all lanes are the same block
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        s = (block_id << 32) | SFR_id
+        inst = (func_id << 32) | inst_id
+        warp = warp_id << 5
+        access = Address.load_from if is_load else Address.store_from
+        on_race = self.on_race
+
+        if self.drop_closed_SFR:
+            open_SFR = self.block_SFR.get(block_id)
+            if open_SFR is None or SFR_id > open_SFR:
+                if open_SFR is not None:
+                    self.close_SFR((block_id << 32) | open_SFR)
+                self.block_SFR[block_id] = SFR_id
+
+        first_lane = {} # key: addr, val: first lane accessing it
+        second_lane = {} # key: addr, val: second lane accessing it
+        for lane_id, addr in enumerate(addrs):
+            if addr == 0:
+                continue
+            if addr not in first_lane:
+                first_lane[addr] = lane_id
+            elif addr not in second_lane:
+                second_lane[addr] = lane_id
+
+        if is_shared_memory:
+            kind = INTRA_SHARED
+            SFR_mem = self.SFR_shared_mem
+        else:
+            kind = INTRA_GLOBAL
+            SFR_mem = self.SFR_global_mem
+        mem = SFR_mem.get(s)
+        if mem is None:
+            mem = SFR_mem[s] = {}
+
+        new_address = self.new_address
+        for addr, lane_id in first_lane.items():
+            a = mem.get(addr)
+            if a is None:
+                a = mem[addr] = new_address()
+            other = access(a, warp | lane_id, inst)
+            if second_lane and addr in second_lane:
+                other_second = access(a, warp | second_lane[addr], inst)
+                if other is None:
+                    other = other_second
+            if other is not None and on_race is not None:
+                on_race(kind, s, addr, inst, other)
+
+        if self.track_threads:
+            # all the lanes, not only the first two of each address,
+            # as a bitmask of the lanes of the warp per address
+            lane_masks = {}
+            for lane_id, addr in enumerate(addrs):
+                if addr != 0:
+                    lane_masks[addr] = lane_masks.get(addr, 0) | (1 << lane_id)
+            for addr, lanes in lane_masks.items():
+                a = mem[addr]
+                if is_load:
+                    a.load |= lanes << warp
+                else:
+                    a.store |= lanes << warp
+
+        if is_shared_memory:
+            return
+
+        # inter block, add block rather than thread
+        GLOBAL_mem = self.GLOBAL_mem
+        new_block_address = self.new_block_address
+        for addr in first_lane:
+            a = GLOBAL_mem.get(addr)
+            if a is None:
+                a = GLOBAL_mem[addr] = new_block_address()
+            other = access(a, block_id, inst)
+            if other is not None and on_race is not None:
+                on_race(INTER_GLOBAL, block_id, addr, inst, other)
+
+        if self.track_threads:
+            for addr, lanes in lane_masks.items():
+                threads = GLOBAL_mem[addr].load if is_load else GLOBAL_mem[addr].store
+                threads[block_id] = threads.get(block_id, 0) | (lanes << warp)
+
+    # return the races of instructions of the three kinds and the races of addresses
+    def find_races(self):
+        intra_shared_races, intra_global_races, inter_global_races = \
+            find_races(self.SFR_shared_mem, self.SFR_global_mem, self.GLOBAL_mem)
+        intra_shared_races |= self.closed_shared_races
+        intra_global_races |= self.closed_global_races
+
+        address_races = self.closed_address_races
+        if self.track_threads:
+            for s, shared_mem in self.SFR_shared_mem.items():
+                collect_address_races(shared_mem, INTRA_SHARED, s, address_races)
+            for s, global_mem in self.SFR_global_mem.items():
+                collect_address_races(global_mem, INTRA_GLOBAL, s, address_races)
+            collect_inter_address_races(self.GLOBAL_mem, address_races)
+
+        return intra_shared_races, intra_global_races, inter_global_races, address_races
+
+    # number of SFRs and of distinct addresses tracked, for the metrics
+    def stats(self):
+        return {
+            "sfrs": len(self.SFR_shared_mem.keys() | self.SFR_global_mem.keys()),
+            "shared_addresses": sum(len(mem) for mem in self.SFR_shared_mem.values()),
+            "global_addresses": sum(len(mem) for mem in self.SFR_global_mem.values()),
+            "inter_block_addresses": len(self.GLOBAL_mem),
+        }
+
+
+# an access is sent to shard (addr >> SHARD_SHIFT) % JOBS, all the accesses
+# to an address go to the same shard so each worker can find its races alone.
+# Accesses are sent in batches of warp records of RECORD_SIZE words:
+# is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id
+# and 32 addresses (0 for lanes of other shards)
+SHARD_SHIFT = 7
+RECORD_SIZE = 7 + 32
+BATCH_SIZE = RECORD_SIZE * 1024
+# messages to the workers other than batches, they are shorter than a record
+KERNEL_END_MESSAGE = b""
+EXIT_MESSAGE = b"\0"
+
+
+def shard_worker(conn, config):
+    globals().update(config)
+
+    shadow = new_shadow_memory()
+    while True:
+        data = conn.recv_bytes()
+        if data == EXIT_MESSAGE:
+            return
+        if data == KERNEL_END_MESSAGE:
+            conn.send(shadow.find_races())
+            shadow = new_shadow_memory()
+            continue
+        records = array.array('Q')
+        records.frombytes(data)
+        add_warp = shadow.add_warp
+        for i in range(0, len(records), RECORD_SIZE):
+            add_warp(*records[i:i + 7], records[i + 7:i + RECORD_SIZE])
+
+
+class ShardPool:
+    def __init__(self, jobs):
+        # the worker analyses a shard the way a serial run would
+        config = {"ENGINE": ENGINE, "DROP_CLOSED_SFR": DROP_CLOSED_SFR,
+                  "MAX_INSTS_PER_ADDRESS": MAX_INSTS_PER_ADDRESS,
+                  "MAX_MEMORY": MAX_MEMORY // jobs, "SPILL_DIR": SPILL_DIR,
+                  "REPORT_ADDRS": REPORT_ADDRS, "MEMO_CACHE_SIZE": 0, "sampler": None,
+                  "ONLINE_REPORT": False, "JOBS": 1}
+        self.conns = []
+        self.workers = []
+        for i in range(jobs):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_worker, args=(worker_conn, config), daemon=True)
+            worker.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def send(self, shard, records):
+        self.conns[shard].send_bytes(records)
+
+    # signal the kernel ends
+    def end_kernel(self):
+        for conn in self.conns:
+            conn.send_bytes(KERNEL_END_MESSAGE)
+
+    # return the races found by every worker in the kernel that ended first
+    def results(self):
+        return [conn.recv() for conn in self.conns]
+
+    def close(self):
+        # workers inherit the connections of each other, so they are told
+        # to exit rather than waiting for the connection to be closed
+        for conn in self.conns:
+            conn.send_bytes(EXIT_MESSAGE)
+            conn.close()
+        for worker in self.workers:
+            worker.join()
+
+
+# shadow memory whose accesses are analysed by the workers of a ShardPool
+class ShardedShadowMemory:
+    def __init__(self, pool):
+        self.pool = pool
+        self.jobs = len(pool.conns)
+        self.buffers = [array.array('Q') for i in range(self.jobs)]
+        self.ended = False
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        addrs = [0] * 32
+        addrs[lane_id] = addr
+        self.add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        jobs = self.jobs
+        header = (int(is_load), int(is_shared_memory), block_id, warp_id, func_id, inst_id, SFR_id)
+
+        # usually all the lanes of a warp go to the same shard
+        shards = {(addr >> SHARD_SHIFT) % jobs for addr in addrs if addr}
+        if len(shards) == 1:
+            shard = shards.pop()
+            buffer = self.buffers[shard]
+            buffer.extend(header)
+            buffer.extend(addrs)
+            if len(buffer) >= BATCH_SIZE:
+                self.pool.send(shard, buffer)
+                self.buffers[shard] = array.array('Q')
+            return
+
+        shard_addrs = {} # key: shard, val: addresses of the lanes of the shard
+        for lane_id, addr in enumerate(addrs):
+            if addr == 0:
+                continue
+            shard = (addr >> SHARD_SHIFT) % jobs
+            lane_addrs = shard_addrs.get(shard)
+            if lane_addrs is None:
+                lane_addrs = shard_addrs[shard] = [0] * 32
+            lane_addrs[lane_id] = addr
+
+        for shard, lane_addrs in shard_addrs.items():
+            buffer = self.buffers[shard]
+            buffer.extend(header)
+            buffer.extend(lane_addrs)
+            if len(buffer) >= BATCH_SIZE:
+                self.pool.send(shard, buffer)
+                self.buffers[shard] = array.array('Q')
+
+    # send the remaining accesses and signal the kernel ends, in pipelined mode
+    # it is done by the reader before the accesses of the next kernel are sent
+    def end(self):
+        if self.ended:
+            return
+        for shard, buffer in enumerate(self.buffers):
+            if buffer:
+                self.pool.send(shard, buffer)
+        self.buffers = None
+        self.pool.end_kernel()
+        self.ended = True
+
+    def find_races(self):
+        self.end()
+
+        races = (set(), set(), set(), set())
+        for shard_races in self.pool.results():
+            for kind, kind_races in enumerate(shard_races):
+                races[kind].update(kind_races)
+        return races
+
+
+# with a memory budget, the warp records of a kernel (see RECORD_SIZE) are
+# buffered in SPILL_PARTITIONS partitions of the addresses, and written to
+# one temporary file per partition when the buffers use half of the budget.
+# All the accesses to an address are in the same partition, so when the
+# kernel ends the partitions are analysed one at a time by an in-memory
+# shadow memory, and their races merged. A partition whose shadow memory
+# would not fit in the budget is partitioned again, up to SPILL_MAX_LEVEL
+SPILL_PARTITIONS = 64
+SPILL_MAX_LEVEL = 3
+# estimated size of the shadow memory per access, in bytes
+SHADOW_BYTES_PER_ACCESS = 300
+
+
+def spill_partition(addr, level):
+    return hash((addr >> SHARD_SHIFT, level)) % SPILL_PARTITIONS
+
+
+class SpillingShadowMemory:
+    def __init__(self, max_memory, level=0):
+        self.max_memory = max_memory
+        self.level = level
+        self.buffers = [array.array('Q') for i in range(SPILL_PARTITIONS)]
+        self.buffered = 0 # number of words in the buffers
+        self.files = [None] * SPILL_PARTITIONS
+        self.accesses = [0] * SPILL_PARTITIONS # number of accesses of every partition
+        self.spilled = 0 # number of words written to the files
+        self.partition_stats = collections.Counter() # stats of the partitions analysed
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        addrs = [0] * 32
+        addrs[lane_id] = addr
+        self.add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        level = self.level
+        header = (int(is_load), int(is_shared_memory), block_id, warp_id, func_id, inst_id, SFR_id)
+
+        partition_addrs = {} # key: partition, val: addresses of the lanes of the partition
+        for lane_id, addr in enumerate(addrs):
+            if addr == 0:
+                continue
+            partition = spill_partition(addr, level)
+            lane_addrs = partition_addrs.get(partition)
+            if lane_addrs is None:
+                lane_addrs = partition_addrs[partition] = [0] * 32
+            lane_addrs[lane_id] = addr
+            self.accesses[partition] += 1
+
+        for partition, lane_addrs in partition_addrs.items():
+            buffer = self.buffers[partition]
+            buffer.extend(header)
+            buffer.extend(lane_addrs)
+        self.buffered += RECORD_SIZE * len(partition_addrs)
+
+        if self.buffered * 8 * 2 >= self.max_memory:
+            self.spill()
+
+    def spill(self):
+        for partition, buffer in enumerate(self.buffers):
+            if not buffer:
+                continue
+            if self.files[partition] is None:
+                self.files[partition] = tempfile.TemporaryFile(prefix="race_check_", dir=SPILL_DIR)
+            buffer.tofile(self.files[partition])
+            self.spilled += len(buffer)
+            self.buffers[partition] = array.array('Q')
+        self.buffered = 0
+
+    # yield the records of a partition in arrival order, in batches,
+    # the partition is dropped afterwards
+    def records(self, partition):
+        f = self.files[partition]
+        if f is not None:
+            f.seek(0)
+            while True:
+                data = f.read(BATCH_SIZE * 8)
+                if not data:
+                    break
+                records = array.array('Q')
+                records.frombytes(data)
+                yield records
+            f.close()
+            self.files[partition] = None
+        yield self.buffers[partition]
+        self.buffers[partition] = array.array('Q')
+
+    def find_races(self):
+        races = (set(), set(), set(), set())
+        for partition in range(SPILL_PARTITIONS):
+            if self.accesses[partition] == 0:
+                continue
+            if self.accesses[partition] * SHADOW_BYTES_PER_ACCESS <= self.max_memory or self.level == SPILL_MAX_LEVEL:
+                shadow = new_in_memory_shadow()
+            else:
+                shadow = SpillingShadowMemory(self.max_memory, self.level + 1)
+            for records in self.records(partition):
+                add_warp = shadow.add_warp
+                for i in range(0, len(records), RECORD_SIZE):
+                    add_warp(*records[i:i + 7], records[i + 7:i + RECORD_SIZE])
+            for kind, partition_races in enumerate(shadow.find_races()):
+                races[kind].update(partition_races)
+            if hasattr(shadow, "stats"):
+                self.partition_stats.update(shadow.stats())
+        return races
+
+    # the partitions have distinct addresses, their counts add up,
+    # but an SFR can be in several partitions
+    def stats(self):
+        stats = dict(self.partition_stats)
+        stats.pop("sfrs", None)
+        stats["spilled_bytes"] = self.spilled * 8 + stats.get("spilled_bytes", 0)
+        return stats
+
+
+# with memoization, the accesses of a kernel go to a shadow memory as usual,
+# and every warp record (see RECORD_SIZE) is hashed as it arrives. When the
+# kernel ends, the launch is looked up in launch_cache by the functions it
+# accesses, its number of blocks and a digest of the records. Only launches
+# that are not found have their races found and reported
+class MemoShadowMemory:
+    def __init__(self, kernel_id=None):
+        self.analysed = new_analysis_memory(kernel_id)
+        self.digest = 0
+        self.func_ids = set()
+        self.blocks = set()
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        addrs = [0] * 32
+        addrs[lane_id] = addr
+        self.add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
+
+    # warps are not scheduled in the same order by every launch, so the
+    # digest is the sum of the hashes of the records, which does not depend
+    # on their order (races do not either, unless MAX_INSTS_PER_ADDRESS is reached)
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        record = array.array('Q', (int(is_load), int(is_shared_memory), block_id, warp_id, func_id, inst_id, SFR_id))
+        record.extend(addrs)
+        self.digest += int.from_bytes(hashlib.blake2b(record, digest_size=16).digest(), "little")
+        self.func_ids.add(func_id)
+        self.blocks.add(block_id)
+        self.analysed.add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
+
+    # (kernel identity, digest of the accesses), the identity is the name of
+    # the functions and the number of blocks
+    def key(self):
+        names = ", ".join(sorted(functions[func_id].func_name if func_id < len(functions) else str(func_id)
+                                 for func_id in self.func_ids))
+        return (names, len(self.blocks)), (self.digest % (1 << 128)).to_bytes(16, "little")
+
+    def end(self):
+        if hasattr(self.analysed, "end"):
+            self.analysed.end()
+
+    def find_races(self):
+        return self.analysed.find_races()
+
+    # the launch is found in launch_cache, its races are not needed. The
+    # workers of --jobs answer the end of every kernel, they are drained
+    def discard(self):
+        if JOBS > 1:
+            self.analysed.find_races()
+        self.analysed = None
+
+
+# launches already analysed, the least recently seen are evicted
+# beyond capacity. Counts of launches are kept per kernel identity
+class LaunchCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.launches = collections.OrderedDict() # key: (identity, digest), val: LaunchEntry
+        self.kernels = {} # key: identity, val: [launches, analysed, launches with races]
+
+    # return the entry of an earlier launch with the same key, or None
+    def lookup(self, key):
+        entry = self.launches.get(key)
+        if entry is not None:
+            self.launches.move_to_end(key)
+            entry.launches += 1
+            self.count(key[0], entry.race_counter, analysed=False)
+        return entry
+
+    def insert(self, key, kernel_id, race_counter):
+        self.launches[key] = LaunchEntry(kernel_id, race_counter)
+        self.count(key[0], race_counter, analysed=True)
+        if len(self.launches) > self.capacity:
+            self.launches.popitem(last=False)
+
+    def count(self, identity, race_counter, analysed):
+        counts = self.kernels.get(identity)
+        if counts is None:
+            counts = self.kernels[identity] = [0, 0, 0]
+        counts[0] += 1
+        if analysed:
+            counts[1] += 1
+        if race_counter:
+            counts[2] += 1
+
+    # print the launches of every kernel and how often the races
+    # of the launches still in the cache occurred
+    def report(self):
+        if not self.kernels:
+            return
+        print(bcolors.HEADER + "Kernel launches:" + bcolors.ENDC)
+        for (names, num_blocks), (launches, analysed, racy) in self.kernels.items():
+            print("{} ({} blocks): {} launches, {} analysed, {} reused, {} with data races".format(
+                names, num_blocks, launches, analysed, launches - analysed, racy))
+            for (identity, digest), entry in self.launches.items():
+                if identity == (names, num_blocks) and entry.launches > 1:
+                    print("\tsame accesses as the {}th execution of kernel ({} potential data races): {} launches".format(
+                        entry.kernel_id, entry.race_counter, entry.launches))
+
+
+class LaunchEntry:
+    __slots__ = ('kernel_id', 'race_counter', 'launches')
+
+    def __init__(self, kernel_id, race_counter):
+        self.kernel_id = kernel_id # first launch with these accesses
+        self.race_counter = race_counter
+        self.launches = 1
+
+
+# print a race the first time it is found in a kernel,
+# a race is identified by its kind and the pair of instructions
+class OnlineReporter:
+    def __init__(self, kernel_id):
+        self.kernel_id = kernel_id
+        self.reported = set()
+
+    def __call__(self, kind, where, addr, inst, other_inst):
+        key = (kind, min(inst, other_inst), max(inst, other_inst))
+        if key in self.reported:
+            return
+        self.reported.add(key)
+
+        if kind == INTER_GLOBAL:
+            location = "Block_id: ({})".format(where)
+        else:
+            location = "Block_id: ({}), SFR_id: {}".format(where >> 32, where & 0xffffffff)
+        with print_lock:
+            print(bcolors.WARNING + "Warning! Found an {} data race in the {}th execution of kernel ({}, address {}) between instructions:".format(
+                RACE_KINDS[kind], self.kernel_id, location, hex(addr)) + bcolors.ENDC)
+            print(instruction(*unpack_inst(other_inst)))
+            print(instruction(*unpack_inst(inst)), flush=True)
+
+
+# kernel_id is the id of the kernel in the reports, by default
+# the number of the kernel being read
+def new_shadow_memory(kernel_id=None):
+    if MEMO_CACHE_SIZE:
+        return MemoShadowMemory(kernel_id)
+
+    return new_analysis_memory(kernel_id)
+
+
+def new_analysis_memory(kernel_id=None):
+    if JOBS > 1:
+        shadow = ShardedShadowMemory(shard_pool)
+    elif MAX_MEMORY:
+        shadow = SpillingShadowMemory(MAX_MEMORY)
+    else:
+        shadow = new_in_memory_shadow(kernel_id)
 
+    if sampler is not None:
+        shadow = sampling.SampledShadowMemory(shadow, sampler)
+    return shadow
 
-def process_message():
-    global functions
 
-    SFR_shared_mem = {} # key: SFR, val: shared_mem (a dic of addr : Address (has two set of Thread))
-    SFR_global_mem = {} # key: SFR, val: global_mem (a dic of addr : Address (has two set of Thread))
+def new_in_memory_shadow(kernel_id=None):
+    if ENGINE == "numpy":
+        import race_check_numpy
+        return race_check_numpy.ColumnShadowMemory(MAX_INSTS_PER_ADDRESS)
+    if ENGINE == "ranges":
+        import race_check_ranges
+        return race_check_ranges.RangeShadowMemory(functools.partial(ShadowMemory, None, False, REPORT_ADDRS))
 
-    GLOBAL_mem = {} # key: addr, val: Address (has two set of Block)
+    if kernel_id is None:
+        kernel_id = kernel_id_of(kernels_ended + 1)
+    on_race = OnlineReporter(kernel_id) if ONLINE_REPORT else None
+    return ShadowMemory(on_race, DROP_CLOSED_SFR, REPORT_ADDRS)
 
-    # flag and counter for reading function assembly
+
+# metrics of a kernel being read, None if they are not measured
+def new_kernel_metrics():
+    if metrics_writer is None:
+        return None
+    return metrics.KernelMetrics()
+
+
+# what the shadow memory of a checked kernel tracked, for the metrics
+def shadow_stats(shadow):
+    shadow = getattr(shadow, "analysed", shadow)
+    if isinstance(shadow, sampling.SampledShadowMemory):
+        shadow = shadow.shadow
+    if hasattr(shadow, "stats"):
+        return shadow.stats()
+    return None
+
+
+# read the text trace from stream (default: stdin)
+# the tool prints the lanes of a warp instruction one after another,
+# consecutive lines of the same warp instruction are added as one warp access
+class WarpAssembler:
+    def __init__(self):
+        self.key = None # (is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id)
+        self.addrs = None
+        self.last_lane = 32
+
+    # add the accesses parsed by trace_parser, the last warp access is
+    # kept as its lanes may continue in the next chunk
+    def add(self, shadow, accesses):
+        add_warp = shadow.add_warp
+        warp_key = self.key
+        warp_addrs = self.addrs
+        last_lane = self.last_lane
+        for key, lane_id, addr in accesses:
+            if key != warp_key or lane_id <= last_lane:
+                if warp_key is not None:
+                    add_warp(*warp_key, warp_addrs)
+                warp_key = key
+                warp_addrs = [0] * 32
+            warp_addrs[lane_id] = addr
+            last_lane = lane_id
+        self.key = warp_key
+        self.addrs = warp_addrs
+        self.last_lane = last_lane
+
+    # add the last warp access, when the kernel ends
+    def flush(self, shadow):
+        if self.key is not None:
+            shadow.add_warp(*self.key, self.addrs)
+            self.key = None
+
+
+# handle the control lines other than "#kernelends#" (function assembly and
+# sampling). read_func tells whether SASS lines are instructions of the last
+# function, its new value is returned
+def read_control(event, value, read_func):
+    global trace_sampler
+
+    if event == trace_parser.FUNC_BEGIN: # begins reading functions
+        functions.append(Function(value))
+        if access_filter is not None:
+            access_filter.add_function(len(functions) - 1, value)
+        return True
+    if event == trace_parser.FUNC_END: # finish reading functions
+        if read_func:
+            functions[-1].cache()
+        return False
+    if event == trace_parser.FUNC_REF: # function of the function cache
+        key, _, func_name = value.partition(",")
+        add_function_ref(key, func_name)
+        if access_filter is not None:
+            access_filter.add_function(len(functions) - 1, func_name)
+        return False
+    if event == trace_parser.SASS:
+        if read_func:
+            functions[-1].insts.append(value)
+    elif event == trace_parser.SAMPLE:
+        trace_sampler = sampling.Sampler.from_line(value)
+    elif event == trace_parser.LAUNCH:
+        raise TraceError("the launches of a trace of concurrent launches cannot be checked apart")
+    return read_func
+
+
+# a kernel launch being read
+class Launch:
+    # launch_id is None for traces without launch ids
+    def __init__(self, launch_id):
+        self.launch_id = launch_id
+        self.shadow = new_shadow_memory(launch_id)
+        self.kernel_metrics = new_kernel_metrics()
+        self.warps = WarpAssembler()
+
+    # add access tuples of trace_parser, parsed in parse_seconds
+    def add(self, accesses, parse_seconds=0.0):
+        if self.kernel_metrics is not None:
+            self.kernel_metrics.parsed(parse_seconds)
+            start = time.perf_counter()
+        self.warps.add(self.shadow, accesses)
+        if self.kernel_metrics is not None:
+            self.kernel_metrics.ingested(len(accesses), time.perf_counter() - start)
+
+    def end(self):
+        self.warps.flush(self.shadow)
+        end_kernel(self.shadow, self.kernel_metrics, self.launch_id)
+
+
+# a launch beyond --max-launches in flight, its accesses are dropped
+# and its end is reported as not checked
+class SkippedLaunch:
+    shadow = None
+
+    def __init__(self, launch_id):
+        self.launch_id = launch_id
+
+    def add(self, accesses, parse_seconds=0.0):
+        pass
+
+    def end(self):
+        global kernels_ended
+        kernels_ended += 1
+        if kernel_pipeline is not None:
+            kernel_pipeline.wait() # printed after the reports of the launches before
+        print(bcolors.WARNING + "The {}th execution of kernel is not checked: more than {} launches were in flight, "
+              "see --max-launches.".format(self.launch_id, MAX_LAUNCHES) + bcolors.ENDC)
+
+
+# the launches being read. race_check_trace runs kernels one after another,
+# unless CONCURRENT_LAUNCHES=1 is set: then the accesses of the launches
+# running at the same time are interleaved, "#launch#N" tells the launch of
+# the accesses that follow and "#kernelends#N" ends launch N. Every launch
+# has its own shadow memory until it ends, and is reported with its id.
+# Launches that start while --max-launches are in flight are skipped.
+# Without launch ids, a single launch with id None is read at a time
+class Launches:
+    def __init__(self):
+        self.in_flight = {} # key: launch id, val: Launch
+        self.current = None # launch of the accesses being read, created when they come
+
+    def get(self, launch_id):
+        launch = self.in_flight.get(launch_id)
+        if launch is None:
+            if launch_id is not None and JOBS > 1:
+                raise TraceError("--jobs cannot check a trace of concurrent launches")
+            if len(self.in_flight) >= MAX_LAUNCHES:
+                launch = self.in_flight[launch_id] = SkippedLaunch(launch_id)
+            else:
+                launch = self.in_flight[launch_id] = Launch(launch_id)
+        return launch
+
+    def switch(self, launch_id):
+        self.current = self.get(launch_id)
+        return self.current
+
+    # end launch_id (None: the launch of a trace without launch ids)
+    def end(self, launch_id):
+        launch = self.in_flight.pop(launch_id, None)
+        if launch is None:
+            launch = Launch(launch_id) # no access, it is reported race free
+        if launch is self.current:
+            self.current = None
+        launch.end()
+
+
+# a binary stream that counts the time spent in its reads
+class TimedStream:
+    def __init__(self, stream):
+        self.read_part = getattr(stream, "read1", None) or stream.read
+        self.seconds = 0.0
+
+    def read1(self, size):
+        start = time.perf_counter()
+        data = self.read_part(size)
+        self.seconds += time.perf_counter() - start
+        return data
+
+
+# yield the events of trace_parser.parse_stream as (event, value, seconds).
+# With timed, seconds is the time parse_stream took to produce the event,
+# without the time it waited for the stream, otherwise it is 0.0
+def parse_events(stream, offset=None, timed=False):
+    if not timed:
+        for event, value in trace_parser.parse_stream(stream, offset=offset):
+            yield event, value, 0.0
+        return
+
+    stream = TimedStream(stream)
+    events = trace_parser.parse_stream(stream, offset=offset)
+    while True:
+        start = time.perf_counter()
+        read_seconds = stream.seconds
+        item = next(events, None)
+        if item is None:
+            return
+        yield item[0], item[1], time.perf_counter() - start - (stream.seconds - read_seconds)
+
+
+# offset is the offset of stream in the trace file when checkpoints are written,
+# launches are the launches in flight there when resuming from a checkpoint
+def process_message(stream=None, offset=None, launches=None):
+    launches = launches or Launches()
+
+    # flag for reading function assembly
     read_func = False
-    read_func_name = False
 
     # read input and build dict
-    for line in sys.stdin:
+    for event, value, seconds in parse_events(stream or sys.stdin.buffer, offset, metrics_writer is not None):
+        # handle load and store message
+        if event == trace_parser.ACCESSES:
+            (launches.current or launches.switch(None)).add(value, seconds)
+
         # handle special message (kernel ends signal and function assembly)
-        if line[0] != '#': # all message begin with #
-            continue
-        elif line.strip('\n') == "#kernelends#":
-            check_result(SFR_shared_mem, SFR_global_mem, GLOBAL_mem)
-            # do a new loop
-            SFR_shared_mem = {} # key: SFR, val: shared_mem (a dic of addr : Address)
-            SFR_global_mem = {} # key: SFR, val: global_mem (a dic of addr : Address)
+        elif event == trace_parser.KERNEL_END:
+            launches.end(value)
+        elif event == trace_parser.LAUNCH:
+            launches.switch(value)
+        elif event == trace_parser.POSITION:
+            checkpointer.kernel_end(launches, value)
+        else:
+            read_func = read_control(event, value, read_func)
 
-            GLOBAL_mem = {} # key: addr, val: Address (a set of Block)
-            continue
-        elif line[:12] == "#func_begin#": # begins reading functions
-            read_func = True
-            functions.append(Function(line.strip('\n')[12:]))
-            continue
-        elif line.strip('\n') == "#func_end#": # finish reading functions
-            read_func = False
-            continue
-        elif read_func and line[:6] == "#SASS#":
-            functions[-1].insts.append(line.strip('\n')[6:])
-            continue
-        
-        # handle load and store message
-        # format: "#ld#is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr\n"
-        temp = line.strip('\n')[4:].split(",")
 
-        if (len(temp) != 8):  # skip unwanted output
-            continue
+# the trace refers to a function of the function cache by its key
+def add_function_ref(key, func_name):
+    if func_cache is None or key not in func_cache:
+        raise TraceError("function {} ({}) is not in the function cache, see --func-cache".format(func_name, key))
+    if func_cache.name(key) != func_name:
+        raise TraceError("function {} ({}) is {} in the function cache".format(func_name, key, func_cache.name(key)))
+    functions.append(Function(func_name, key))
 
-        addr = temp[-1]
-        t = Thread(temp[2], temp[3])
-        s = SFR(temp[1], temp[-2])
-        b = Block(temp[1])
-        inst = instruction(int(temp[4]), int(temp[5]))
 
-        if "#ld#" in line: 
-            if (temp[0] == '1'): # shared memory
-                if s not in SFR_shared_mem:
-                    SFR_shared_mem[s] = {}
+# add the records of a FRAME_ACCESS payload of one launch
+def add_binary_accesses(launch, payload):
+    import binary_trace
 
-                shared_mem = SFR_shared_mem[s]
+    shadow = launch.shadow
+    if shadow is None:
+        return # skipped launch
+    kernel_metrics = launch.kernel_metrics
+    if kernel_metrics is not None:
+        start = time.perf_counter()
+    if hasattr(shadow, "add_access_array"):
+        records = binary_trace.access_array(payload)
+        if access_filter is not None:
+            records = access_filter.filter_array(records)
+        shadow.add_access_array(records)
+    elif access_filter is not None:
+        add_filtered_records(shadow, binary_trace.iter_accesses(payload))
+    else:
+        add_warp = shadow.add_warp
+        ADDRS = binary_trace.ADDRS
+        for record in binary_trace.iter_accesses(payload):
+            block_id, warp_id, opcode_id, func_id, inst_id, is_shared_memory, is_load, SFR_id = record[:ADDRS]
+            add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, record[ADDRS:])
+    if kernel_metrics is not None:
+        kernel_metrics.ingested(binary_trace.count_accesses(payload), time.perf_counter() - start)
 
-                if addr not in shared_mem:
-                    shared_mem[addr] = Address()
-                shared_mem[addr].load.add(t) 
-                # add inst to inst set
-                shared_mem[addr].insts.add(inst)
 
-            else: # global memory
-                # intra block
-                if s not in SFR_global_mem:
-                    SFR_global_mem[s] = {}
+# same as process_message, but read the binary trace in path ('-' for stdin)
+# from offset if given. In a trace of concurrent launches, a FRAME_LAUNCH
+# tells the launch of the FRAME_ACCESS frames that follow
+def process_binary(path, offset=None, launches=None):
+    global functions, trace_sampler
 
-                global_mem = SFR_global_mem[s]
+    import binary_trace
 
-                if addr not in global_mem:
-                    global_mem[addr] = Address()
+    launches = launches or Launches()
+    position = offset or binary_trace.TRACE_HEADER.size
 
-                global_mem[addr].load.add(t) 
-                # add inst to inst set
-                global_mem[addr].insts.add(inst)    
+    for frame_type, payload in binary_trace.open_trace(path, offset):
+        position += binary_trace.FRAME_HEADER.size + len(payload)
+        if frame_type == binary_trace.FRAME_ACCESS:
+            add_binary_accesses(launches.current or launches.switch(None), payload)
+        elif frame_type == binary_trace.FRAME_LAUNCH:
+            launches.switch(binary_trace.decode_launch(payload))
+        elif frame_type == binary_trace.FRAME_KERNEL_END:
+            launches.end(binary_trace.decode_kernel_end(payload))
+            if checkpointer is not None:
+                checkpointer.kernel_end(launches, position)
+        elif frame_type == binary_trace.FRAME_FUNC:
+            func_id, func_name, insts = binary_trace.decode_function(payload)
+            functions.append(Function(func_name))
+            functions[-1].insts = insts
+            functions[-1].cache()
+            if access_filter is not None:
+                access_filter.add_function(func_id, func_name)
+        elif frame_type == binary_trace.FRAME_FUNC_REF:
+            func_id, key, func_name = binary_trace.decode_function_ref(payload)
+            add_function_ref(key, func_name)
+            if access_filter is not None:
+                access_filter.add_function(func_id, func_name)
+        elif frame_type == binary_trace.FRAME_SAMPLE:
+            trace_sampler = sampling.Sampler.from_config(*binary_trace.decode_sample(payload))
 
-                # inter block
-                if addr not in GLOBAL_mem:
-                    GLOBAL_mem[addr] = Address()
 
-                GLOBAL_mem[addr].load.add(b)  # add block rather than thread
-                # add inst to inst set
-                GLOBAL_mem[addr].insts.add(inst) 
+# add the records of a binary trace kept by access_filter
+def add_filtered_records(shadow, records):
+    import binary_trace
 
-        elif "#st#" in line: # format: "#st#is_shared_memory, block_id, warp_id, lane_id,func_id, inst_id, SFR_id, addr\n"
-            if (temp[0] == '1'): # shared memory
-                if s not in SFR_shared_mem:
-                    SFR_shared_mem[s] = {}
+    add_warp = shadow.add_warp
+    ADDRS = binary_trace.ADDRS
+    keep = access_filter.keep
+    keep_addr = access_filter.address_filter()
+    for record in records:
+        block_id, warp_id, opcode_id, func_id, inst_id, is_shared_memory, is_load, SFR_id = record[:ADDRS]
+        if not keep(bool(is_shared_memory), func_id, inst_id):
+            continue
+        addrs = record[ADDRS:]
+        if keep_addr is not None:
+            addrs = access_filter.filter_addrs(addrs, keep_addr)
+            if addrs is None:
+                continue
+        add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
 
-                shared_mem = SFR_shared_mem[s]
 
-                if addr not in shared_mem:
-                    shared_mem[addr] = Address()
-                shared_mem[addr].store.add(t) 
-                # add inst to inst set
-                shared_mem[addr].insts.add(inst)
+# Offline traces are checked a kernel per worker process (--kernel-jobs).
+# The parent reads the control lines once (the function table and the
+# sampling), the workers get them when they start. Every worker reads the
+# accesses of its kernel from the file itself and returns its report,
+# reports are printed in kernel order.
+
+# binary stream over mm[start:end]
+class SpanStream:
+    def __init__(self, mm, start, end):
+        self.mm = mm
+        self.pos = start
+        self.end = end
+
+    def read(self, size=-1):
+        end = self.end if size < 0 else min(self.pos + size, self.end)
+        data = self.mm[self.pos:end]
+        self.pos = end
+        return data
+
+
+# the kernels of a text trace file, a kernel is the span
+# of the file up to the end of its "#kernelends#" line
+class KernelTraceFile:
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+
+    def map(self):
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # read the control lines, return the kernels as (kernel id, (start, end))
+    def scan(self):
+        mm = self.map()
+        kernels = []
+        start = 0
+        read_func = False
+        for m in trace_parser.CONTROL_LINE.finditer(mm):
+            control = trace_parser.control_event(m)
+            if control is None:
+                continue
+            event, value = control
+            if event == trace_parser.KERNEL_END:
+                end = m.end() + 1
+                kernels.append((len(kernels) + 1, (start, end)))
+                start = end
             else:
-                # intra block
-                if s not in SFR_global_mem:
-                    SFR_global_mem[s] = {}
+                read_func = read_control(event, value, read_func)
+        return kernels
 
-                global_mem = SFR_global_mem[s]
+    def open(self):
+        self.mm = self.map()
 
-                if addr not in global_mem:
-                    global_mem[addr] = Address()
+    def stream(self, span):
+        return SpanStream(self.mm, *span)
 
-                global_mem[addr].store.add(t)  
-                # add inst to inst set
-                global_mem[addr].insts.add(inst)  
 
-                # inter block
-                if addr not in GLOBAL_mem:
-                    GLOBAL_mem[addr] = Address()
+# the launches of a capture of trace_capture.py
+class KernelCapture:
+    def __init__(self, path, selected=None):
+        self.path = path
+        self.selected = selected
+        self.file = None
 
-                GLOBAL_mem[addr].store.add(b)  # add block rather than thread
-                # add inst to inst set
-                GLOBAL_mem[addr].insts.add(inst) 
+    # read the control members, return the launches as (kernel id, members of accesses)
+    def scan(self):
+        capture = trace_capture.Capture(self.path)
+        read_func = False
+        for event, value in trace_parser.parse_stream(trace_capture.ReplayStream(capture.meta())):
+            if event != trace_parser.ACCESSES and event != trace_parser.KERNEL_END:
+                read_func = read_control(event, value, read_func)
+        kernel_ids = set(capture.kernel_ids(self.selected))
+        return [(kernel["kernel"], [(offset, length) for kind, offset, length in kernel["members"]
+                                    if kind == trace_capture.ACCESSES])
+                for kernel in capture.kernels if kernel["kernel"] in kernel_ids]
 
+    def open(self):
+        self.file = open(self.path, "rb")
+
+    def stream(self, members):
+        return trace_capture.ReplayStream(piece for offset, length in members
+                                          for piece in trace_capture.read_member(self.file, offset, length))
 
-def check_result(SFR_shared_mem, SFR_global_mem, GLOBAL_mem):
-    global kernel_counter
-    kernel_counter += 1
 
-    inter_block_global_memory_counter = 0
+def kernel_worker(config, source):
+    global kernel_source
+    globals().update(config)
+    kernel_source = source
+    trace_parser.access_filter = access_filter
+    source.open()
 
+
+# check a kernel, return its id, report, number of races, metrics and stats
+def check_kernel(task):
+    kernel_id, part = task
+    shadow = new_analysis_memory()
+    kernel_metrics = metrics.KernelMetrics() if measure_kernels else None
+
+    warps = WarpAssembler()
+    for event, value, seconds in parse_events(kernel_source.stream(part), timed=kernel_metrics is not None):
+        if event == trace_parser.ACCESSES:
+            if kernel_metrics is not None:
+                kernel_metrics.parsed(seconds)
+                start = time.perf_counter()
+            warps.add(shadow, value)
+            if kernel_metrics is not None:
+                kernel_metrics.ingested(len(value), time.perf_counter() - start)
+    warps.flush(shadow)
+
+    if kernel_metrics is not None:
+        start = time.perf_counter()
+    races = shadow.find_races()
+    race_counter = count_races(races)
+    if kernel_metrics is not None:
+        kernel_metrics.check_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        report_kernel(shadow, races, kernel_id)
+    if kernel_metrics is not None:
+        kernel_metrics.report_seconds = time.perf_counter() - start
+    return kernel_id, output.getvalue(), race_counter, kernel_metrics, \
+        shadow_stats(shadow) if kernel_metrics is not None else None
+
+
+def process_kernels(source, jobs):
+    global kernel_counter, kernels_ended
+
+    kernels = source.scan()
+    # the workers check a kernel the way a serial run would
+    config = {"ENGINE": ENGINE, "DROP_CLOSED_SFR": DROP_CLOSED_SFR,
+              "MAX_INSTS_PER_ADDRESS": MAX_INSTS_PER_ADDRESS,
+              "MAX_MEMORY": MAX_MEMORY // jobs, "SPILL_DIR": SPILL_DIR,
+              "REPORT_INSTS": REPORT_INSTS, "REPORT_ADDRS": REPORT_ADDRS,
+              "MEMO_CACHE_SIZE": 0, "ONLINE_REPORT": False, "JOBS": 1,
+              "functions": functions, "func_cache": func_cache, "sampler": sampler, "trace_sampler": trace_sampler, "access_filter": access_filter,
+              "metrics_writer": None, "measure_kernels": metrics_writer is not None}
+    with multiprocessing.Pool(jobs, initializer=kernel_worker, initargs=(config, source)) as pool:
+        for kernel_id, output, race_counter, kernel_metrics, stats in pool.imap(check_kernel, kernels):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            kernels_ended += 1
+            kernel_counter += 1
+            if metrics_writer is not None:
+                metrics_writer.write(kernel_id, kernel_metrics, race_counter, False, stats)
+
+
+# add races (frozenset of packed instructions) of a dic of addr : Address to races
+def collect_races(mem, races):
+    for addr, addr_obj in mem.items():
+        if addr_obj.racy:
+            races.add(frozenset(addr_obj.insts))
+
+
+# races of addresses are tuples (kind, where, addr, loads, stores):
+#   intra block: where is the packed SFR, loads and stores are frozensets of packed threads
+#   inter block: where is 0, loads and stores are sorted tuples of (block id, frozenset of packed threads)
+# the rules are those of race_check_helper_memaddr.py, for inter block races
+# a block that writes and reads the address is not racing with other readers
+
+# add the races of a dic of addr : ThreadAddress of SFR s to races.
+# load and store are bitmasks, store & (store - 1) tells whether there is
+# more than one writer
+def collect_address_races(mem, kind, s, races):
+    for addr, addr_obj in mem.items():
+        load = addr_obj.load
+        store = addr_obj.store
+        if store & (store - 1) or (store and load and load != store):
+            races.add((kind, s, addr, threads_of(load), threads_of(store)))
+
+
+# add the races of a dic of addr : BlockAddress to races
+def collect_inter_address_races(mem, races):
+    for addr, addr_obj in mem.items():
+        load = addr_obj.load
+        store = addr_obj.store
+        if len(store) > 1 or (len(store) == 1 and load and next(iter(store)) not in load):
+            races.add((INTER_GLOBAL, 0, addr,
+                       tuple(sorted((block_id, threads_of(threads)) for block_id, threads in load.items())),
+                       tuple(sorted((block_id, threads_of(threads)) for block_id, threads in store.items()))))
+
+
+# return the set of races (frozenset of packed instructions) of the three kinds
+def find_races(SFR_shared_mem, SFR_global_mem, GLOBAL_mem):
     # intra block shared memory
     intra_shared_races = set()
-
     for SFR, shared_mem in SFR_shared_mem.items():
-        for addr, addr_obj in shared_mem.items():
-            if (len(addr_obj.store) > 1) or (len(addr_obj.store) == 1 and \
-                (len(addr_obj.load) >= 1 and addr_obj.load != addr_obj.store)) :
-                intra_shared_races.add(frozenset(addr_obj.insts))
-
-    # report races
-    for race in intra_shared_races:
-        if (OUTPUT_VERBOSE):
-            print(bcolors.WARNING + "Warning! There may be an intra block shared memory data race involving following instructions:" + bcolors.ENDC)
-        for inst in race:
-            print(inst)
-                
+        collect_races(shared_mem, intra_shared_races)
 
     # intra block global memory
     intra_global_races = set()
     for SFR, global_mem in SFR_global_mem.items():
-        for addr, addr_obj in global_mem.items():
-            if (len(addr_obj.store) > 1) or (len(addr_obj.store) == 1 and \
-                (len(addr_obj.load) >= 1 and addr_obj.load != addr_obj.store)) :
-                intra_global_races.add(frozenset(addr_obj.insts))
-
-    # report races
-    for race in intra_global_races:
-        if (OUTPUT_VERBOSE):
-            print(bcolors.WARNING + "Warning! There may be an intra block global memory data race involving following instructions:" + bcolors.ENDC)
-        for inst in race:
-            print(inst)
+        collect_races(global_mem, intra_global_races)
 
     # inter block global memory
     inter_global_races = set()
-    for addr, addr_obj in GLOBAL_mem.items():
-        if (len(addr_obj.store) > 1) or (len(addr_obj.store) == 1 and \
-            (len(addr_obj.load) >= 1 and addr_obj.load != addr_obj.store)) :
-            inter_global_races.add(frozenset(addr_obj.insts))
+    collect_races(GLOBAL_mem, inter_global_races)
+
+    return intra_shared_races, intra_global_races, inter_global_races
 
-    # report races
-    for race in inter_global_races:
+
+# races are printed sorted by instruction so the report is reproducible
+def print_races(races, kind):
+    for race in sorted(sorted(race) for race in races):
         if (OUTPUT_VERBOSE):
-            print(bcolors.WARNING + "Warning! There may be an inter block global memory data race involving following instructions:" + bcolors.ENDC)
+            print(bcolors.WARNING + "Warning! There may be an " + kind + " data race involving following instructions:" + bcolors.ENDC)
         for inst in race:
-            print(inst)
+            print(instruction(*unpack_inst(inst)))
+
+
+def report_races(intra_shared_races, intra_global_races, inter_global_races, kernel_id):
+    print_races(intra_shared_races, RACE_KINDS[INTRA_SHARED])
+    print_races(intra_global_races, RACE_KINDS[INTRA_GLOBAL])
+    print_races(inter_global_races, RACE_KINDS[INTER_GLOBAL])
 
     race_counter = len(intra_shared_races) + len(intra_global_races) + len(inter_global_races)
-    
+
     if (not OUTPUT_VERBOSE):
         return
-    
+
     if race_counter == 0:
-        print(bcolors.OKGREEN + "no data race is found in the {}th execution of kernel.".format(kernel_counter) + bcolors.ENDC)
+        print(bcolors.OKGREEN + "no data race is found in the {}th execution of kernel.".format(kernel_id) + bcolors.ENDC)
     else:
-        print(bcolors.WARNING + "There are {} potential data races in the {}th execution of kernel.".format(race_counter, kernel_counter) + bcolors.ENDC)
+        print(bcolors.WARNING + "There are {} potential data races in the {}th execution of kernel.".format(race_counter, kernel_id) + bcolors.ENDC)
         print(bcolors.WARNING + "{} of them are intra block shared memory data races.".format(len(intra_shared_races)) + bcolors.ENDC)
         print(bcolors.WARNING + "{} of them are intra block global memory data races.".format(len(intra_global_races)) + bcolors.ENDC)
         print(bcolors.WARNING + "{} of them are inter block global memory data races.".format(len(inter_global_races)) + bcolors.ENDC)
     print()
 
+
+# print the races of addresses the way race_check_helper_memaddr.py does,
+# sorted by kind, SFR and address
+def report_address_races(address_races, kernel_id):
+    counters = [0, 0, 0]
+
+    for kind, where, addr, loads, stores in sorted(
+            address_races, key=lambda race: (race[0], block_order(race[1] >> 32), race[1] & 0xffffffff, race[2])):
+        counters[kind] += 1
+        if kind == INTER_GLOBAL:
+            print(bcolors.WARNING + "Warning! There may be a data race in address(GLOBAL): 0x{:016x} where:".format(addr) + bcolors.ENDC)
+            for name, blocks in (("Load", loads), ("Store", stores)):
+                print("\t{} from blocks: ".format(name), end="")
+                for block_id, threads in sorted(blocks, key=lambda block: block_order(block[0])):
+                    print(format_block(block_id), end="-")
+                    print("[Thread ", end="")
+                    for t in sorted(threads):
+                        print(format_thread(t), end=" ")
+                    print("]")
+                    print(" "*23, end="")
+                print("\n")
+            continue
+
+        space = "SHARED" if kind == INTRA_SHARED else "GLOBAL"
+        SFR = "Block_id: {}, SFR_id: {}".format(format_block(where >> 32), where & 0xffffffff)
+        print(bcolors.WARNING + "Warning! There may be a data race in address({}, {}): 0x{:016x} where:".format(space, SFR, addr) + bcolors.ENDC)
+        print("\tLoad from threads: ", end="")
+        for t in sorted(loads):
+            print(format_thread(t), end=" ")
+        print("")
+        print("\tStore from threads: ", end="")
+        for t in sorted(stores):
+            print(format_thread(t), end=" ")
+        print("\n")
+
+    race_counter = sum(counters)
+    if race_counter == 0:
+        print(bcolors.OKGREEN + "no data races found in {}th kernel lunches.".format(kernel_id) + bcolors.ENDC)
+    else:
+        print(bcolors.WARNING + "There are {} potential data races in {}th kernel lunches".format(race_counter, kernel_id) + bcolors.ENDC)
+        print(bcolors.WARNING + "{} of them are intra block shared memory data races in this kernel lunches".format(counters[INTRA_SHARED]) + bcolors.ENDC)
+        print(bcolors.WARNING + "{} of them are intra block global memory data races in this kernel lunches".format(counters[INTRA_GLOBAL]) + bcolors.ENDC)
+        print(bcolors.WARNING + "{} of them are inter block global memory data races in this kernel lunches".format(counters[INTER_GLOBAL]) + bcolors.ENDC)
+
+
+# coverage of the sample of a kernel (see sampling.SampledShadowMemory.coverage),
+# None if it is not sampled
+def sample_coverage(shadow):
+    shadow = getattr(shadow, "analysed", shadow)
+    if isinstance(shadow, sampling.SampledShadowMemory):
+        return shadow.coverage()
+    return None
+
+
+def report_coverage(coverage):
+    if trace_sampler is not None:
+        print(bcolors.OKBLUE + "The trace was sampled by race_check_trace: {}.".format(trace_sampler) + bcolors.ENDC)
+    if coverage is not None:
+        print(bcolors.OKBLUE + "Sampled coverage ({}): {}.".format(sampler, sampling.format_coverage(coverage)) + bcolors.ENDC)
+
+
+# finished kernels are checked one by one in kernel order by a thread,
+# at most depth kernels can wait so the memory stays bounded
+class KernelPipeline:
+    def __init__(self, depth):
+        self.queue = queue.Queue(maxsize=depth)
+        self.error = None # exception of a kernel, raised again in the main thread
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # after an error the queue is still drained, so submit and close do not block
+    def run(self):
+        while True:
+            kernel = self.queue.get()
+            if kernel is None:
+                return
+            try:
+                if self.error is None:
+                    check_result(*kernel)
+                    sys.stdout.flush()
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    # wait for the kernels submitted to be reported
+    def wait(self):
+        self.queue.join()
+        self.raise_error()
+
+    def submit(self, shadow, kernel_metrics, launch_id):
+        self.raise_error()
+        self.queue.put((shadow, kernel_metrics, launch_id))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+
+# writes a checkpoint at the end of a kernel every few kernels, see checkpoint.py
+class Checkpointer:
+    # source is ("trace", "binary" or "capture", path)
+    def __init__(self, path, source, every):
+        self.path = path
+        self.source = source
+        self.every = every
+        self.last = kernels_ended # kernels read at the last checkpoint
+        self.warned = kernels_ended # kernels read at the last warning
+        # the shadow memories of the launches in flight can be saved,
+        # unset once one cannot (a capture, or spilled to disk by --max-memory)
+        self.save_in_flight = source[0] != "capture"
+
+    # a kernel ended at position of the trace, the launches in flight
+    # are still being read, they are saved with the checkpoint
+    def kernel_end(self, launches, position):
+        if kernels_ended - self.last < self.every:
+            return
+        if launches.in_flight and not self.save_in_flight:
+            self.warn()
+            return
+        if kernel_pipeline is not None:
+            kernel_pipeline.wait()
+        sys.stdout.flush()
+        try:
+            state = self.state(position, launches)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self.save_in_flight = False
+            self.warn()
+            return
+        checkpoint.write(self.path, state)
+        self.last = kernels_ended
+
+    # warn once per interval that launches in flight hold back the checkpoint
+    def warn(self):
+        if kernels_ended - self.warned < self.every:
+            return
+        self.warned = kernels_ended
+        print("race_check_helper.py: warning: no checkpoint in the last {} kernels, "
+              "launches were in flight at every kernel end".format(kernels_ended - self.last), file=sys.stderr)
+
+    # the state, pickled so that a launch that cannot be saved is found here
+    def state(self, position, launches):
+        in_flight = None
+        if launches.in_flight:
+            current = launches.current.launch_id if launches.current is not None else None
+            in_flight = pickle.dumps((launches.in_flight, current), pickle.HIGHEST_PROTOCOL)
+        return {
+            "launches": in_flight,
+            "source": self.source,
+            "position": None if self.source[0] == "capture" else position,
+            "kernel_counter": kernel_counter,
+            "kernels_ended": kernels_ended,
+            "functions": functions,
+            "selected_funcs": access_filter.selected_funcs if access_filter is not None else None,
+            "trace_sampler": trace_sampler,
+            "block_cta_ids": trace_parser.block_cta_ids,
+            "launch_cache": launch_cache,
+            "metrics": metrics_writer.state() if metrics_writer is not None else None,
+        }
+
+
+# restore the state of a checkpoint, return its position
+def resume(state, source):
+    global kernel_counter, kernels_ended, functions, trace_sampler, launch_cache
+
+    if state["source"] != source:
+        raise TraceError("the checkpoint is of {} {}, not of {} {}".format(*state["source"], *source))
+    kernel_counter = state["kernel_counter"]
+    kernels_ended = state["kernels_ended"]
+    functions = state["functions"]
+    if access_filter is not None and state["selected_funcs"] is not None:
+        access_filter.selected_funcs = state["selected_funcs"]
+    trace_sampler = state["trace_sampler"]
+    for cta_id in state["block_cta_ids"]:
+        trace_parser.block_of_cta(cta_id)
+    if launch_cache is not None and state["launch_cache"] is not None:
+        launch_cache = state["launch_cache"]
+    return state["position"]
+
+
+# the launches in flight at the checkpoint, to go on reading them
+def resumed_launches(state):
+    launches = Launches()
+    if state is not None and state["launches"] is not None:
+        launches.in_flight, current = pickle.loads(state["launches"])
+        if current is not None:
+            launches.current = launches.in_flight[current]
+    return launches
+
+
+def end_kernel(shadow, kernel_metrics=None, launch_id=None):
+    global kernels_ended
+    kernels_ended += 1
+
+    if kernel_pipeline is None:
+        check_result(shadow, kernel_metrics, launch_id)
+        return
+
+    if JOBS > 1:
+        shadow.end()
+    kernel_pipeline.submit(shadow, kernel_metrics, launch_id)
+
+
+# launch_id is the id of the launch in a trace of concurrent launches,
+# it is the id of the kernel in the report
+def check_result(shadow, kernel_metrics=None, launch_id=None):
+    global kernel_counter
+    kernel_counter += 1
+    kernel_id = kernel_id_of(kernel_counter) if launch_id is None else launch_id
+    if kernel_metrics is not None:
+        start = time.perf_counter()
+
+    if launch_cache is not None:
+        key = shadow.key()
+        entry = launch_cache.lookup(key)
+        if entry is not None:
+            shadow.discard()
+            if kernel_metrics is not None:
+                kernel_metrics.check_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+            with print_lock:
+                if OUTPUT_VERBOSE:
+                    color = bcolors.WARNING if entry.race_counter else bcolors.OKGREEN
+                    print(color + "The {}th execution of kernel has the same accesses as the {}th execution ({} potential data races), it is not checked again.".format(
+                        kernel_id, entry.kernel_id, entry.race_counter) + bcolors.ENDC)
+                if kernel_metrics is not None:
+                    kernel_metrics.report_seconds = time.perf_counter() - start
+                    metrics_writer.write(kernel_id, kernel_metrics, entry.race_counter, True, None)
+            return
+
+    races = shadow.find_races()
+    race_counter = count_races(races)
+    if launch_cache is not None:
+        launch_cache.insert(key, kernel_id, race_counter)
+    if kernel_metrics is not None:
+        kernel_metrics.check_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+    with print_lock:
+        report_kernel(shadow, races, kernel_id)
+        if kernel_metrics is not None:
+            kernel_metrics.report_seconds = time.perf_counter() - start
+            metrics_writer.write(kernel_id, kernel_metrics, race_counter, False, shadow_stats(shadow))
+
+
+# number of races reported
+def count_races(races):
+    if REPORT_INSTS:
+        return len(races[INTRA_SHARED]) + len(races[INTRA_GLOBAL]) + len(races[INTER_GLOBAL])
+    return len(races[ADDRESS_RACES])
+
+
+def report_kernel(shadow, races, kernel_id):
+    if REPORT_INSTS:
+        report_races(*races[:ADDRESS_RACES], kernel_id)
+    if REPORT_ADDRS:
+        report_address_races(races[ADDRESS_RACES], kernel_id)
+    coverage = sample_coverage(shadow)
+    if OUTPUT_VERBOSE and (coverage is not None or trace_sampler is not None):
+        report_coverage(coverage)
+
+
+# parse "BEGIN:END" of addresses
+def parse_addr_range(text):
+    try:
+        return filters.parse_addr_range(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a non-empty address range BEGIN:END")
+
+
+# parse "BEGIN:END"
+def parse_range(text):
+    try:
+        begin, end = text.split(":")
+        return int(begin or 0), int(end) if end else sampling.INT_MAX
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected BEGIN:END")
+
+
+def main(argv=None):
+    global REPORT_INSTS, REPORT_ADDRS, ONLINE_REPORT, DROP_CLOSED_SFR, ENGINE, JOBS, PIPELINE, MAX_MEMORY, SPILL_DIR, \
+        MEMO_CACHE_SIZE, KERNEL_JOBS, MAX_LAUNCHES, MAX_INSTS_PER_ADDRESS, sampler, access_filter, shard_pool, kernel_pipeline, launch_cache, metrics_writer, kernel_ids, \
+        func_cache, checkpointer
+
+    parser = argparse.ArgumentParser(description="Check data races in the output of NVBit tool race_check_trace (read from stdin).")
+    parser.add_argument("--report", choices=("inst", "addr", "both"), default="inst",
+                        help="inst: races of instructions (default), addr: races of addresses with the threads "
+                             "accessing them (as race_check_helper_memaddr.py), both: the two reports from one pass")
+    parser.add_argument("--online", action="store_true",
+                        help="report a race as soon as it is found instead of waiting for the kernel to end")
+    parser.add_argument("--drop-closed-sfr", action="store_true",
+                        help="drop the state of a SFR once the SFR_id of its block moves forward")
+    parser.add_argument("--binary", metavar="FILE",
+                        help="read the binary trace written by race_check_trace with BINARY_TRACE=FILE ('-' for stdin)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="read the text trace from FILE instead of stdin")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="replay the kernel launches of a capture of trace_capture.py")
+    parser.add_argument("--kernels", type=trace_capture.parse_kernels, metavar="IDS",
+                        help="launches of the capture to check, e.g. 3,7-9,12- (default: all)")
+    parser.add_argument("--engine", choices=("dict", "numpy", "ranges"), default=ENGINE,
+                        help="dict: shadow memory updated as accesses arrive (default), "
+                             "numpy: accesses of a kernel are stored in columns and sorted when it ends, "
+                             "ranges: warp accesses are stored as address ranges, overlapping ranges are checked when the kernel ends")
+    parser.add_argument("--jobs", type=int, default=JOBS, metavar="N",
+                        help="analyse the accesses in N worker processes, sharded by address")
+    parser.add_argument("--kernel-jobs", type=int, default=KERNEL_JOBS, metavar="N",
+                        help="check N kernels of --trace or --capture at a time in worker processes")
+    parser.add_argument("--max-launches", type=int, default=MAX_LAUNCHES, metavar="N",
+                        help="max number of launches in flight in a trace of concurrent launches, "
+                             "launches beyond are not checked (default: {})".format(MAX_LAUNCHES))
+    parser.add_argument("--pipeline", action="store_true",
+                        help="check and report a kernel in the background while the next kernel is read")
+    parser.add_argument("--max-insts-per-address", type=int, default=MAX_INSTS_PER_ADDRESS, metavar="N",
+                        help="instructions kept per address, the others are not listed in the race report "
+                             "(default: {}, 0: no cap)".format(MAX_INSTS_PER_ADDRESS))
+    parser.add_argument("--max-memory", type=parse_size, default=0, metavar="SIZE",
+                        help="memory budget of the accesses of a kernel (e.g. 4G), "
+                             "accesses beyond it are spilled to disk")
+    parser.add_argument("--spill-dir", metavar="DIR",
+                        help="directory of the spilled accesses (default: system temporary directory)")
+    parser.add_argument("--memoize", type=int, default=0, metavar="N",
+                        help="remember the last N distinct launches and do not check again a launch with the same "
+                             "accesses, a summary of the launches is printed at the end")
+    parser.add_argument("--sample", choices=sorted(sampling.MODES),
+                        help="analyse only a sample of the blocks or of the warps, chosen by a hash of their id")
+    parser.add_argument("--sample-rate", type=float, default=1.0, metavar="RATE",
+                        help="fraction of the blocks or warps analysed (default: 1)")
+    parser.add_argument("--sample-seed", type=int, default=0, metavar="N",
+                        help="seed of the hash choosing the blocks or warps")
+    parser.add_argument("--sample-blocks", type=parse_range, metavar="BEGIN:END",
+                        help="analyse only the blocks in [BEGIN, END)")
+    parser.add_argument("--function", action="append", default=[], metavar="PATTERN",
+                        help="check only the accesses of the functions whose name matches PATTERN "
+                             "(shell wildcards, may be repeated)")
+    parser.add_argument("--func-ids", type=parse_range, metavar="BEGIN:END",
+                        help="check only the accesses of the functions with func_id in [BEGIN, END)")
+    parser.add_argument("--inst-ids", type=parse_range, metavar="BEGIN:END",
+                        help="check only the accesses of the instructions with inst_id in [BEGIN, END)")
+    parser.add_argument("--space", choices=sorted(filters.SPACES),
+                        help="check only the accesses of one memory space")
+    parser.add_argument("--addrs", type=parse_addr_range, action="append", default=[], metavar="BEGIN:END",
+                        help="check only the accesses to addresses in [BEGIN, END), e.g. 0x7f0000:0x7f1000 "
+                             "(may be repeated)")
+    parser.add_argument("--func-cache", metavar="DIR", default=os.environ.get("FUNC_CACHE") or None,
+                        help="cache of the function tables shared with race_check_trace, the trace may refer "
+                             "to the functions of DIR by key (default: $FUNC_CACHE)")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="write a checkpoint to FILE at the end of a kernel every --checkpoint-every "
+                             "kernels, needs --trace, --binary or --capture")
+    parser.add_argument("--checkpoint-every", type=int, default=100, metavar="N",
+                        help="kernels between two checkpoints (default: 100)")
+    parser.add_argument("--resume", action="store_true",
+                        help="go on from the checkpoint in --checkpoint FILE, start from the beginning "
+                             "if there is none yet")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write timings, throughput, memory and shadow memory size of every kernel "
+                             "as JSON lines to FILE ('-' for stderr)")
+    args = parser.parse_args(argv)
+
+    if sum(1 for source in (args.binary, args.capture, args.trace) if source) > 1:
+        parser.error("only one of --binary, --capture and --trace can be used")
+    if args.kernels and not args.capture:
+        parser.error("--kernels needs --capture")
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.max_launches < 1:
+        parser.error("--max-launches must be at least 1")
+    if args.max_insts_per_address < 0:
+        parser.error("--max-insts-per-address must not be negative")
+    if args.kernel_jobs < 1:
+        parser.error("--kernel-jobs must be at least 1")
+    if args.kernel_jobs > 1:
+        if not (args.trace or args.capture):
+            parser.error("--kernel-jobs needs --trace or --capture")
+        if args.jobs > 1 or args.online or args.pipeline or args.memoize:
+            parser.error("--kernel-jobs cannot be used with --jobs, --online, --pipeline or --memoize")
+    if args.jobs > 1 and args.online:
+        parser.error("--online cannot be used with --jobs")
+
+    if args.checkpoint:
+        if not (args.trace or args.capture or args.binary) or args.binary == "-":
+            parser.error("--checkpoint needs --trace, --binary or --capture")
+        if args.kernel_jobs > 1:
+            parser.error("--checkpoint cannot be used with --kernel-jobs")
+        if args.checkpoint_every < 1:
+            parser.error("--checkpoint-every must be at least 1")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+
+    if not 0 <= args.sample_rate <= 1:
+        parser.error("--sample-rate must be between 0 and 1")
+
+    if args.memoize < 0:
+        parser.error("--memoize must be at least 0")
+    if args.memoize and args.online:
+        parser.error("--online cannot be used with --memoize")
+    if args.max_memory and args.online:
+        parser.error("--online cannot be used with --max-memory")
+
+    if args.engine == "numpy" and (args.online or args.drop_closed_sfr or args.report != "inst"):
+        parser.error("--online, --drop-closed-sfr and --report need the dict engine")
+    if args.engine == "ranges" and (args.online or args.drop_closed_sfr):
+        parser.error("--online and --drop-closed-sfr need the dict engine")
+
+    REPORT_INSTS = args.report != "addr"
+    REPORT_ADDRS = args.report != "inst"
+    ONLINE_REPORT = args.online
+    DROP_CLOSED_SFR = args.drop_closed_sfr
+    ENGINE = args.engine
+    JOBS = args.jobs
+    PIPELINE = args.pipeline
+    MAX_MEMORY = args.max_memory
+    SPILL_DIR = args.spill_dir
+    MEMO_CACHE_SIZE = args.memoize
+    KERNEL_JOBS = args.kernel_jobs
+    MAX_LAUNCHES = args.max_launches
+    MAX_INSTS_PER_ADDRESS = args.max_insts_per_address
+    if args.sample or args.sample_blocks:
+        block_begin, block_end = args.sample_blocks or (0, sampling.INT_MAX)
+        sampler = sampling.Sampler(sampling.MODES[args.sample or "block"], args.sample_rate,
+                                   args.sample_seed, block_begin, block_end)
+    access_filter = filters.AccessFilter(args.function, args.func_ids, args.inst_ids, args.space, args.addrs) or None
+    trace_parser.access_filter = access_filter
+
+    if JOBS > 1:
+        shard_pool = ShardPool(JOBS)
+    if PIPELINE:
+        kernel_pipeline = KernelPipeline(PIPELINE_DEPTH)
+    if MEMO_CACHE_SIZE:
+        launch_cache = LaunchCache(MEMO_CACHE_SIZE)
+    if args.func_cache:
+        func_cache = func_caches.FuncCache(args.func_cache)
+
+    state = None
+    position = None
+    if args.checkpoint:
+        if args.binary:
+            source = ("binary", os.path.abspath(args.binary))
+        elif args.capture:
+            source = ("capture", os.path.abspath(args.capture))
+        else:
+            source = ("trace", os.path.abspath(args.trace))
+        if args.resume and os.path.exists(args.checkpoint):
+            try:
+                state = checkpoint.read(args.checkpoint)
+                position = resume(state, source)
+            except (checkpoint.CheckpointError, TraceError) as e:
+                parser.error(str(e))
+        checkpointer = Checkpointer(args.checkpoint, source, args.checkpoint_every)
+    if args.metrics:
+        metrics_writer = metrics.MetricsWriter(args.metrics, state and state["metrics"])
+
+    try:
+        if args.binary:
+            process_binary(args.binary, position, resumed_launches(state))
+        elif KERNEL_JOBS > 1:
+            if args.capture:
+                process_kernels(KernelCapture(args.capture, args.kernels), KERNEL_JOBS)
+            else:
+                process_kernels(KernelTraceFile(args.trace), KERNEL_JOBS)
+        elif args.capture:
+            capture = trace_capture.Capture(args.capture)
+            if args.kernels and capture.concurrent():
+                raise TraceError("--kernels cannot select launches of a capture of concurrent launches")
+            kernel_ids = capture.kernel_ids(args.kernels)
+            after = kernel_ids[kernels_ended - 1] if kernels_ended else 0
+            process_message(capture.open(args.kernels, after), 0 if checkpointer else None)
+        elif args.trace:
+            with open(args.trace, "rb") as stream:
+                if position:
+                    stream.seek(position)
+                process_message(stream, (position or 0) if checkpointer else None, resumed_launches(state))
+        else:
+            process_message()
+    except TraceError as e:
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
+
+    if kernel_pipeline is not None:
+        kernel_pipeline.close()
+    if launch_cache is not None:
+        launch_cache.report()
+    if shard_pool is not None:
+        shard_pool.close()
+    if metrics_writer is not None:
+        metrics_writer.close()
+
+
 if __name__ == "__main__":
-    process_message()
\ No newline at end of file
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# NumPy engine of race_check_helper.py (--engine numpy).
+#
+# The accesses of a kernel are stored in columns (address, memory space,
+# SFR, thread, block, instruction, is_store) and races are found when the
+# kernel ends by sorting the accesses by address and counting distinct
+# writers and foreign readers of every group, instead of keeping a shadow
+# memory of Address objects. Races are returned in the same form as
+# ShadowMemory.find_races of race_check_helper.py.
+
+import array
+
+import numpy as np
+
+
+class ColumnShadowMemory:
+    def __init__(self, max_insts_per_address=0):
+        self.max_insts_per_address = max_insts_per_address
+
+        # columns filled by add/add_warp
+        self.addr = array.array('Q')
+        self.is_shared = array.array('B')
+        self.is_store = array.array('B')
+        self.SFR = array.array('q') # packed SFR
+        self.thread = array.array('q') # packed thread
+        self.block = array.array('q')
+        self.inst = array.array('q') # packed instruction
+
+        # columns of the records added by add_access_array, a list of tuples of
+        # arrays in the same order as above
+        self.chunks = []
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        self.addr.append(addr)
+        self.is_shared.append(1 if is_shared_memory else 0)
+        self.is_store.append(0 if is_load else 1)
+        self.SFR.append((block_id << 32) | SFR_id)
+        self.thread.append((warp_id << 5) | lane_id)
+        self.block.append(block_id)
+        self.inst.append((func_id << 32) | inst_id)
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        lanes = [lane_id for lane_id, addr in enumerate(addrs) if addr != 0]
+        n = len(lanes)
+        warp = warp_id << 5
+        self.addr.extend(addrs[lane_id] for lane_id in lanes)
+        self.is_shared.extend([1 if is_shared_memory else 0] * n)
+        self.is_store.extend([0 if is_load else 1] * n)
+        self.SFR.extend([(block_id << 32) | SFR_id] * n)
+        self.thread.extend(warp | lane_id for lane_id in lanes)
+        self.block.extend([block_id] * n)
+        self.inst.extend([(func_id << 32) | inst_id] * n)
+
+    # add the records of a structured array of mem_access_t
+    # (see binary_trace.access_array), lanes are expanded without a Python loop
+    def add_access_array(self, records):
+        rows, lanes = np.nonzero(records['addrs'])
+        if len(rows) == 0:
+            return
+        block = records['block_id'][rows].astype(np.int64)
+        self.chunks.append((
+            records['addrs'][rows, lanes],
+            records['is_shared_memory'][rows].astype(np.uint8),
+            (records['is_load'][rows] == 0).astype(np.uint8),
+            (block << 32) | records['SFR_id'][rows].astype(np.int64),
+            (records['warp_id'][rows].astype(np.int64) << 5) | lanes,
+            block,
+            (records['func_id'][rows].astype(np.int64) << 32) | records['inst_id'][rows].astype(np.int64),
+        ))
+
+    def columns(self):
+        columns = [
+            np.frombuffer(self.addr, dtype=np.uint64),
+            np.frombuffer(self.is_shared, dtype=np.uint8),
+            np.frombuffer(self.is_store, dtype=np.uint8),
+            np.frombuffer(self.SFR, dtype=np.int64),
+            np.frombuffer(self.thread, dtype=np.int64),
+            np.frombuffer(self.block, dtype=np.int64),
+            np.frombuffer(self.inst, dtype=np.int64),
+        ]
+        if not self.chunks:
+            return columns
+        # records added by add_access_array come after those added one by one,
+        # the order only matters for max_insts_per_address
+        return [np.concatenate([column] + [chunk[i] for chunk in self.chunks])
+                for i, column in enumerate(columns)]
+
+    def find_races(self):
+        addr, is_shared, is_store, SFR, thread, block, inst = self.columns()
+        is_shared = is_shared.astype(bool)
+        is_store = is_store.astype(bool)
+        cap = self.max_insts_per_address
+
+        # intra block shared memory
+        shared = np.flatnonzero(is_shared)
+        intra_shared_races = group_races([SFR[shared], addr[shared]], thread[shared],
+                                         is_store[shared], inst[shared], shared, cap)
+
+        # intra block global memory
+        glob = np.flatnonzero(~is_shared)
+        intra_global_races = group_races([SFR[glob], addr[glob]], thread[glob],
+                                         is_store[glob], inst[glob], glob, cap)
+
+        # inter block global memory
+        inter_global_races = group_races([addr[glob]], block[glob],
+                                         is_store[glob], inst[glob], glob, cap)
+
+        # races of addresses are only found by the dict engine
+        return intra_shared_races, intra_global_races, inter_global_races, set()
+
+
+# accesses are grouped by the key columns (e.g. SFR and address). A group is a
+# race if it has more than one distinct writer, or one writer and a reader
+# that is not the writer. ident is the thread (or block) of every access and
+# pos its position in the trace. Return the set of frozensets of the
+# instructions of racy groups
+def group_races(key_columns, ident, is_store, inst, pos, max_insts_per_address=0):
+    n = len(ident)
+    if n == 0:
+        return set()
+
+    # group id of every access
+    order = np.lexsort(key_columns[::-1])
+    new_group = np.zeros(n, dtype=bool)
+    new_group[0] = True
+    for column in key_columns:
+        sorted_column = column[order]
+        new_group[1:] |= sorted_column[1:] != sorted_column[:-1]
+    group = np.empty(n, dtype=np.int64)
+    group[order] = np.cumsum(new_group) - 1
+    num_groups = int(group[order[-1]]) + 1
+
+    # distinct writers of every group
+    writer_pairs = np.unique((group[is_store] << 32) | ident[is_store])
+    writer_group = writer_pairs >> 32
+    num_writers = np.bincount(writer_group, minlength=num_groups)
+    writer = np.full(num_groups, -1, dtype=np.int64)
+    writer[writer_group] = writer_pairs & 0xffffffff
+
+    racy = num_writers > 1
+
+    # readers other than the only writer
+    is_load = ~is_store
+    reader_group = group[is_load]
+    foreign = (num_writers[reader_group] == 1) & (ident[is_load] != writer[reader_group])
+    racy[reader_group[foreign]] = True
+
+    if not racy.any():
+        return set()
+
+    # distinct instructions of racy groups, with the position of their first access
+    selected = racy[group]
+    g = group[selected]
+    i = inst[selected]
+    p = pos[selected]
+    order = np.lexsort((p, i, g))
+    g = g[order]
+    i = i[order]
+    p = p[order]
+    first = np.ones(len(g), dtype=bool)
+    first[1:] = (g[1:] != g[:-1]) | (i[1:] != i[:-1])
+    g = g[first]
+    i = i[first]
+    p = p[first]
+
+    if max_insts_per_address:
+        # keep the instructions that access the address first
+        order = np.lexsort((p, g))
+        g = g[order]
+        i = i[order]
+        group_start = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+        rank = np.arange(len(g)) - np.repeat(group_start, np.diff(np.r_[group_start, len(g)]))
+        keep = rank < max_insts_per_address
+        g = g[keep]
+        i = i[keep]
+
+    boundaries = np.flatnonzero(g[1:] != g[:-1]) + 1
+    return {frozenset(part.tolist()) for part in np.split(i, boundaries)}
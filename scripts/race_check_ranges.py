@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# Range engine of race_check_helper.py (--engine ranges).
+#
+# The lanes of a warp access are stored as runs of consecutive lanes whose
+# addresses are base + stride * (lane - first lane), a coalesced warp is a
+# single run instead of 32 addresses. When the kernel ends the runs of every
+# SFR (and of the whole kernel for inter block races) are sorted by their
+# address interval, and only the runs overlapping another run are expanded
+# into a shadow memory of Address objects to find the races. A run that
+# overlaps no other run cannot race: its lanes access distinct addresses,
+# except a run of stride 0, which is kept if it stores. Overlapping runs
+# are not expanded either if none of them stores, or if they all access
+# the same addresses from the same threads (the same block for inter block
+# races), e.g. a load and a store of a[i] by thread i.
+# Races are returned in the same form as ShadowMemory.find_races of
+# race_check_helper.py.
+
+import array
+
+# a warp record in RangeShadowMemory.records is
+#   is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, number of runs
+# followed by a (first lane, number of lanes, base address, stride) for every run
+HEADER_SIZE = 8
+RUN_SIZE = 4
+
+
+# return the runs of the addresses of a warp (0 for inactive lanes)
+# as a flat list of (first lane, number of lanes, base address, stride)
+def warp_runs(addrs):
+    if type(addrs) is not list: # records of binary traces and of the shard workers
+        addrs = list(addrs)
+    base = addrs[0]
+    if base != 0:
+        # fast path for the coalesced and broadcast warps
+        stride = addrs[1] - base
+        if stride == 0:
+            if addrs == [base] * 32:
+                return [0, 32, base, 0]
+        elif addrs == list(range(base, base + 32 * stride, stride)):
+            return [0, 32, base, stride]
+
+    runs = []
+    count = 0
+    for lane_id, addr in enumerate(addrs):
+        if addr == 0:
+            if count:
+                runs += (first_lane, count, base, stride)
+                count = 0
+            continue
+        if count == 1:
+            stride = addr - base
+            count = 2
+        elif count and addr == base + stride * count:
+            count += 1
+        else:
+            if count:
+                runs += (first_lane, count, base, stride)
+            first_lane = lane_id
+            base = addr
+            stride = 0
+            count = 1
+    if count:
+        runs += (first_lane, count, base, stride)
+    return runs
+
+
+class RangeShadowMemory:
+    # new_shadow() returns the ShadowMemory the overlapping runs are
+    # expanded into when the kernel ends
+    def __init__(self, new_shadow):
+        self.new_shadow = new_shadow
+        self.records = array.array('q')
+        self.runs = 0
+        self.expanded_runs = 0
+        self.expanded_stats = None # stats of the shadow memory of the expanded runs
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        self.records.extend((is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, 1,
+                             lane_id, 1, addr, 0))
+        self.runs += 1
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        runs = warp_runs(addrs)
+        if not runs:
+            return
+        self.records.extend((is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id,
+                             len(runs) // RUN_SIZE))
+        self.records.extend(runs)
+        self.runs += len(runs) // RUN_SIZE
+
+    # return the positions in self.records of the runs that may race
+    def overlapping_runs(self):
+        records = self.records
+        intervals = {} # key: (is_shared_memory, packed SFR) or None for inter block, val: list of (low, high, run position)
+        keep = set()
+
+        pos = 0
+        end = len(records)
+        while pos < end:
+            is_load, is_shared_memory, block_id, _, _, _, SFR_id, num_runs = records[pos:pos + HEADER_SIZE]
+            warp_id = records[pos + 3]
+            SFR = (is_shared_memory, (block_id << 32) | SFR_id)
+            intra = intervals.get(SFR)
+            if intra is None:
+                intra = intervals[SFR] = []
+            pos += HEADER_SIZE
+            for run in range(pos, pos + num_runs * RUN_SIZE, RUN_SIZE):
+                count = records[run + 1]
+                base = records[run + 2]
+                stride = records[run + 3]
+                low, high = (base, base + stride * (count - 1)) if stride >= 0 else (base + stride * (count - 1), base)
+                intra.append((low, high, run, is_load, warp_id))
+                if not is_shared_memory:
+                    intervals.setdefault(None, []).append((low, high, run, is_load, block_id))
+                if stride == 0 and count > 1 and not is_load:
+                    keep.add(run)
+            pos += num_runs * RUN_SIZE
+
+        # runs are clustered by overlapping intervals, the runs of clusters
+        # that may race are kept
+        for key, runs in intervals.items():
+            if len(runs) < 2:
+                continue
+            runs.sort()
+            cluster = [runs[0]]
+            high = runs[0][1]
+            for interval in runs[1:]:
+                if interval[0] <= high:
+                    cluster.append(interval)
+                    if interval[1] > high:
+                        high = interval[1]
+                    continue
+                if len(cluster) > 1 and self.may_race(cluster, key is None):
+                    keep.update(interval[2] for interval in cluster)
+                cluster = [interval]
+                high = interval[1]
+            if len(cluster) > 1 and self.may_race(cluster, key is None):
+                keep.update(interval[2] for interval in cluster)
+
+        return keep
+
+    # cluster is a list of overlapping (low, high, run position, is_load, warp_id or block_id)
+    def may_race(self, cluster, inter_block):
+        if all(interval[3] for interval in cluster):
+            return False # loads only
+        records = self.records
+        first = None
+        for _, _, run, _, owner in cluster:
+            first_lane, count, base, stride = records[run:run + RUN_SIZE]
+            if inter_block:
+                # the block is the accessor, lanes do not matter
+                access = (owner, count, base, stride)
+            elif stride == 0 and count > 1:
+                return True # several threads access the address
+            else:
+                access = (owner, first_lane, count, base, stride)
+            if first is None:
+                first = access
+            elif access != first:
+                return True
+        return False
+
+    # return the races of instructions of the three kinds and the races of addresses
+    def find_races(self):
+        keep = self.overlapping_runs()
+        self.expanded_runs = len(keep)
+        shadow = self.new_shadow()
+        records = self.records
+
+        pos = 0
+        end = len(records)
+        while pos < end:
+            header = records[pos:pos + HEADER_SIZE - 1]
+            num_runs = records[pos + HEADER_SIZE - 1]
+            pos += HEADER_SIZE
+            addrs = None
+            for run in range(pos, pos + num_runs * RUN_SIZE, RUN_SIZE):
+                if run not in keep:
+                    continue
+                if addrs is None:
+                    addrs = [0] * 32
+                first_lane, count, base, stride = records[run:run + RUN_SIZE]
+                for i in range(count):
+                    addrs[first_lane + i] = base + stride * i
+            if addrs is not None:
+                shadow.add_warp(*header, addrs)
+            pos += num_runs * RUN_SIZE
+
+        races = shadow.find_races()
+        if hasattr(shadow, "stats"):
+            self.expanded_stats = shadow.stats()
+        return races
+
+    # number of runs stored and expanded, and what the shadow memory
+    # of the expanded runs tracked, for the metrics
+    def stats(self):
+        stats = {"runs": self.runs, "expanded_runs": self.expanded_runs}
+        stats.update(self.expanded_stats or {})
+        return stats
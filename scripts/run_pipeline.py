@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#
+# Run an application under an NVbit tool and pipe its trace to
+# race_check_helper.py, in place of the shell pipe of utils.sh:
+#
+#   run_pipeline.py --tool tools/race_check_trace/race_check_trace.so ./app args
+#   run_pipeline.py --helper "scripts/race_check_helper.py --engine numpy" --tee app.txt ./app
+#   run_pipeline.py --tool "" -- scripts/gen_trace.py --kernels 4    # stub producer, no GPU
+#
+# The output of the application is read through a pipe enlarged to
+# --pipe-size and queued in a ring of --buffer bytes of memory before it is
+# written to the helper. With --spool SIZE, bursts that do not fit in memory
+# are written to a temporary file (in --spool-dir) instead of throttling the
+# application. The application is throttled only when both are full.
+#
+# At the end, the rates of the application (producer) and of the helper
+# (consumer) are printed to stderr, with the time the application was
+# throttled, the time the helper waited for data and the time writes to the
+# helper blocked. The exit status is the status of the helper, or of the
+# application if the helper succeeded. If the application cannot be
+# started, the helper is stopped and the status is 126 (or 127 if the
+# application is not found), as in a shell.
+
+import argparse
+import collections
+import fcntl
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from sizes import parse_size
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# fcntl command to resize a pipe, Linux only
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+CHUNK_SIZE = 1 << 20
+
+
+# bytes queued between the application and the helper, in memory
+# and, once memory_limit is reached, in a spool file up to spool_limit
+class Ring:
+    def __init__(self, memory_limit, spool_limit=0, spool_dir=None):
+        self.memory_limit = memory_limit
+        self.spool_limit = spool_limit
+        self.spool_dir = spool_dir
+        self.chunks = collections.deque()
+        self.memory_bytes = 0
+        self.spool = None
+        self.spool_read = 0 # read and write offsets of the spool file
+        self.spool_write = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.put_stall = 0.0 # time put waited for room
+        self.get_stall = 0.0 # time get waited for data
+        self.peak_bytes = 0
+        self.spooled_bytes = 0
+
+    def queued(self):
+        return self.memory_bytes + self.spool_write - self.spool_read
+
+    # chunks go to the spool once it has data, so they are read in order
+    def put(self, chunk):
+        with self.cond:
+            start = time.perf_counter()
+            while True:
+                if self.spool_write == self.spool_read and (
+                        self.memory_bytes + len(chunk) <= self.memory_limit or not self.chunks):
+                    self.chunks.append(chunk)
+                    self.memory_bytes += len(chunk)
+                    break
+                if self.spool_write - self.spool_read + len(chunk) <= self.spool_limit:
+                    self.write_spool(chunk)
+                    break
+                self.cond.wait()
+            self.put_stall += time.perf_counter() - start
+            self.peak_bytes = max(self.peak_bytes, self.queued())
+            self.cond.notify_all()
+
+    def write_spool(self, chunk):
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile(prefix="race_check_spool_", dir=self.spool_dir)
+        os.pwrite(self.spool.fileno(), chunk, self.spool_write)
+        self.spool_write += len(chunk)
+        self.spooled_bytes += len(chunk)
+
+    # return the next chunk, None once the ring is closed and empty
+    def get(self):
+        with self.cond:
+            start = time.perf_counter()
+            while not self.queued() and not self.closed:
+                self.cond.wait()
+            self.get_stall += time.perf_counter() - start
+            if self.chunks:
+                chunk = self.chunks.popleft()
+                self.memory_bytes -= len(chunk)
+            elif self.spool_write > self.spool_read:
+                chunk = os.pread(self.spool.fileno(), min(CHUNK_SIZE, self.spool_write - self.spool_read),
+                                 self.spool_read)
+                self.spool_read += len(chunk)
+                if self.spool_read == self.spool_write:
+                    # the spool is empty, it is written from the start again
+                    self.spool_read = self.spool_write = 0
+                    self.spool.truncate(0)
+            else:
+                chunk = None
+            self.cond.notify_all()
+            return chunk
+
+    # no more chunks will be put
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+# a side of the pipeline, the rates are computed over the
+# time from the start of the run to its last byte
+class Rate:
+    def __init__(self, start):
+        self.start = start
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, size):
+        self.bytes += size
+        self.seconds = time.perf_counter() - self.start
+
+    def __str__(self):
+        return "{:.1f} MB in {:.2f} s ({:.1f} MB/s)".format(
+            self.bytes / 1e6, self.seconds, self.bytes / 1e6 / self.seconds if self.seconds else 0.0)
+
+
+# read the output of the application into the ring
+def produce(stream, ring, rate, tee):
+    fd = stream.fileno()
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        if not chunk:
+            break
+        rate.add(len(chunk))
+        if tee is not None:
+            tee.write(chunk)
+        ring.put(chunk)
+    ring.close()
+
+
+# write the ring to the helper, the ring is drained even if the helper
+# exits early so the application does not block
+class Consumer:
+    def __init__(self, stream, ring, rate):
+        self.stream = stream
+        self.ring = ring
+        self.rate = rate
+        self.write_stall = 0.0 # time writes to the helper blocked
+        self.broken = False
+
+    def run(self):
+        fd = self.stream.fileno()
+        while True:
+            chunk = self.ring.get()
+            if chunk is None:
+                break
+            if self.broken:
+                continue
+            start = time.perf_counter()
+            try:
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fd, view):]
+            except BrokenPipeError:
+                self.broken = True
+                continue
+            self.write_stall += time.perf_counter() - start
+            self.rate.add(len(chunk))
+        try:
+            self.stream.close()
+        except BrokenPipeError:
+            pass
+
+
+def enlarge_pipe(stream, size):
+    try:
+        fcntl.fcntl(stream.fileno(), F_SETPIPE_SZ, size)
+    except OSError:
+        pass # above /proc/sys/fs/pipe-max-size, the pipe keeps its size
+
+
+def report(producer, consumer, ring, helper_rate):
+    print("pipeline: application {}, helper {}".format(producer, helper_rate), file=sys.stderr)
+    print("pipeline: application throttled {:.2f} s, helper waited {:.2f} s for data, "
+          "writes to the helper blocked {:.2f} s".format(ring.put_stall, ring.get_stall, consumer.write_stall),
+          file=sys.stderr)
+    print("pipeline: peak buffered {:.1f} MB, spooled {:.1f} MB{}".format(
+        ring.peak_bytes / 1e6, ring.spooled_bytes / 1e6,
+        ", the helper exited before the end of the trace" if consumer.broken else ""), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an application under an NVbit tool and pipe its trace to race_check_helper.py.")
+    parser.add_argument("--tool", default=os.path.join(SCRIPTS_DIR, "..", "tools", "race_check_trace", "race_check_trace.so"),
+                        help="NVbit tool preloaded in the application, \"\" runs the application "
+                             "as it is (default: tools/race_check_trace/race_check_trace.so)")
+    parser.add_argument("--helper", default=None, metavar="COMMAND",
+                        help="command reading the trace on stdin (default: race_check_helper.py)")
+    parser.add_argument("--pipe-size", type=parse_size, default=parse_size("1M"), metavar="SIZE",
+                        help="size of the pipe of the application output (default: 1M)")
+    parser.add_argument("--buffer", type=parse_size, default=parse_size("256M"), metavar="SIZE",
+                        help="memory queued between the application and the helper (default: 256M)")
+    parser.add_argument("--spool", type=parse_size, default=0, metavar="SIZE",
+                        help="disk queued once --buffer is full (default: 0, the application is throttled)")
+    parser.add_argument("--spool-dir", default=None, metavar="DIR",
+                        help="directory of the spool file (default: the system temporary directory)")
+    parser.add_argument("--tee", default=None, metavar="FILE",
+                        help="also write the trace to FILE")
+    parser.add_argument("--quiet", action="store_true",
+                        help="do not print the rates at the end")
+    parser.add_argument("app", metavar="APP", help="application to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, metavar="ARGS", help="arguments of the application")
+    args = parser.parse_args()
+
+    if args.buffer < 1:
+        parser.error("--buffer must be positive")
+
+    env = dict(os.environ)
+    if args.tool:
+        if not os.path.exists(args.tool):
+            parser.error("no NVbit tool {}, build it with utils.sh make_tool".format(args.tool))
+        env["LD_PRELOAD"] = os.path.abspath(args.tool)
+    if args.helper:
+        helper_args = shlex.split(args.helper)
+    else:
+        helper_args = [sys.executable, os.path.join(SCRIPTS_DIR, "race_check_helper.py")]
+
+    start = time.perf_counter()
+    helper = subprocess.Popen(helper_args, stdin=subprocess.PIPE)
+    try:
+        app = subprocess.Popen([args.app] + args.args, stdout=subprocess.PIPE, env=env)
+    except OSError as e:
+        # the helper reads an empty trace and exits
+        helper.stdin.close()
+        helper.wait()
+        print("run_pipeline.py: cannot run {}: {}".format(args.app, e.strerror or e), file=sys.stderr)
+        sys.exit(127 if isinstance(e, FileNotFoundError) else 126)
+    enlarge_pipe(app.stdout, args.pipe_size)
+
+    ring = Ring(args.buffer, args.spool, args.spool_dir)
+    producer = Rate(start)
+    consumer = Consumer(helper.stdin, ring, Rate(start))
+    tee = open(args.tee, "wb") if args.tee else None
+    writer = threading.Thread(target=consumer.run, daemon=True)
+    writer.start()
+    try:
+        produce(app.stdout, ring, producer, tee)
+        writer.join()
+    except KeyboardInterrupt:
+        app.kill()
+        raise
+    finally:
+        if tee is not None:
+            tee.close()
+    app_status = app.wait()
+    helper_status = helper.wait()
+    helper_rate = consumer.rate
+    helper_rate.seconds = time.perf_counter() - start # the helper ends with its last report
+
+    if not args.quiet:
+        report(producer, consumer, ring, helper_rate)
+    sys.exit(helper_status or app_status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# Sampling of the accesses by block or by warp, for race_check_helper.py
+# (--sample) and NVbit tool race_check_trace (SAMPLE=block|warp).
+#
+# A block (or a warp) is kept if it is in the range of blocks and the hash of
+# its block_id (or block_id and warp_id) is below the rate. sample_hash is
+# the function of tools/race_check_trace/common.h, so for the same seed the
+# tool and the helper keep the same blocks.
+#
+# Races between a kept and a dropped block (or warp) are not found, the
+# coverage printed with the report tells how much of the kernel was checked.
+
+SAMPLE_NONE = 0
+SAMPLE_BLOCK = 1
+SAMPLE_WARP = 2
+MODES = {"block": SAMPLE_BLOCK, "warp": SAMPLE_WARP}
+
+# rates are kept as a threshold on the low bits of the hash
+SAMPLE_SCALE = 1 << 16
+
+INT_MAX = (1 << 31) - 1
+
+
+def sample_hash(x, seed):
+    x = (x ^ seed) & 0xffffffff
+    x = (x * 0x9e3779b1) & 0xffffffff
+    x ^= x >> 16
+    x = (x * 0x85ebca6b) & 0xffffffff
+    x ^= x >> 13
+    x = (x * 0xc2b2ae35) & 0xffffffff
+    x ^= x >> 16
+    return x
+
+
+class Sampler:
+    # rate is the fraction of blocks (or warps) kept,
+    # only blocks in [block_begin, block_end) are kept
+    def __init__(self, mode, rate=1.0, seed=0, block_begin=0, block_end=INT_MAX):
+        self.mode = mode
+        self.threshold = round(rate * SAMPLE_SCALE)
+        self.seed = seed & 0xffffffff
+        self.block_begin = block_begin
+        self.block_end = block_end
+
+    # the sampling of race_check_trace, "mode,threshold,seed,block_begin,block_end"
+    # in a "#sample#" line or a sample_config_t in binary traces
+    @classmethod
+    def from_config(cls, mode, threshold, seed, block_begin, block_end):
+        sampler = cls(mode, 0, seed, block_begin, block_end)
+        sampler.threshold = threshold
+        return sampler
+
+    @classmethod
+    def from_line(cls, line):
+        mode, threshold, seed, block_begin, block_end = line.split(",")
+        return cls.from_config(MODES[mode], int(threshold), int(seed), int(block_begin), int(block_end))
+
+    def to_line(self):
+        mode = [name for name, value in MODES.items() if value == self.mode][0]
+        return "{},{},{},{},{}".format(mode, self.threshold, self.seed, self.block_begin, self.block_end)
+
+    def keep(self, block_id, warp_id):
+        if self.mode == SAMPLE_NONE:
+            return True
+        if block_id < self.block_begin or block_id >= self.block_end:
+            return False
+        if self.mode == SAMPLE_BLOCK:
+            key = block_id & 0xffffffff
+        else:
+            key = ((block_id << 6) | warp_id) & 0xffffffff
+        return (sample_hash(key, self.seed) & (SAMPLE_SCALE - 1)) < self.threshold
+
+    def __str__(self):
+        text = "{}s sampled at {:.1f}% (seed {})".format(
+            "block" if self.mode == SAMPLE_BLOCK else "warp", 100 * self.threshold / SAMPLE_SCALE, self.seed)
+        if self.block_begin != 0 or self.block_end != INT_MAX:
+            text += ", blocks {}:{}".format(self.block_begin, self.block_end)
+        return text
+
+
+# shadow memory of the accesses of the blocks (or warps) kept by sampler,
+# and coverage of the sample
+class SampledShadowMemory:
+    def __init__(self, shadow, sampler):
+        self.shadow = shadow
+        self.sampler = sampler
+        self.warps = {} # key: (block_id, warp_id), val: whether it is kept
+        self.accesses = 0
+        self.kept_accesses = 0
+
+    def add(self, is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr):
+        if self.sample(block_id, warp_id, 1):
+            self.shadow.add(is_load, is_shared_memory, block_id, warp_id, lane_id, func_id, inst_id, SFR_id, addr)
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        if self.sample(block_id, warp_id, len(addrs) - addrs.count(0)):
+            self.shadow.add_warp(is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs)
+
+    def sample(self, block_id, warp_id, accesses):
+        key = (block_id, warp_id)
+        keep = self.warps.get(key)
+        if keep is None:
+            keep = self.warps[key] = self.sampler.keep(block_id, warp_id)
+        self.accesses += accesses
+        if keep:
+            self.kept_accesses += accesses
+        return keep
+
+    def end(self):
+        if hasattr(self.shadow, "end"):
+            self.shadow.end()
+
+    def find_races(self):
+        return self.shadow.find_races()
+
+    # (kept, seen) numbers of blocks, warps and accesses
+    def coverage(self):
+        blocks = {}
+        for (block_id, warp_id), keep in self.warps.items():
+            blocks[block_id] = blocks.get(block_id, False) or keep
+        return ((sum(blocks.values()), len(blocks)),
+                (sum(self.warps.values()), len(self.warps)),
+                (self.kept_accesses, self.accesses))
+
+
+def format_coverage(coverage):
+    parts = []
+    for (kept, seen), name in zip(coverage, ("blocks", "warps", "accesses")):
+        parts.append("{}/{} {} ({:.1f}%)".format(kept, seen, name, 100 * kept / seen if seen else 100))
+    return ", ".join(parts)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+#
+# Sizes in bytes given on the command line of race_check_helper.py
+# (--max-memory) and run_pipeline.py (--pipe-size, --buffer, --spool).
+
+import argparse
+
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+# parse a size in bytes with an optional K, M or G suffix
+def parse_size(text):
+    unit = UNITS.get(text[-1:].upper())
+    try:
+        return int(float(text[:-1] if unit else text) * (unit or 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size {}".format(text))
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+#
+# Capture of the text output of NVbit tool "race_check_trace" into a
+# compressed file indexed by kernel launch, so launches can be analysed
+# again without running the application:
+#
+#   LD_PRELOAD=... ./app | trace_capture.py capture app.rct | race_check_helper.py
+#   trace_capture.py list app.rct
+#   trace_capture.py extract app.rct --kernels 3,7-9 > part.txt
+#   race_check_helper.py --capture app.rct --kernels 3,7-9
+#
+# capture copies stdin to stdout while it writes the capture.
+#
+# The capture is a sequence of gzip members. Every launch has members of
+# control lines (functions, sampling) and members of accesses, the last one
+# ends with its "#kernelends#". The whole file is still a gzip file, zcat
+# gives back the trace.
+# The index FILE.index has one JSON line per launch, appended as the
+# launch ends so a capture cut short can still be replayed:
+#   {"kernel": launch id (from 1), "members": [[kind, offset, length], ...],
+#    "size": bytes of the accesses, "functions": [[func_id, name], ...] defined
+#    in the launch, "ended": false for the trailing part of a trace with no "#kernelends#",
+#    "concurrent": true if the part has "#launch#" lines}
+# Replaying a launch decompresses its members and the control members of
+# the launches before it, never the accesses of other launches.
+
+import argparse
+import json
+import re
+import sys
+import zlib
+
+import trace_parser
+
+INDEX_SUFFIX = ".index"
+
+META = "meta"
+ACCESSES = "accesses"
+
+# gzip container for zlib
+GZIP_WBITS = 31
+
+BLANK = re.compile(rb"\s*")
+
+
+# parse "3,7-9,12-" into a function telling whether a launch id is selected
+def parse_kernels(text):
+    ranges = []
+    try:
+        for part in text.split(","):
+            begin, dash, end = part.partition("-")
+            begin = int(begin)
+            if not dash:
+                end = begin
+            elif end:
+                end = int(end)
+            else:
+                end = None
+            ranges.append((begin, end))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected launch ids such as 3,7-9,12-")
+    return lambda kernel_id: any(begin <= kernel_id and (end is None or kernel_id <= end) for begin, end in ranges)
+
+
+class CaptureWriter:
+    def __init__(self, path, level=6):
+        self.file = open(path, "wb")
+        self.index = open(path + INDEX_SUFFIX, "w")
+        self.level = level
+        self.kernel_id = 1
+        self.num_functions = 0
+        self.kind = None # kind of the member being written
+        self.compressor = None
+        self.offset = 0 # offset of the member being written
+        self.start_kernel()
+
+    def start_kernel(self):
+        self.members = []
+        self.size = 0
+        self.functions = []
+        self.concurrent = False
+
+    def write(self, kind, data):
+        if kind != self.kind:
+            self.end_member()
+            self.kind = kind
+            self.compressor = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+            self.offset = self.file.tell()
+        self.file.write(self.compressor.compress(data))
+        if kind == ACCESSES:
+            self.size += len(data)
+
+    def end_member(self):
+        if self.kind is None:
+            return
+        self.file.write(self.compressor.flush())
+        self.members.append([self.kind, self.offset, self.file.tell() - self.offset])
+        self.kind = None
+
+    def end_kernel(self, ended=True):
+        self.end_member()
+        self.index.write(json.dumps({"kernel": self.kernel_id, "members": self.members, "size": self.size,
+                                     "functions": self.functions, "ended": ended,
+                                     "concurrent": self.concurrent}) + "\n")
+        self.index.flush()
+        self.kernel_id += 1
+        self.start_kernel()
+
+    # split a chunk of whole lines (see trace_parser.read_chunks) into members
+    def add_chunk(self, chunk):
+        pos = 0
+        for m in trace_parser.CONTROL_LINE.finditer(chunk):
+            start = m.start()
+            if start > pos:
+                self.add_lines(chunk, pos, start)
+            end = m.end() + 1 # with the line feed
+            name = m.group(1)
+            if name == b"kernelends":
+                self.write(ACCESSES, chunk[start:end])
+                self.end_kernel()
+            else:
+                if name == b"func_begin" or name == b"func_ref":
+                    func_name = m.group(2).decode(errors="replace")
+                    if name == b"func_ref":
+                        func_name = func_name.partition(",")[2]
+                    self.functions.append([self.num_functions, func_name])
+                    self.num_functions += 1
+                elif name == b"launch":
+                    self.concurrent = True
+                self.write(META, chunk[start:end])
+            pos = end
+        if pos < len(chunk):
+            self.add_lines(chunk, pos, len(chunk))
+
+    # lines other than control lines, blank lines between
+    # control lines stay in the control member
+    def add_lines(self, chunk, start, end):
+        if self.kind == META and BLANK.fullmatch(chunk, start, end):
+            self.write(META, chunk[start:end])
+        else:
+            self.write(ACCESSES, chunk[start:end])
+
+    def close(self):
+        if self.kind is not None or self.members:
+            self.end_kernel(ended=False)
+        self.file.close()
+        self.index.close()
+
+
+class Capture:
+    def __init__(self, path):
+        self.path = path
+        with open(path + INDEX_SUFFIX) as index:
+            self.kernels = [json.loads(line) for line in index if line.strip()]
+
+    # functions of the capture, a list of names indexed by func_id
+    def functions(self):
+        return [name for kernel in self.kernels for func_id, name in kernel["functions"]]
+
+    # ids of the launches that ended and are selected
+    def kernel_ids(self, selected=None):
+        return [kernel["kernel"] for kernel in self.kernels
+                if kernel["ended"] and (selected is None or selected(kernel["kernel"]))]
+
+    # yield the text of the trace of the selected launches, with
+    # the control lines of the launches before them. Launches up to
+    # launch id after are skipped with their control lines
+    def replay(self, selected=None, after=0):
+        kernel_ids = set(self.kernel_ids(selected))
+        last = max(kernel_ids, default=0)
+        with open(self.path, "rb") as f:
+            for kernel in self.kernels:
+                if kernel["kernel"] <= after:
+                    continue
+                if kernel["kernel"] > last:
+                    break
+                for kind, offset, length in kernel["members"]:
+                    if kind == META or kernel["kernel"] in kernel_ids:
+                        yield from read_member(f, offset, length)
+
+    def open(self, selected=None, after=0):
+        return ReplayStream(self.replay(selected, after))
+
+    # whether the trace is a trace of concurrent launches, its
+    # parts end with the end of a launch but are not launches then
+    def concurrent(self):
+        return any(kernel.get("concurrent") for kernel in self.kernels)
+
+    # yield the text of the control members of all the launches
+    def meta(self):
+        with open(self.path, "rb") as f:
+            for kernel in self.kernels:
+                for kind, offset, length in kernel["members"]:
+                    if kind == META:
+                        yield from read_member(f, offset, length)
+
+
+# yield the decompressed data of the gzip member at offset
+def read_member(f, offset, length, chunk_size=trace_parser.CHUNK_SIZE):
+    f.seek(offset)
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    while length > 0:
+        data = f.read(min(chunk_size, length))
+        if not data:
+            break
+        length -= len(data)
+        data = decompressor.decompress(data)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+# binary stream over the pieces of a replay, for trace_parser.parse_stream
+class ReplayStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            piece = next(self.pieces, None)
+            if piece is None:
+                break
+            self.buffer += piece
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+def capture(args):
+    writer = CaptureWriter(args.file, args.level)
+    stdout = sys.stdout.buffer
+    try:
+        for chunk in trace_parser.read_chunks(sys.stdin.buffer):
+            stdout.write(chunk)
+            stdout.flush()
+            writer.add_chunk(chunk)
+    finally:
+        writer.close()
+
+
+def list_kernels(args):
+    capture = Capture(args.file)
+    functions = capture.functions()
+    for kernel in capture.kernels:
+        compressed = sum(length for kind, offset, length in kernel["members"] if kind == ACCESSES)
+        defined = ", ".join(name for func_id, name in kernel["functions"])
+        print("{:>6} {:>14} bytes {:>12} compressed{}{}".format(
+            kernel["kernel"], kernel["size"], compressed,
+            "" if kernel["ended"] else " (not ended)",
+            "  defines: " + defined if defined else ""))
+    print("{} launches, {} functions".format(len(capture.kernel_ids()), len(functions)))
+
+
+def extract(args):
+    stdout = sys.stdout.buffer
+    for data in Capture(args.file).replay(args.kernels):
+        stdout.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture the output of race_check_trace, list and extract its kernel launches.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("capture", help="copy stdin to stdout and capture it to FILE")
+    command.add_argument("file", metavar="FILE")
+    command.add_argument("--level", type=int, default=6, choices=range(1, 10), metavar="1-9",
+                         help="compression level (default: 6)")
+    command.set_defaults(run=capture)
+
+    command = commands.add_parser("list", help="list the kernel launches of a capture")
+    command.add_argument("file", metavar="FILE")
+    command.set_defaults(run=list_kernels)
+
+    command = commands.add_parser("extract", help="write the trace of some kernel launches to stdout")
+    command.add_argument("file", metavar="FILE")
+    command.add_argument("--kernels", type=parse_kernels, metavar="IDS",
+                         help="launch ids, e.g. 3,7-9,12- (default: all)")
+    command.set_defaults(run=extract)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+#
+# Parser of the text output of NVbit tool "race_check_trace".
+#
+# The trace is read in large binary chunks. The few control lines
+# (#kernelends#, #func_begin#, #SASS#, #func_end#, #func_ref#, #sample#, #launch#) are located with a regex,
+# and the "#ld#"/"#st#" lines between them are split into fields with a few
+# bytes operations over the whole run and converted column by column.
+# All the lanes of a warp instruction share the same fields except lane_id
+# and addr, so those fields (the header) are converted once and cached.
+#
+# Accesses are returned as typed tuples (header, lane_id, addr) where header is
+#   (is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id)
+# and is the same object for all the lanes of a warp instruction.
+#
+# Lines with 10 fields, where the block is given as cta_id_x, cta_id_y,
+# cta_id_z (the input of race_check_helper_memaddr.py), are parsed too.
+# Their blocks are numbered in order of appearance, see block_cta_ids
+#
+# Accesses dropped by access_filter (see access_filter.py) are filtered as
+# their header is cached, before their addresses are converted.
+
+import itertools
+import operator
+import re
+
+CHUNK_SIZE = 1 << 20
+
+# events yielded by parse_stream
+ACCESSES = 0 # value: list of access tuples
+KERNEL_END = 1 # value: id of the launch that ended, None if the trace has no launch ids
+FUNC_BEGIN = 2 # value: function name
+SASS = 3 # value: SASS of an instruction
+FUNC_END = 4 # value: None
+SAMPLE = 5 # value: sampling of race_check_trace, see sampling.Sampler.from_line
+LAUNCH = 6 # value: id of the launch of the accesses that follow
+FUNC_REF = 7 # value: "key,function name" of a function of the function cache, see func_cache.py
+POSITION = 8 # value: offset in the stream after the "#kernelends#" line before it (parse_stream with an offset)
+
+# format: "#ld#is_shared_memory,block_id,warp_id,lane_id,func_id,inst_id,SFR_id,addr"
+ACCESS_LINE = re.compile(rb"^(#(?:ld|st)#-?\d+),(-?\d+),(-?\d+),(\d+),(-?\d+),(-?\d+),(-?\d+),(0x[0-9a-fA-F]+)$", re.M)
+# format: "#ld#is_shared_memory,cta_id_x,cta_id_y,cta_id_z,warp_id,lane_id,func_id,inst_id,SFR_id,addr"
+ACCESS_LINE_CTA = re.compile(rb"^(#(?:ld|st)#-?\d+),(-?\d+),(-?\d+),(-?\d+),(-?\d+),(\d+),(-?\d+),(-?\d+),(-?\d+),(0x[0-9a-fA-F]+)$", re.M)
+CONTROL_LINE = re.compile(rb"^#(kernelends|func_end|func_begin|func_ref|SASS|sample|launch)#(.*)$", re.M)
+
+CONTROL_EVENTS = {b"kernelends": KERNEL_END, b"func_begin": FUNC_BEGIN,
+                  b"SASS": SASS, b"func_end": FUNC_END, b"func_ref": FUNC_REF, b"sample": SAMPLE,
+                  b"launch": LAUNCH}
+
+LANES = {str(lane_id).encode(): lane_id for lane_id in range(32)}
+
+cta_blocks = {} # key: (cta_id_x, cta_id_y, cta_id_z), val: block_id
+block_cta_ids = [] # (cta_id_x, cta_id_y, cta_id_z) of every block_id
+
+
+def block_of_cta(cta_id):
+    block_id = cta_blocks.get(cta_id)
+    if block_id is None:
+        block_id = cta_blocks[cta_id] = len(block_cta_ids)
+        block_cta_ids.append(cta_id)
+    return block_id
+
+
+# parse one line, return None for unwanted output.
+# This is the straightforward parser, parse_stream is much faster
+def parse_line(line):
+    temp = line.strip('\n')[4:].split(",")
+
+    if len(temp) == 10:
+        block_id = block_of_cta((int(temp[1]), int(temp[2]), int(temp[3])))
+        temp[1:4] = [block_id]
+    if (len(temp) != 8):  # skip unwanted output
+        return None
+
+    kind = line[:4]
+    if kind == "#ld#":
+        is_load = True
+    elif kind == "#st#":
+        is_load = False
+    else:
+        return None
+
+    return (is_load, temp[0] == '1', int(temp[1]), int(temp[2]), int(temp[3]),
+            int(temp[4]), int(temp[5]), int(temp[6]), int(temp[7], 16))
+
+
+# key: the raw header fields (b"#ld#is_shared_memory", block_id, warp_id, func_id, inst_id, SFR_id)
+# or (b"#ld#is_shared_memory", cta_id_x, cta_id_y, cta_id_z, warp_id, func_id, inst_id, SFR_id)
+# val: the header tuple
+class HeaderCache(dict):
+    MAX_SIZE = 1 << 16
+
+    def __missing__(self, fields):
+        key = fields
+        kind = fields[0][:4]
+        if kind != b"#ld#" and kind != b"#st#":
+            raise ValueError("not an access line")
+        if len(fields) == 8:
+            block_id = block_of_cta((int(fields[1]), int(fields[2]), int(fields[3])))
+            fields = (fields[0], block_id) + fields[4:]
+        header = (kind == b"#ld#", fields[0][4:] == b"1", int(fields[1]), int(fields[2]),
+                  int(fields[3]), int(fields[4]), int(fields[5]))
+        if access_filter is not None and not access_filter.keep_header(header):
+            header = None # filtered, its lanes are dropped
+        if len(self) >= self.MAX_SIZE:
+            self.clear()
+        self[key] = header
+        return header
+
+
+header_cache = HeaderCache()
+
+# access_filter.AccessFilter of the accesses kept, None keeps every access.
+# It must be set before the trace is parsed, the filtered headers are cached
+access_filter = None
+
+
+def accesses_of_columns(kind, block, warp, lane, func, inst, SFR, addr):
+    headers = map(header_cache.__getitem__, zip(kind, block, warp, func, inst, SFR))
+    if access_filter is not None:
+        return filter_accesses(headers, lane, addr)
+    return list(zip(headers, map(LANES.__getitem__, lane), map(int, addr, itertools.repeat(16))))
+
+
+def accesses_of_cta_columns(kind, x, y, z, warp, lane, func, inst, SFR, addr):
+    headers = map(header_cache.__getitem__, zip(kind, x, y, z, warp, func, inst, SFR))
+    if access_filter is not None:
+        return filter_accesses(headers, lane, addr)
+    return list(zip(headers, map(LANES.__getitem__, lane), map(int, addr, itertools.repeat(16))))
+
+
+# drop the lanes of the filtered headers before converting their addresses,
+# then the addresses out of the ranges of the filter
+def filter_accesses(headers, lane, addr):
+    headers = list(headers)
+    kept = list(map(operator.is_not, headers, itertools.repeat(None)))
+    if not any(kept):
+        return []
+    compress = itertools.compress
+    accesses = zip(compress(headers, kept), map(LANES.__getitem__, compress(lane, kept)),
+                   map(int, compress(addr, kept), itertools.repeat(16)))
+    keep_addr = access_filter.address_filter()
+    if keep_addr is not None:
+        return [access for access in accesses if keep_addr(access[2])]
+    return list(accesses)
+
+
+# return the access tuples of the "#ld#"/"#st#" lines in chunk[start:end]
+def parse_accesses(chunk, start=0, end=None):
+    if end is None:
+        end = len(chunk)
+
+    # fast path, the run only has access lines
+    tokens = chunk[start:end].split()
+    if not tokens:
+        return []
+    fields = b",".join(tokens).split(b",")
+    try:
+        if len(fields) == 8 * len(tokens):
+            return accesses_of_columns(*(fields[i::8] for i in range(8)))
+        if len(fields) == 10 * len(tokens):
+            return accesses_of_cta_columns(*(fields[i::10] for i in range(10)))
+    except (ValueError, KeyError):
+        pass
+
+    # other output is mixed with the access lines
+    found = ACCESS_LINE.findall(chunk, start, end)
+    if found:
+        return accesses_of_columns(*zip(*found))
+    found = ACCESS_LINE_CTA.findall(chunk, start, end)
+    if found:
+        return accesses_of_cta_columns(*zip(*found))
+    return []
+
+
+# return the event (kind, value) of a match of CONTROL_LINE, None if it is not one
+def control_event(m):
+    event = CONTROL_EVENTS[m.group(1)]
+    if event == FUNC_BEGIN or event == SASS or event == SAMPLE or event == FUNC_REF:
+        return event, m.group(2).decode(errors="replace")
+    if m.group(2) == b"": # "#kernelends#" and "#func_end#" are the whole line
+        return event, None
+    if (event == KERNEL_END or event == LAUNCH) and m.group(2).isdigit():
+        # traces of concurrent launches: "#launch#N" and "#kernelends#N"
+        return event, int(m.group(2))
+    return None
+
+
+# yield the events (kind, value) of a chunk, base is the offset
+# of the chunk in the stream if POSITION events are wanted
+def parse_chunk(chunk, base=None):
+    pos = 0
+    for m in CONTROL_LINE.finditer(chunk):
+        if m.start() > pos:
+            accesses = parse_accesses(chunk, pos, m.start())
+            if accesses:
+                yield ACCESSES, accesses
+        control = control_event(m)
+        if control is not None:
+            yield control
+            if base is not None and control[0] == KERNEL_END:
+                yield POSITION, base + min(m.end() + 1, len(chunk))
+        pos = m.end()
+    if pos < len(chunk):
+        accesses = parse_accesses(chunk, pos)
+        if accesses:
+            yield ACCESSES, accesses
+
+
+# yield the chunks of a stream, each one ends at the end of a line. A chunk holds
+# what is available (read1) rather than waiting for chunk_size bytes, so the
+# lines of a pipe are parsed as soon as they are written (see --online)
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    read = getattr(stream, "read1", None) or stream.read
+    rest = b""
+    while True:
+        data = read(chunk_size)
+        if not data:
+            if rest:
+                yield rest
+            return
+        if rest:
+            data = rest + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end]
+
+
+# yield the events (kind, value) of a binary stream (e.g. sys.stdin.buffer).
+# With the offset of the stream, the end of every kernel is followed by its
+# POSITION, where the stream can be read again from (see checkpoint.py)
+def parse_stream(stream, chunk_size=CHUNK_SIZE, offset=None):
+    for chunk in read_chunks(stream, chunk_size):
+        yield from parse_chunk(chunk, offset)
+        if offset is not None:
+            offset += len(chunk)
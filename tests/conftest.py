@@ -0,0 +1,86 @@
+#
+# Fixtures of the tests of the scripts: traces written by gen_trace.py and
+# the verdicts of race_check_helper.py on them. The scripts are run as
+# processes, as they are in a pipeline, and their modules are importable
+# from the tests.
+#
+#   python -m pytest -q tests
+#
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+KERNEL_SUMMARY = re.compile(r"(\d+)th execution of kernel\.")
+MEMOIZED = re.compile(r"(\d+)th execution of kernel has the same accesses as the (\d+)th execution")
+RACE_HEADER = "Warning! There may be an "
+ONLINE_HEADER = "Warning! Found an "
+
+
+def run_script(name, *args, **kwargs):
+    kwargs.setdefault("check", True)
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, name)] + [str(a) for a in args],
+                          capture_output=True, **kwargs)
+
+
+# races of instructions of every kernel of a report:
+# {kernel_id: sorted [(kind, (instruction, ...))]}
+# the races reported as found by --online are repeated at the end
+# of the kernel, only those are kept. A launch not checked again by
+# --memoize has the races of the launch it repeats
+def parse_verdicts(output):
+    kernels = {}
+    races = []
+    insts = None
+    for line in ANSI_ESCAPE.sub("", output).splitlines():
+        summary = KERNEL_SUMMARY.search(line)
+        memoized = MEMOIZED.search(line)
+        if line.startswith(RACE_HEADER):
+            insts = []
+            races.append((line[len(RACE_HEADER):].split(" data race")[0], insts))
+        elif line.startswith(ONLINE_HEADER):
+            insts = None
+        elif summary:
+            kernels[int(summary.group(1))] = sorted((kind, tuple(sorted(i))) for kind, i in races)
+            races = []
+            insts = None
+        elif memoized:
+            kernels[int(memoized.group(1))] = kernels[int(memoized.group(2))]
+        elif insts is not None and line:
+            insts.append(line)
+    return kernels
+
+
+# run_script, for the tests of the other scripts
+@pytest.fixture(scope="session")
+def script():
+    return run_script
+
+
+# a trace of gen_trace.py with the given arguments, written once per session
+@pytest.fixture(scope="session")
+def gen_trace(tmp_path_factory):
+    traces = {}
+
+    def gen(*args):
+        if args not in traces:
+            path = tmp_path_factory.mktemp("trace") / "trace"
+            run_script("gen_trace.py", *args, "-o", path)
+            traces[args] = str(path)
+        return traces[args]
+    return gen
+
+
+# the verdicts of race_check_helper.py with the given arguments
+@pytest.fixture(scope="session")
+def verdicts():
+    def run(*args, **kwargs):
+        return parse_verdicts(run_script("race_check_helper.py", *args, **kwargs).stdout.decode())
+    return run
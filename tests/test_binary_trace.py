@@ -0,0 +1,159 @@
+#
+# A text trace converted by binary_trace.py must read back as the same
+# events, and must give the same verdicts with --binary.
+#
+
+import io
+import os
+import re
+
+import pytest
+
+import binary_trace
+import sampling
+import trace_parser
+
+COMMON_H = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "tools", "race_check_trace", "common.h")
+
+# name: arguments of gen_trace.py
+TRACES = {
+    "serial": ("--races", 3, "--kernels", 2, "--seed", 7),
+    "sampled": ("--races", 3, "--kernels", 2, "--seed", 7, "--sample", "warp", "--sample-rate", 0.5),
+    "concurrent": ("--streams", 3, "--races", 2, "--kernels", 4, "--seed", 5),
+}
+
+FUNC_REF_TRACE = b"""#func_ref#0123456789abcdef0123456789abcdef,kernel(int*)
+#ld#0,1,0,3,0,0,0,0x00007f0000000010
+#st#1,1,2,31,0,1,2,0x0000000000000100
+#kernelends#
+"""
+
+
+# events of a text trace, accesses one per lane:
+# ("access", (is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id), lane_id, addr)
+def text_events(data):
+    events = []
+    for event, value in trace_parser.parse_stream(io.BytesIO(data)):
+        if event == trace_parser.ACCESSES:
+            events.extend(("access", tuple(int(v) for v in header), lane_id, addr)
+                          for header, lane_id, addr in value)
+        elif event == trace_parser.FUNC_BEGIN:
+            events.append(["func", value, []])
+        elif event == trace_parser.SASS:
+            events[-1][2].append(value)
+        elif event == trace_parser.FUNC_END:
+            events[-1] = tuple(events[-1])
+        elif event == trace_parser.FUNC_REF:
+            events.append(("func_ref",) + tuple(value.split(",", 1)))
+        elif event == trace_parser.SAMPLE:
+            sampler = sampling.Sampler.from_line(value)
+            events.append(("sample", sampler.mode, sampler.threshold, sampler.seed,
+                           sampler.block_begin, sampler.block_end))
+        elif event == trace_parser.LAUNCH:
+            events.append(("launch", value))
+        elif event == trace_parser.KERNEL_END:
+            events.append(("kernel_end", value))
+    return events
+
+
+# events of a binary trace, as text_events
+def binary_events(data):
+    events = []
+    for frame_type, payload in binary_trace.iter_frames(data):
+        if frame_type == binary_trace.FRAME_ACCESS:
+            for record in binary_trace.iter_accesses(payload):
+                header = (record[binary_trace.IS_LOAD], record[binary_trace.IS_SHARED_MEMORY],
+                          record[binary_trace.BLOCK_ID], record[binary_trace.WARP_ID],
+                          record[binary_trace.FUNC_ID], record[binary_trace.INST_ID],
+                          record[binary_trace.SFR_ID])
+                events.extend(("access", header, lane_id, addr)
+                              for lane_id, addr in enumerate(record[binary_trace.ADDRS:]) if addr)
+        elif frame_type == binary_trace.FRAME_FUNC:
+            func_id, func_name, insts = binary_trace.decode_function(payload)
+            events.append(("func", func_name, insts))
+        elif frame_type == binary_trace.FRAME_FUNC_REF:
+            func_id, key, func_name = binary_trace.decode_function_ref(payload)
+            events.append(("func_ref", key, func_name))
+        elif frame_type == binary_trace.FRAME_SAMPLE:
+            events.append(("sample",) + tuple(binary_trace.decode_sample(payload)))
+        elif frame_type == binary_trace.FRAME_LAUNCH:
+            events.append(("launch", binary_trace.decode_launch(payload)))
+        elif frame_type == binary_trace.FRAME_KERNEL_END:
+            events.append(("kernel_end", binary_trace.decode_kernel_end(payload)))
+    return events
+
+
+def to_binary(data):
+    stream = io.BytesIO()
+    binary_trace.text_to_binary(io.StringIO(data.decode()), binary_trace.TraceWriter(stream))
+    return stream.getvalue()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", sorted(TRACES))
+def test_round_trip(name, gen_trace):
+    data = read(gen_trace(*TRACES[name]))
+    events = text_events(data)
+    assert binary_events(to_binary(data)) == events
+    kinds = {event[0] for event in events}
+    assert {"func", "access", "kernel_end"} <= kinds
+    if name == "sampled":
+        assert "sample" in kinds
+    if name == "concurrent":
+        assert "launch" in kinds
+
+
+def test_round_trip_func_ref():
+    events = text_events(FUNC_REF_TRACE)
+    assert events[0] == ("func_ref", "0123456789abcdef0123456789abcdef", "kernel(int*)")
+    assert binary_events(to_binary(FUNC_REF_TRACE)) == events
+
+
+# gen_trace.py writes whole warps in a record, the same lanes as its text trace
+@pytest.mark.parametrize("name", sorted(TRACES))
+def test_gen_trace_binary(name, gen_trace):
+    text = read(gen_trace(*TRACES[name]))
+    binary = read(gen_trace(*TRACES[name], "--format", "binary"))
+    assert binary_events(binary) == text_events(text)
+
+
+@pytest.mark.parametrize("name", sorted(TRACES))
+def test_binary_verdicts(name, gen_trace, verdicts, tmp_path):
+    path = gen_trace(*TRACES[name])
+    converted = tmp_path / "trace.bin"
+    converted.write_bytes(to_binary(read(path)))
+    expected = verdicts("--trace", path)
+    assert verdicts("--binary", converted) == expected
+    assert verdicts("--binary", gen_trace(*TRACES[name], "--format", "binary")) == expected
+    assert verdicts("--binary", "-", input=converted.read_bytes()) == expected
+
+
+def test_script_converts_stdin(gen_trace, script):
+    data = read(gen_trace(*TRACES["serial"]))
+    assert script("binary_trace.py", input=data).stdout == to_binary(data)
+
+
+def test_header_is_checked():
+    data = bytearray(to_binary(FUNC_REF_TRACE))
+    with pytest.raises(binary_trace.TraceFormatError):
+        list(binary_trace.iter_frames(data[:4]))
+    data[8] += 1 # version
+    with pytest.raises(binary_trace.TraceFormatError):
+        list(binary_trace.iter_frames(data))
+
+
+# the frame types and the version are those of race_check_trace
+def test_format_matches_common_h():
+    with open(COMMON_H) as f:
+        header = f.read()
+    frames = dict(re.findall(r"\b(FRAME_[A-Z_]+) = (\d+),", header))
+    assert frames
+    assert {name: int(value) for name, value in frames.items()} == \
+        {name: getattr(binary_trace, name) for name in frames}
+    assert int(re.search(r"#define BINARY_TRACE_VERSION (\d+)", header).group(1)) == binary_trace.VERSION
+    assert re.search(r'#define BINARY_TRACE_MAGIC "(\w+)"', header).group(1).encode() + b"\0" == binary_trace.MAGIC
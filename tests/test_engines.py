@@ -0,0 +1,102 @@
+#
+# The engines and modes of race_check_helper.py must give the verdicts of
+# the default dict engine, run alone, on the same trace.
+#
+
+import pytest
+
+from gen_trace import INTER_GLOBAL, INTRA_GLOBAL, INTRA_SHARED
+
+KINDS = {
+    INTRA_SHARED: "intra block shared memory",
+    INTRA_GLOBAL: "intra block global memory",
+    INTER_GLOBAL: "inter block global memory",
+}
+
+RACES = 3
+
+# name: (arguments of gen_trace.py, kernels)
+TRACES = {
+    "coalesced": (("--races", RACES, "--kernels", 3, "--seed", 7), 3),
+    "strided": (("--pattern", "strided", "--races", RACES, "--kernels", 2, "--seed", 1), 2),
+    # several loads of the same address in a SFR
+    "reduction": (("--pattern", "reduction", "--races", RACES, "--kernels", 2, "--seed", 3), 2),
+    "tile": (("--pattern", "tile", "--races", RACES, "--kernels", 2, "--seed", 3), 2),
+    "concurrent": (("--streams", 3, "--races", RACES, "--kernels", 4, "--seed", 5), 4),
+}
+
+MODES = [
+    ("--engine", "numpy"),
+    ("--engine", "ranges"),
+    ("--jobs", "2"),
+    ("--pipeline",),
+    ("--jobs", "2", "--pipeline"),
+    ("--engine", "numpy", "--pipeline"),
+    ("--max-memory", "1K"),
+    ("--engine", "numpy", "--max-memory", "1K"),
+    ("--online",),
+    ("--drop-closed-sfr",),
+    ("--kernel-jobs", "2"),
+    ("--memoize", "4"),
+]
+
+# modes that do not take a trace of concurrent launches
+SERIAL_MODES = ("--jobs", "--kernel-jobs")
+
+
+@pytest.fixture(scope="module")
+def baseline(gen_trace, verdicts):
+    results = {}
+
+    def get(name):
+        if name not in results:
+            results[name] = verdicts("--trace", gen_trace(*TRACES[name][0]))
+        return results[name]
+    return get
+
+
+@pytest.mark.parametrize("name", sorted(TRACES))
+def test_baseline_finds_planted_races(name, baseline):
+    kernels = TRACES[name][1]
+    expected = sorted(KINDS[i % len(KINDS)] for i in range(RACES))
+    result = baseline(name)
+    assert sorted(result) == list(range(1, kernels + 1))
+    for races in result.values():
+        assert sorted(kind for kind, insts in races) == expected
+
+
+@pytest.mark.parametrize("mode", MODES, ids=" ".join)
+@pytest.mark.parametrize("name", sorted(TRACES))
+def test_mode_matches_baseline(name, mode, gen_trace, verdicts, baseline):
+    if name == "concurrent" and mode[0] in SERIAL_MODES:
+        pytest.skip("{} needs a trace of serial launches".format(mode[0]))
+    assert verdicts("--trace", gen_trace(*TRACES[name][0]), *mode) == baseline(name)
+
+
+def test_concurrent_launches_match_serial_trace(gen_trace, verdicts, baseline):
+    serial = verdicts("--trace", gen_trace(*TRACES["concurrent"][0][2:]))
+    assert serial == baseline("concurrent")
+
+
+@pytest.mark.parametrize("space", ["shared", "global"])
+def test_space_filter(space, gen_trace, verdicts, baseline):
+    result = verdicts("--trace", gen_trace(*TRACES["coalesced"][0]), "--space", space)
+    expected = {kernel_id: [race for race in races if space in race[0]]
+                for kernel_id, races in baseline("coalesced").items()}
+    assert result == expected
+
+
+def test_inst_ids_filter(gen_trace, verdicts, baseline):
+    # keeps the races between instructions in [0, end)
+    end = 6
+    result = verdicts("--trace", gen_trace(*TRACES["tile"][0]), "--inst-ids", "0:{}".format(end))
+    expected = {kernel_id: [race for race in races if all(int(inst.split(",")[1]) < end for inst in race[1])]
+                for kernel_id, races in baseline("tile").items()}
+    assert result == expected
+    assert result != baseline("tile")
+
+
+def test_func_ids_filter(gen_trace, verdicts, baseline):
+    path = gen_trace(*TRACES["coalesced"][0])
+    assert verdicts("--trace", path, "--func-ids", "0:1") == baseline("coalesced")
+    assert verdicts("--trace", path, "--func-ids", "1:2") == {kernel_id: [] for kernel_id in baseline("coalesced")}
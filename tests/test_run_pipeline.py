@@ -0,0 +1,151 @@
+#
+# run_pipeline.py must pass the whole trace to the helper, in order,
+# through its memory ring and its spool file.
+#
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+import run_pipeline
+from sizes import parse_size
+
+TRACE = ("--races", 3, "--kernels", 3, "--seed", 7)
+SPOOLED = re.compile(r"spooled ([0-9.]+) MB")
+
+
+def drain(ring):
+    chunks = []
+    while True:
+        chunk = ring.get()
+        if chunk is None:
+            return chunks
+        chunks.append(chunk)
+
+
+def test_ring_in_memory():
+    ring = run_pipeline.Ring(100)
+    for i in range(5):
+        ring.put(bytes([i]) * 10)
+    ring.close()
+    assert drain(ring) == [bytes([i]) * 10 for i in range(5)]
+    assert ring.peak_bytes == 50
+    assert ring.spooled_bytes == 0
+    assert ring.spool is None
+
+
+def test_ring_spools_in_order(tmp_path):
+    ring = run_pipeline.Ring(25, 1000, str(tmp_path))
+    chunks = [bytes([i]) * 10 for i in range(8)]
+    for chunk in chunks:
+        ring.put(chunk)
+    # the memory holds two chunks, the others wait in the spool
+    assert ring.memory_bytes == 20
+    assert ring.spooled_bytes == 60
+    assert ring.queued() == 80
+    ring.close()
+    assert b"".join(drain(ring)) == b"".join(chunks)
+    assert ring.queued() == 0
+    # the spool is written from the start once it is empty
+    assert ring.spool_read == ring.spool_write == 0
+
+
+def test_ring_chunk_larger_than_memory():
+    ring = run_pipeline.Ring(10)
+    ring.put(b"x" * 100)
+    ring.close()
+    assert drain(ring) == [b"x" * 100]
+
+
+def test_ring_throttles_when_full():
+    ring = run_pipeline.Ring(20, 20)
+    chunks = [bytes([i]) * 10 for i in range(5)]
+    for chunk in chunks[:4]:
+        ring.put(chunk)
+    done = threading.Event()
+
+    def put():
+        ring.put(chunks[4])
+        done.set()
+    thread = threading.Thread(target=put)
+    thread.start()
+    assert not done.wait(0.2)
+    # room in memory, but the chunk waits for the spool to be read
+    assert ring.get() == chunks[0]
+    assert ring.get() == chunks[1]
+    assert not done.wait(0.2)
+    assert ring.get() == chunks[2] + chunks[3]
+    thread.join(5)
+    assert done.is_set()
+    assert ring.put_stall >= 0.4
+    ring.close()
+    assert drain(ring) == [chunks[4]]
+
+
+def test_ring_get_waits_for_data():
+    ring = run_pipeline.Ring(100)
+
+    def put():
+        time.sleep(0.2)
+        ring.put(b"late")
+        ring.close()
+    thread = threading.Thread(target=put)
+    thread.start()
+    assert ring.get() == b"late"
+    assert ring.get() is None
+    thread.join()
+    assert ring.get_stall >= 0.1
+
+
+def test_parse_size():
+    assert parse_size("4096") == 4096
+    assert parse_size("1K") == 1024
+    assert parse_size("1.5m") == 3 << 19
+    assert parse_size("2G") == 2 << 30
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_size("4X")
+
+
+def pipeline(script, *args, **kwargs):
+    return script("run_pipeline.py", "--tool", "", *args, "--", sys.executable,
+                  os.path.join(os.path.dirname(run_pipeline.__file__), "gen_trace.py"), *TRACE, **kwargs)
+
+
+def test_pipeline_report(script, gen_trace):
+    result = pipeline(script, "--quiet", "--buffer", "64K")
+    assert result.stdout == script("race_check_helper.py", "--trace", gen_trace(*TRACE)).stdout
+
+
+@pytest.mark.parametrize("buffer,spool", [("256M", "0"), ("64K", "0"), ("64K", "64M")], ids="-".join)
+def test_pipeline_passes_whole_trace(buffer, spool, script, gen_trace, tmp_path):
+    out = tmp_path / "out.txt"
+    tee = tmp_path / "tee.txt"
+    # the helper starts late, the trace is queued meanwhile
+    helper = "sh -c 'sleep 1; cat > {}'".format(out)
+    result = pipeline(script, "--helper", helper, "--buffer", buffer, "--spool", spool,
+                      "--spool-dir", tmp_path, "--tee", tee)
+    with open(gen_trace(*TRACE), "rb") as f:
+        trace = f.read()
+    assert out.read_bytes() == trace
+    assert tee.read_bytes() == trace
+    spooled = float(SPOOLED.search(result.stderr.decode()).group(1))
+    assert (spooled > 0) == (spool != "0")
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("race_check_spool_")]
+
+
+def test_helper_exits_early(script):
+    result = pipeline(script, "--helper", "head -c 100", "--buffer", "64K", check=False)
+    assert result.returncode == 0
+    assert len(result.stdout) == 100
+    assert "the helper exited before the end of the trace" in result.stderr.decode()
+
+
+def test_application_not_found(script):
+    result = script("run_pipeline.py", "--tool", "", "--helper", "cat", "no-such-application", check=False)
+    assert result.returncode == 127
+    assert "cannot run no-such-application" in result.stderr.decode()
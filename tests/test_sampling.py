@@ -0,0 +1,147 @@
+#
+# Sampling of the helper (--sample) must keep the blocks and warps that
+# race_check_trace keeps (SAMPLE=block|warp), and report their coverage.
+#
+
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import sampling
+
+COMMON_H_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "tools", "race_check_trace")
+
+RACES = 6
+KERNELS = 2
+TRACE = ("--races", RACES, "--kernels", KERNELS, "--seed", 7, "--grid", 32)
+PLANTED = re.compile(r"kernel (\d+): (\d+) intra block shared, (\d+) intra block global, "
+                     r"(\d+) inter block global races planted")
+COVERAGE = re.compile(r"Sampled coverage \((.*)\): (\d+)/(\d+) blocks \(.*?\), (\d+)/(\d+) warps \(.*?\), (\d+)/(\d+) accesses")
+
+# (mode, rate, seed, blocks), gen_trace.py does not sample a range of blocks
+TRACE_SAMPLES = [
+    ("block", 0.5, 3, None),
+    ("warp", 0.5, 3, None),
+    ("block", 0.25, 11, None),
+]
+SAMPLES = TRACE_SAMPLES + [("warp", 1.0, 0, "4:20")]
+
+
+def sample_args(mode, rate, seed, blocks):
+    args = ("--sample", mode, "--sample-rate", rate, "--sample-seed", seed)
+    return args + ("--sample-blocks", blocks) if blocks else args
+
+
+def kinds(races):
+    counts = [0, 0, 0]
+    for kind, insts in races:
+        counts[("intra block shared memory", "intra block global memory", "inter block global memory").index(kind)] += 1
+    return counts
+
+
+def sample_id(sample):
+    return "-".join(str(v) for v in sample if v is not None)
+
+
+@pytest.mark.parametrize("sample", TRACE_SAMPLES, ids=sample_id)
+def test_helper_sample_matches_trace_sample(sample, gen_trace, verdicts):
+    mode, rate, seed, blocks = sample
+    sampled = verdicts("--trace", gen_trace(*TRACE, *sample_args(mode, rate, seed, None)))
+    assert verdicts("--trace", gen_trace(*TRACE), *sample_args(mode, rate, seed, None)) == sampled
+
+
+# the races found are the planted races between two kept threads
+@pytest.mark.parametrize("mode", sorted(sampling.MODES))
+def test_sampled_races_are_planted_races(mode, script, verdicts, tmp_path):
+    path = tmp_path / "trace.txt"
+    planted = script("gen_trace.py", *TRACE, "--sample", mode, "--sample-rate", 0.5, "-o", path).stderr.decode()
+    expected = {int(m.group(1)): [int(n) for n in m.groups()[1:]] for m in PLANTED.finditer(planted)}
+    result = verdicts("--trace", path)
+    assert {kernel_id: kinds(races) for kernel_id, races in result.items()} == expected
+    assert sum(sum(counts) for counts in expected.values()) < RACES * KERNELS
+
+
+def test_full_rate_keeps_everything(gen_trace, verdicts):
+    path = gen_trace(*TRACE)
+    assert verdicts("--trace", path, "--sample", "block", "--sample-rate", 1) == verdicts("--trace", path)
+
+
+def test_zero_rate_finds_nothing(gen_trace, verdicts):
+    result = verdicts("--trace", gen_trace(*TRACE), "--sample", "warp", "--sample-rate", 0)
+    assert result == {kernel_id: [] for kernel_id in range(1, KERNELS + 1)}
+
+
+@pytest.mark.parametrize("sample", SAMPLES, ids=sample_id)
+def test_coverage(sample, gen_trace, script):
+    mode, rate, seed, blocks = sample
+    sampler = sampling.Sampler(sampling.MODES[mode], rate, seed,
+                               *(int(b) for b in blocks.split(":")) if blocks else ())
+    output = script("race_check_helper.py", "--trace", gen_trace(*TRACE), *sample_args(mode, rate, seed, blocks))
+    coverage = COVERAGE.findall(output.stdout.decode())
+    assert len(coverage) == KERNELS
+    for name, blocks_kept, blocks_seen, warps_kept, warps_seen, kept, seen in coverage:
+        assert name == str(sampler)
+        assert int(blocks_seen) == 32
+        assert int(warps_seen) == 32 * 4
+        assert int(seen) > int(kept)
+    warps = [(block_id, warp_id) for block_id in range(32) for warp_id in range(4)]
+    assert int(coverage[0][3]) == sum(sampler.keep(*warp) for warp in warps)
+    assert int(coverage[0][1]) == len({block_id for block_id, warp_id in warps if sampler.keep(block_id, warp_id)})
+
+
+class Shadow:
+    def __init__(self):
+        self.warps = []
+
+    def add_warp(self, is_load, is_shared_memory, block_id, warp_id, func_id, inst_id, SFR_id, addrs):
+        self.warps.append((block_id, warp_id))
+
+
+def test_sampled_shadow_memory():
+    sampler = sampling.Sampler(sampling.SAMPLE_BLOCK, 0.5, 1, 0, 8)
+    shadow = Shadow()
+    sampled = sampling.SampledShadowMemory(shadow, sampler)
+    addrs = [0x1000 + 4 * lane for lane in range(16)] + [0] * 16
+    for block_id in range(10):
+        for warp_id in range(2):
+            sampled.add_warp(1, 0, block_id, warp_id, 0, 0, 0, addrs)
+    kept = [block_id for block_id in range(10) if sampler.keep(block_id, 0)]
+    assert 0 < len(kept) < 8
+    assert all(block_id < 8 for block_id in kept)
+    assert shadow.warps == [(block_id, warp_id) for block_id in kept for warp_id in range(2)]
+    assert sampled.coverage() == ((len(kept), 10), (2 * len(kept), 20), (32 * len(kept), 320))
+
+
+def test_sampler_line_round_trip():
+    sampler = sampling.Sampler(sampling.SAMPLE_WARP, 0.3, 42, 5, 100)
+    line = sampler.to_line()
+    assert line == "warp,{},42,5,100".format(round(0.3 * sampling.SAMPLE_SCALE))
+    copy = sampling.Sampler.from_line(line)
+    assert [copy.keep(b, w) for b in range(120) for w in range(8)] == \
+        [sampler.keep(b, w) for b in range(120) for w in range(8)]
+
+
+# sample_hash is the hash of race_check_trace
+@pytest.mark.skipif(shutil.which("g++") is None, reason="needs g++")
+def test_sample_hash_matches_common_h(tmp_path):
+    source = tmp_path / "sample_hash.cpp"
+    source.write_text("""#define __host__
+#define __device__
+#include <stdio.h>
+#include "common.h"
+int main() {
+    for (uint32_t x = 0; x < 1000; x += 7) {
+        printf("%u\\n", sample_hash(x * 2654435761u, x % 5 == 0 ? 0 : x * 40503u));
+    }
+}
+""")
+    binary = tmp_path / "sample_hash"
+    subprocess.run(["g++", "-I", COMMON_H_DIR, "-o", str(binary), str(source)], check=True, capture_output=True)
+    output = subprocess.run([str(binary)], check=True, capture_output=True).stdout.split()
+    expected = [sampling.sample_hash((x * 2654435761) & 0xffffffff, 0 if x % 5 == 0 else (x * 40503) & 0xffffffff)
+                for x in range(0, 1000, 7)]
+    assert [int(v) for v in output] == expected
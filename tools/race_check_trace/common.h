@@ -14,7 +14,7 @@
  * on the channel from the GPU to the CPU */
 typedef struct {
     int block_id;
-    int warp_id;
+    int warp_id;  // %warpid, or the linear thread index in the block / 32 with BLOCK_WARP_ID=1
     int opcode_id;
     int func_id;
     int inst_id;
@@ -23,3 +23,183 @@ typedef struct {
     int SFR_id;  // id of synchronization-free regions
     uint64_t addrs[32];
 } mem_access_t;
+
+/* with CONCURRENT_LAUNCHES=1 every message of the channel begins with a
+ * launch_msg_t. A LAUNCH_MSG_ACCESS is followed by the mem_access_t of its
+ * launch, pushed together so the warps of other launches cannot come in
+ * between. The launch id is only on the channel: the trace tells the launch
+ * of the accesses that follow when it changes ("#launch#N" or FRAME_LAUNCH) */
+enum {
+    LAUNCH_MSG_ACCESS = 0,
+    LAUNCH_MSG_END = 1,      // the launch ended, all its accesses were pushed
+    LAUNCH_MSG_DROPPED = 2,  // a record of a warp that found no launch slot, not pushed
+    LAUNCH_MSG_FLUSH = 3,    // pushed by flush_channel, no launch
+};
+
+typedef struct {
+    int type;
+    int launch_id;
+} launch_msg_t;
+
+typedef struct {
+    launch_msg_t msg;
+    mem_access_t ma;
+} launch_access_t;
+
+/* binary trace format (BINARY_TRACE=<path>), read by scripts/binary_trace.py
+ *
+ * the file begins with a binary_trace_header_t, followed by frames.
+ * every frame begins with a binary_frame_header_t and its payload is
+ *   FRAME_FUNC:       int32 func_id, uint32 number of instructions,
+ *                     then the function name and the SASS of every
+ *                     instruction, each terminated by '\0'
+ *   FRAME_ACCESS:     mem_access_t records
+ *   FRAME_KERNEL_END: empty, or the int32 launch_id of the launch that
+ *                     ended if CONCURRENT_LAUNCHES=1
+ *   FRAME_SAMPLE:     sample_config_t, written first if the trace is sampled
+ *   FRAME_FUNC_REF:   int32 func_id, then the key of the function in the
+ *                     function cache (FUNC_CACHE=<dir>) and its name, each
+ *                     terminated by '\0', in place of a FRAME_FUNC
+ *   FRAME_LAUNCH:     int32 launch_id of the FRAME_ACCESS frames that follow,
+ *                     if CONCURRENT_LAUNCHES=1
+ * all values are little endian */
+#define BINARY_TRACE_MAGIC "RCTRACE"
+#define BINARY_TRACE_VERSION 3
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t record_size;  // sizeof(mem_access_t)
+} binary_trace_header_t;
+
+enum {
+    FRAME_FUNC = 1,
+    FRAME_ACCESS = 2,
+    FRAME_KERNEL_END = 3,
+    FRAME_SAMPLE = 4,
+    FRAME_FUNC_REF = 5,
+    FRAME_LAUNCH = 6,
+};
+
+typedef struct {
+    uint32_t type;
+    uint32_t length;  // number of bytes of the payload
+} binary_frame_header_t;
+
+/* sampling of the traced accesses (SAMPLE=block|warp), a block (or a warp)
+ * is traced if it is in [block_begin, block_end) and the hash of its id is
+ * below rate, in 1/SAMPLE_SCALE. The same hash is used by scripts/sampling.py
+ * so the helper can tell which blocks a trace covers */
+#define SAMPLE_SCALE (1u << 16)
+
+enum {
+    SAMPLE_NONE = 0,
+    SAMPLE_BLOCK = 1,
+    SAMPLE_WARP = 2,
+};
+
+typedef struct {
+    uint32_t mode;
+    uint32_t rate;
+    uint32_t seed;
+    int32_t block_begin;
+    int32_t block_end;
+} sample_config_t;
+
+__host__ __device__ static inline uint32_t sample_hash(uint32_t x, uint32_t seed) {
+    x ^= seed;
+    x *= 0x9e3779b1u;
+    x ^= x >> 16;
+    x *= 0x85ebca6bu;
+    x ^= x >> 13;
+    x *= 0xc2b2ae35u;
+    x ^= x >> 16;
+    return x;
+}
+
+__host__ __device__ static inline bool sample_keep(const sample_config_t *sample,
+                                                   int block_id, int warp_id) {
+    if (sample->mode == SAMPLE_NONE) {
+        return true;
+    }
+    if (block_id < sample->block_begin || block_id >= sample->block_end) {
+        return false;
+    }
+    uint32_t key = sample->mode == SAMPLE_BLOCK
+                       ? (uint32_t)block_id
+                       : ((uint32_t)block_id << 6) | (uint32_t)warp_id;
+    return (sample_hash(key, sample->seed) & (SAMPLE_SCALE - 1)) < sample->rate;
+}
+
+/* filtering of the traced accesses on the GPU (FILTER_SPACE=shared|global,
+ * FILTER_ADDRS=<begin>:<end>), the range is checked on the addresses as they
+ * are traced (offsets for shared memory). Functions and instructions are
+ * filtered when they are instrumented. scripts/access_filter.py applies the
+ * same filters to a trace */
+enum {
+    FILTER_ANY_SPACE = 0,
+    FILTER_SHARED = 1,
+    FILTER_GLOBAL = 2,
+};
+
+typedef struct {
+    uint32_t space;
+    uint64_t addr_begin;
+    uint64_t addr_end;  // addr_begin == addr_end keeps every address
+} filter_config_t;
+
+/* clear the addresses of ma that are filtered, return whether some are left */
+__host__ __device__ static inline bool filter_keep(const filter_config_t *filter,
+                                                   mem_access_t *ma) {
+    if (filter->space != FILTER_ANY_SPACE &&
+        (filter->space == FILTER_SHARED) != (ma->is_shared_memory != 0)) {
+        return false;
+    }
+    if (filter->addr_begin == filter->addr_end) {
+        return true;
+    }
+    bool kept = false;
+    for (int i = 0; i < 32; i++) {
+        if (ma->addrs[i] != 0 && filter->addr_begin <= ma->addrs[i] && ma->addrs[i] < filter->addr_end) {
+            kept = true;
+        } else {
+            ma->addrs[i] = 0;
+        }
+    }
+    return kept;
+}
+
+/* kernels running at the same time (CONCURRENT_LAUNCHES=1). Before a kernel
+ * is launched the host offers it a slot of the launch table with a new
+ * launch id and a syn_ops_counter of its own. The first warp of the launch
+ * to reach an instrumented instruction claims an offered slot of the same
+ * number of blocks with the grid id of the launch, the other warps find the
+ * slot by grid id. Launches of the same shape running at the same time may
+ * swap their launch ids, their accesses are still kept apart.
+ * The thread that exits last marks the slot free and pushes a LAUNCH_MSG_END
+ * with the launch id, the launch ends there in the trace.
+ * A warp gives up after LAUNCH_SLOT_SPINS tries to claim a slot, it pushes
+ * a LAUNCH_MSG_DROPPED instead of its records, and the host ends the
+ * launch itself once it is completed if its slot was not freed */
+#define LAUNCH_SLOTS 64
+#define LAUNCH_SLOT_SPINS (1 << 20)
+
+enum {
+    LAUNCH_FREE = 0,
+    LAUNCH_OFFERED = 1,
+    LAUNCH_CLAIMED = 2,
+};
+
+typedef struct {
+    int state;  // first, the host writes it after the rest of the slot
+    int launch_id;
+    uint64_t grid_id;
+    int num_blocks;
+    unsigned long long exited_threads;  // 64 bits, a grid may have more than 2^31 threads
+    int *syn_ops_counter;
+} launch_slot_t;
+
+typedef struct {
+    int lock;  // held by a warp claiming a slot
+    launch_slot_t slots[LAUNCH_SLOTS];
+} launch_table_t;
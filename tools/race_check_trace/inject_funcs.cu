@@ -19,6 +19,110 @@
 /* contains definition of the mem_access_t structure */
 #include "common.h"
 
+/* index of the warp in its block: threads are grouped into warps in the
+ * order of their linear index in the block. %warpid (get_warpid) is the
+ * slot of the warp on its SM and is not this index */
+__device__ static int get_block_warpid() {
+    int tid = threadIdx.x + blockDim.x * (threadIdx.y + blockDim.y * threadIdx.z);
+    return tid / 32;
+}
+
+/* warp_id of the records: %warpid, or the index of the warp in its block
+ * with BLOCK_WARP_ID=1. Both tell apart the warps of a block, which is all
+ * the race checks need */
+__device__ static int record_warpid(int block_warp_id) {
+    return block_warp_id ? get_block_warpid() : get_warpid();
+}
+
+/* slot of the running launch in the launch table, see common.h,
+ * NULL if no slot is offered to it after LAUNCH_SLOT_SPINS tries */
+__device__ static launch_slot_t *launch_slot(launch_table_t *table) {
+    uint64_t grid_id;
+    asm volatile("mov.u64 %0, %%gridid;" : "=l"(grid_id));
+    volatile launch_slot_t *slots = table->slots;
+    for (int i = 0; i < LAUNCH_SLOTS; i++) {
+        if (slots[i].state == LAUNCH_CLAIMED && slots[i].grid_id == grid_id) {
+            return (launch_slot_t *)&slots[i];
+        }
+    }
+
+    /* the first warp of the launch claims its slot, the host
+     * offers it before the kernel is launched */
+    int num_blocks = gridDim.x * gridDim.y * gridDim.z;
+    launch_slot_t *slot = NULL;
+    for (int spin = 0; slot == NULL; spin++) {
+        if (spin == LAUNCH_SLOT_SPINS) {
+            return NULL;
+        }
+        /* this cannot deadlock: a single lane of a warp takes the lock (the
+         * first active lane, or thread 0 of the block in instrument_syn), so
+         * no lane spins on a lock held by a lane of its own warp, which could
+         * not be scheduled before Volta. Warps of the same block that contend
+         * for it are scheduled independently, and the holder only scans the
+         * table, without waiting for anything, before it releases the lock */
+        while (atomicCAS(&table->lock, 0, 1) != 0) {
+        }
+        __threadfence();
+        for (int i = 0; i < LAUNCH_SLOTS && slot == NULL; i++) {
+            if (slots[i].state == LAUNCH_CLAIMED && slots[i].grid_id == grid_id) {
+                slot = (launch_slot_t *)&slots[i];
+            }
+        }
+        for (int i = 0; i < LAUNCH_SLOTS && slot == NULL; i++) {
+            if (slots[i].state == LAUNCH_OFFERED && slots[i].num_blocks == num_blocks) {
+                slots[i].grid_id = grid_id;
+                slots[i].exited_threads = 0;
+                __threadfence();
+                slots[i].state = LAUNCH_CLAIMED;
+                slot = (launch_slot_t *)&slots[i];
+            }
+        }
+        __threadfence();
+        atomicExch(&table->lock, 0);
+    }
+    return slot;
+}
+
+/* syn_ops_counter of the running launch, and its launch id
+ * (0 if plaunch_table is 0, the kernels run one at a time).
+ * A launch without a slot has launch id -1 and no counters, the host
+ * drops its records */
+__device__ static int *launch_counters(uint64_t psyn_ops_counter, uint64_t plaunch_table, int *launch_id) {
+    if (plaunch_table == 0) {
+        *launch_id = 0;
+        return (int *)psyn_ops_counter;
+    }
+    launch_slot_t *slot = launch_slot((launch_table_t *)plaunch_table);
+    if (slot == NULL) {
+        *launch_id = -1;
+        return NULL;
+    }
+    *launch_id = slot->launch_id;
+    return slot->syn_ops_counter;
+}
+
+/* SFR of a block of the running launch, 0 for a launch without a slot */
+__device__ static int launch_SFR(uint64_t psyn_ops_counter, uint64_t plaunch_table, int block_id, int *launch_id) {
+    int *counters = launch_counters(psyn_ops_counter, plaunch_table, launch_id);
+    return counters != NULL ? counters[block_id] : 0;
+}
+
+/* push a record of the running launch, in a trace of concurrent launches
+ * (plaunch_table is not 0) behind its launch_msg_t, see common.h */
+__device__ static void push_access(uint64_t pchannel_dev, uint64_t plaunch_table, launch_access_t *la) {
+    ChannelDev *channel_dev = (ChannelDev *)pchannel_dev;
+    if (plaunch_table == 0) {
+        channel_dev->push(&la->ma, sizeof(mem_access_t));
+    } else if (la->msg.launch_id == -1) {
+        /* no slot, the host only counts it */
+        la->msg.type = LAUNCH_MSG_DROPPED;
+        channel_dev->push(&la->msg, sizeof(launch_msg_t));
+    } else {
+        la->msg.type = LAUNCH_MSG_ACCESS;
+        channel_dev->push(la, sizeof(launch_access_t));
+    }
+}
+
 extern "C" __device__ __noinline__ void instrument_mem(int pred, int opcode_id,
                                                        int func_id,
                                                        int inst_id,
@@ -26,7 +130,11 @@ extern "C" __device__ __noinline__ void instrument_mem(int pred, int opcode_id,
                                                        uint64_t pchannel_dev,                                                  
                                                        int32_t is_shared_memory,
                                                        int32_t is_load,
-                                                       uint64_t psyn_ops_counter) {
+                                                       int32_t block_warp_id,
+                                                       uint64_t psyn_ops_counter,
+                                                       uint64_t psample_config,
+                                                       uint64_t pfilter_config,
+                                                       uint64_t plaunch_table) {
     //NOTE: the way to use pred doesn't work on atomic operations
     if (!pred) {
         return;
@@ -35,11 +143,18 @@ extern "C" __device__ __noinline__ void instrument_mem(int pred, int opcode_id,
     int block_id = blockIdx.x + blockIdx.y * gridDim.x +
                    gridDim.x * gridDim.y * blockIdx.z;
 
+    /* not sampled, the whole warp returns */
+    int warp_id = record_warpid(block_warp_id);
+    if (!sample_keep((sample_config_t *)psample_config, block_id, warp_id)) {
+        return;
+    }
+
     int active_mask = ballot(1);
     const int laneid = get_laneid();
     const int first_laneid = __ffs(active_mask) - 1;
 
-    mem_access_t ma;
+    launch_access_t la;
+    mem_access_t &ma = la.ma;
 
     /* collect memory address information from other threads */
     for (int i = 0; i < 32; i++) {
@@ -47,18 +162,22 @@ extern "C" __device__ __noinline__ void instrument_mem(int pred, int opcode_id,
     }
 
     ma.block_id = block_id;
-    ma.warp_id = get_warpid();
+    ma.warp_id = warp_id;
     ma.opcode_id = opcode_id;
     ma.func_id = func_id;
     ma.inst_id = inst_id;
     ma.is_shared_memory = is_shared_memory;
     ma.is_load = is_load;
-    ma.SFR_id = ((int *)psyn_ops_counter)[block_id];
 
     /* first active lane pushes information on the channel */
     if (first_laneid == laneid) {
-        ChannelDev *channel_dev = (ChannelDev *)pchannel_dev;
-        channel_dev->push(&ma, sizeof(mem_access_t));
+        ma.SFR_id = launch_SFR(psyn_ops_counter, plaunch_table, block_id, &la.msg.launch_id);
+
+        /* nothing left after filtering */
+        if (!filter_keep((filter_config_t *)pfilter_config, &ma)) {
+            return;
+        }
+        push_access(pchannel_dev, plaunch_table, &la);
     }
 }
 
@@ -72,7 +191,11 @@ extern "C" __device__ __noinline__ void instrument_gen_mem(int pred, int opcode_
                                                        uint64_t shared_mem_base,
                                                        uint64_t local_mem_base,
                                                        int32_t is_load,
-                                                       uint64_t psyn_ops_counter) {
+                                                       int32_t block_warp_id,
+                                                       uint64_t psyn_ops_counter,
+                                                       uint64_t psample_config,
+                                                       uint64_t pfilter_config,
+                                                       uint64_t plaunch_table) {
     //NOTE: the way to use pred doesn't work on atomic operations
     if (!pred) {
         return;
@@ -81,11 +204,18 @@ extern "C" __device__ __noinline__ void instrument_gen_mem(int pred, int opcode_
     int block_id = blockIdx.x + blockIdx.y * gridDim.x +
                    gridDim.x * gridDim.y * blockIdx.z;
 
+    /* not sampled, the whole warp returns */
+    int warp_id = record_warpid(block_warp_id);
+    if (!sample_keep((sample_config_t *)psample_config, block_id, warp_id)) {
+        return;
+    }
+
     int active_mask = ballot(1);
     const int laneid = get_laneid();
     const int first_laneid = __ffs(active_mask) - 1;
 
-    mem_access_t ma;
+    launch_access_t la;
+    mem_access_t &ma = la.ma;
 
     /* collect memory address information from other threads */
     for (int i = 0; i < 32; i++) {
@@ -93,15 +223,16 @@ extern "C" __device__ __noinline__ void instrument_gen_mem(int pred, int opcode_
     }
 
     ma.block_id = block_id;
-    ma.warp_id = get_warpid();
+    ma.warp_id = warp_id;
     ma.opcode_id = opcode_id;
     ma.func_id = func_id;
     ma.inst_id = inst_id;
     ma.is_load = is_load;
-    ma.SFR_id = ((int *)psyn_ops_counter)[block_id];
 
     /* first active lane pushes information on the channel */
     if (first_laneid == laneid) {
+        ma.SFR_id = launch_SFR(psyn_ops_counter, plaunch_table, block_id, &la.msg.launch_id);
+
         // shmem range is [shared_mem_base, shared_mem_base+16MB)
         if (shared_mem_base <= ma.addrs[first_laneid] && ma.addrs[first_laneid] < (shared_mem_base + (1 << 24))) {
             for (int i = 0; i < 32; i++) {
@@ -119,9 +250,13 @@ extern "C" __device__ __noinline__ void instrument_gen_mem(int pred, int opcode_
         } else {
             ma.is_shared_memory = 0;
         }
+
+        /* nothing left after filtering, the space is known only now */
+        if (!filter_keep((filter_config_t *)pfilter_config, &ma)) {
+            return;
+        }
         
-        ChannelDev *channel_dev = (ChannelDev *)pchannel_dev;
-        channel_dev->push(&ma, sizeof(mem_access_t));
+        push_access(pchannel_dev, plaunch_table, &la);
     }
 }
 
@@ -130,13 +265,58 @@ extern "C" __device__ __noinline__ void instrument_gen_mem(int pred, int opcode_
  * the counter will be used as an ID for code regions between synchronization operations
  * which are also refered as synchronization-free regions (SFRs)
  */
-extern "C" __device__ __noinline__ void instrument_syn(uint64_t psyn_ops_counter) {
+extern "C" __device__ __noinline__ void instrument_syn(uint64_t psyn_ops_counter,
+                                                       uint64_t plaunch_table) {
     int block_id = blockIdx.x + blockIdx.y * gridDim.x + gridDim.x * gridDim.y * blockIdx.z;
     if (threadIdx.x == 0 && threadIdx.y == 0 && threadIdx.z == 0) {
-       ((int *)psyn_ops_counter)[block_id] += 1;
+       int launch_id;
+       int *counters = launch_counters(psyn_ops_counter, plaunch_table, &launch_id);
+       if (counters != NULL) {
+           counters[block_id] += 1;
+       }
     }
 
     // wait for other threads so can gurantee that the counter is updated after this function call
     __syncthreads();
     
 }
+
+
+/* counts the threads of the launch that exit (CONCURRENT_LAUNCHES=1), the
+ * last one ends the launch in the trace with a LAUNCH_MSG_END
+ */
+extern "C" __device__ __noinline__ void instrument_exit(int pred,
+                                                        uint64_t plaunch_table,
+                                                        uint64_t pchannel_dev) {
+    if (!pred) {
+        return;
+    }
+
+    int active_mask = ballot(1);
+    if (get_laneid() != __ffs(active_mask) - 1) {
+        return;
+    }
+
+    launch_slot_t *slot = launch_slot((launch_table_t *)plaunch_table);
+    if (slot == NULL) {
+        return;  // the host ends the launch once it is completed
+    }
+    unsigned long long num_threads = (unsigned long long)gridDim.x * gridDim.y * gridDim.z *
+                                     blockDim.x * blockDim.y * blockDim.z;
+    unsigned long long exited = __popc(active_mask);
+
+    /* the accesses of the warp are pushed before the warp is counted */
+    __threadfence();
+    if (atomicAdd(&slot->exited_threads, exited) + exited == num_threads) {
+        launch_msg_t msg;
+        msg.type = LAUNCH_MSG_END;
+        msg.launch_id = slot->launch_id;
+
+        /* freed before the host hears of the end and offers it again */
+        ((volatile launch_slot_t *)slot)->state = LAUNCH_FREE;
+        __threadfence();
+
+        ChannelDev *channel_dev = (ChannelDev *)pchannel_dev;
+        channel_dev->push(&msg, sizeof(launch_msg_t));
+    }
+}
@@ -9,11 +9,16 @@
  */
 
 #include <assert.h>
+#include <fnmatch.h>
+#include <pthread.h>
 #include <stdint.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <unistd.h>
 #include <string>
 #include <map>
+#include <sstream>
 #include <unordered_set>
 
 /* every tool needs to include this once */
@@ -36,19 +41,77 @@ static ChannelHost channel_host;
 /* synchronization operation counter, updated by the GPU threads */
 int *syn_ops_counter = 0;
 
+/* sampling of the traced blocks or warps (SAMPLE=block|warp), read from the
+ * environment by nvbit_at_init and copied to the GPU when the context starts */
+static __managed__ sample_config_t sample_config;
+sample_config_t sample_config_host = {SAMPLE_NONE, SAMPLE_SCALE, 0, 0, INT32_MAX};
+
+/* filtering of the traced accesses by memory space and address range
+ * (FILTER_SPACE, FILTER_ADDRS), copied to the GPU like the sampling */
+static __managed__ filter_config_t filter_config;
+filter_config_t filter_config_host = {FILTER_ANY_SPACE, 0, 0};
+
+/* functions whose memory instructions are instrumented (FILTER_FUNCTIONS, a
+ * comma separated list of shell wildcards, and FILTER_FUNC_IDS=<begin>:<end>).
+ * Every function is still listed so func_id is the same as without filter */
+std::vector<std::string> filter_functions;
+int filter_func_begin = 0;
+int filter_func_end = INT32_MAX;
+
+/* kernels running at the same time (CONCURRENT_LAUNCHES=1), see common.h.
+ * The launch table is in device memory, the host offers its slots on
+ * launch_stream while kernels of the application run */
+int concurrent_launches = 0;
+launch_table_t *launch_table = NULL;
+cudaStream_t launch_stream;
+CUcontext launch_ctx;
+int launch_counter = 0;
+
+/* host side of the slots: the launch id (0 when the slot is free, the
+ * receiving thread frees it at the end of the launch) and the syn_ops_counter */
+typedef struct {
+    volatile int launch_id;
+    int *syn_ops_counter;
+    int num_counters;
+} launch_host_t;
+launch_host_t launch_slots[LAUNCH_SLOTS];
+
+/* held from the launch of a kernel to its return and while the channel is
+ * flushed, so no kernel pushes during a flush */
+pthread_mutex_t launch_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/* one event per launch returned since the last flush, the channel is
+ * flushed by flush_thread when they are all completed */
+typedef struct {
+    cudaEvent_t event;
+    int slot;
+    int launch_id;
+} launch_event_t;
+std::vector<launch_event_t> launch_events;
+int offered_slot;  // slot offered to the kernel being launched
+
+/* records of warps that found no slot (launch id -1), dropped,
+ * and launches the host had to end */
+unsigned long long dropped_records = 0;
+int unslotted_launches = 0;
+pthread_t flush_thread;
+
 /* receiving thread and its control variables */
 pthread_t recv_thread;
 volatile bool recv_thread_started = false;
 volatile bool recv_thread_receiving = false;
 
 /* skip flag used to avoid re-entry on the nvbit_callback when issuing
- * flush_channel kernel call */
-bool skip_flag = false;
+ * flush_channel kernel call, flush_thread issues it too */
+thread_local bool skip_flag = false;
 
 /* global control variables for this tool */
 uint32_t instr_begin_interval = 0;
 uint32_t instr_end_interval = UINT32_MAX;
 int verbose = 0;
+/* warp_id of the records is the index of the warp in its block
+ * (BLOCK_WARP_ID=1) rather than %warpid, see inject_funcs.cu */
+int block_warp_id = 0;
 
 /* opcode to id map and reverse map  */
 std::map<std::string, int> opcode_to_id_map;
@@ -57,18 +120,246 @@ std::map<int, std::string> id_to_opcode_map;
 /* vector of func_name, index by func_id */
 std::vector<std::string> id_to_func_name;
 
+/* cache of the function tables (FUNC_CACHE=<dir>), written by
+ * scripts/race_check_helper.py. A function found in it is sent by key
+ * instead of its name and SASS, see scripts/func_cache.py */
+std::string func_cache_dir;
+
+/* SHA-1 of the strings of a function key */
+struct sha1_t {
+    uint32_t h[5] = {0x67452301u, 0xefcdab89u, 0x98badcfeu, 0x10325476u, 0xc3d2e1f0u};
+    unsigned char block[64];
+    uint64_t length = 0;
+
+    static uint32_t rol(uint32_t x, int n) { return (x << n) | (x >> (32 - n)); }
+
+    void process() {
+        uint32_t w[80];
+        for (int i = 0; i < 16; i++) {
+            w[i] = (uint32_t)block[4 * i] << 24 | (uint32_t)block[4 * i + 1] << 16 |
+                   (uint32_t)block[4 * i + 2] << 8 | block[4 * i + 3];
+        }
+        for (int i = 16; i < 80; i++) {
+            w[i] = rol(w[i - 3] ^ w[i - 8] ^ w[i - 14] ^ w[i - 16], 1);
+        }
+        uint32_t a = h[0], b = h[1], c = h[2], d = h[3], e = h[4];
+        for (int i = 0; i < 80; i++) {
+            uint32_t f, k;
+            if (i < 20) {
+                f = (b & c) | (~b & d);
+                k = 0x5a827999u;
+            } else if (i < 40) {
+                f = b ^ c ^ d;
+                k = 0x6ed9eba1u;
+            } else if (i < 60) {
+                f = (b & c) | (b & d) | (c & d);
+                k = 0x8f1bbcdcu;
+            } else {
+                f = b ^ c ^ d;
+                k = 0xca62c1d6u;
+            }
+            uint32_t t = rol(a, 5) + f + e + k + w[i];
+            e = d;
+            d = c;
+            c = rol(b, 30);
+            b = a;
+            a = t;
+        }
+        h[0] += a;
+        h[1] += b;
+        h[2] += c;
+        h[3] += d;
+        h[4] += e;
+    }
+
+    void update(const unsigned char *data, size_t size) {
+        for (size_t i = 0; i < size; i++) {
+            block[length++ % 64] = data[i];
+            if (length % 64 == 0) {
+                process();
+            }
+        }
+    }
+
+    void finish() {
+        uint64_t bits = length * 8;
+        unsigned char pad = 0x80;
+        update(&pad, 1);
+        pad = 0;
+        while (length % 64 != 56) {
+            update(&pad, 1);
+        }
+        for (int i = 7; i >= 0; i--) {
+            unsigned char byte = (unsigned char)(bits >> (8 * i));
+            update(&byte, 1);
+        }
+    }
+};
+
+/* key of a function in the function cache: the first 128 bits of the
+ * SHA-1 of its name and SASS, each followed by '\0' */
+std::string function_key(const char *func_name, const std::vector<Instr *> &instrs) {
+    sha1_t sha1;
+    sha1.update((const unsigned char *)func_name, strlen(func_name) + 1);
+    for (auto instr : instrs) {
+        const char *sass = instr->getSass();
+        sha1.update((const unsigned char *)sass, strlen(sass) + 1);
+    }
+    sha1.finish();
+    char key[33];
+    snprintf(key, sizeof(key), "%08x%08x%08x%08x", sha1.h[0], sha1.h[1], sha1.h[2], sha1.h[3]);
+    return std::string(key);
+}
+
+/* binary trace output, opened if BINARY_TRACE=<path> is set,
+ * otherwise the trace is printed as text */
+FILE *binary_trace = NULL;
+
+/* write a frame of the binary trace (see common.h) */
+void write_frame(uint32_t type, const void *payload, uint32_t length) {
+    binary_frame_header_t header = {type, length};
+    flockfile(binary_trace);
+    fwrite(&header, sizeof(header), 1, binary_trace);
+    if (length > 0) {
+        fwrite(payload, 1, length, binary_trace);
+    }
+    funlockfile(binary_trace);
+}
+
 void nvbit_at_init() {
     setenv("CUDA_MANAGED_FORCE_DEVICE_ALLOC", "1", 1);
     GET_VAR_INT(
         instr_begin_interval, "INSTR_BEGIN", 0,
-        "Beginning of the instruction interval where to apply instrumentation");
+        "Beginning of the instruction interval where to instrument memory instructions");
     GET_VAR_INT(
         instr_end_interval, "INSTR_END", UINT32_MAX,
-        "End of the instruction interval where to apply instrumentation");
+        "End of the instruction interval where to instrument memory instructions");
     GET_VAR_INT(verbose, "TOOL_VERBOSE", 0, "Enable verbosity inside the tool");
+    GET_VAR_INT(concurrent_launches, "CONCURRENT_LAUNCHES", 0,
+                "Let kernels run at the same time, their accesses are told apart by launch id");
+    GET_VAR_INT(block_warp_id, "BLOCK_WARP_ID", 0,
+                "Record the index of the warp in its block as warp_id instead of %warpid");
+
+    /* SAMPLE=block|warp SAMPLE_RATE=<fraction> SAMPLE_SEED=<n> SAMPLE_BLOCKS=<begin>:<end> */
+    const char *sample = getenv("SAMPLE");
+    const char *sample_rate = getenv("SAMPLE_RATE");
+    const char *sample_seed = getenv("SAMPLE_SEED");
+    const char *sample_blocks = getenv("SAMPLE_BLOCKS");
+    if (sample != NULL && strcmp(sample, "warp") == 0) {
+        sample_config_host.mode = SAMPLE_WARP;
+    } else if ((sample != NULL && strcmp(sample, "block") == 0) || sample_blocks != NULL) {
+        sample_config_host.mode = SAMPLE_BLOCK;
+    } else if (sample != NULL && sample[0] != '\0') {
+        fprintf(stderr, "SAMPLE must be block or warp\n");
+        exit(1);
+    }
+    if (sample_rate != NULL) {
+        sample_config_host.rate = (uint32_t)(atof(sample_rate) * SAMPLE_SCALE + 0.5);
+    }
+    if (sample_seed != NULL) {
+        sample_config_host.seed = (uint32_t)strtoul(sample_seed, NULL, 0);
+    }
+    if (sample_blocks != NULL &&
+        sscanf(sample_blocks, "%d:%d", &sample_config_host.block_begin, &sample_config_host.block_end) != 2) {
+        fprintf(stderr, "SAMPLE_BLOCKS must be <begin>:<end>\n");
+        exit(1);
+    }
+
+    /* FILTER_FUNCTIONS=<pattern>,... FILTER_FUNC_IDS=<begin>:<end>
+     * FILTER_SPACE=shared|global FILTER_ADDRS=<begin>:<end> */
+    const char *functions = getenv("FILTER_FUNCTIONS");
+    const char *func_ids = getenv("FILTER_FUNC_IDS");
+    const char *space = getenv("FILTER_SPACE");
+    const char *addrs = getenv("FILTER_ADDRS");
+    if (functions != NULL) {
+        std::stringstream patterns(functions);
+        std::string pattern;
+        while (std::getline(patterns, pattern, ',')) {
+            if (!pattern.empty()) {
+                filter_functions.push_back(pattern);
+            }
+        }
+    }
+    if (func_ids != NULL && sscanf(func_ids, "%d:%d", &filter_func_begin, &filter_func_end) != 2) {
+        fprintf(stderr, "FILTER_FUNC_IDS must be <begin>:<end>\n");
+        exit(1);
+    }
+    if (space != NULL && strcmp(space, "shared") == 0) {
+        filter_config_host.space = FILTER_SHARED;
+    } else if (space != NULL && strcmp(space, "global") == 0) {
+        filter_config_host.space = FILTER_GLOBAL;
+    } else if (space != NULL && space[0] != '\0') {
+        fprintf(stderr, "FILTER_SPACE must be shared or global\n");
+        exit(1);
+    }
+    if (addrs != NULL) {
+        char *end;
+        filter_config_host.addr_begin = strtoull(addrs, &end, 0);
+        if (*end != ':') {
+            fprintf(stderr, "FILTER_ADDRS must be <begin>:<end>\n");
+            exit(1);
+        }
+        filter_config_host.addr_end = strtoull(end + 1, NULL, 0);
+        if (filter_config_host.addr_begin >= filter_config_host.addr_end) {
+            fprintf(stderr, "FILTER_ADDRS must be a non-empty range\n");
+            exit(1);
+        }
+    }
+
+    const char *cache = getenv("FUNC_CACHE");
+    if (cache != NULL) {
+        func_cache_dir = cache;
+    }
+
+    const char *binary_trace_path = getenv("BINARY_TRACE");
+    if (binary_trace_path != NULL && binary_trace_path[0] != '\0') {
+        binary_trace = fopen(binary_trace_path, "wb");
+        if (binary_trace == NULL) {
+            fprintf(stderr, "cannot open BINARY_TRACE file %s\n", binary_trace_path);
+            exit(1);
+        }
+        binary_trace_header_t header = {BINARY_TRACE_MAGIC, BINARY_TRACE_VERSION,
+                                        sizeof(mem_access_t)};
+        fwrite(&header, sizeof(header), 1, binary_trace);
+    }
+
     std::string pad(100, '-');
     printf("%s\n", pad.c_str());
+
+    /* tell python script which blocks or warps are traced */
+    if (sample_config_host.mode != SAMPLE_NONE) {
+        if (binary_trace) {
+            write_frame(FRAME_SAMPLE, &sample_config_host, sizeof(sample_config_host));
+        } else {
+            printf("\n#sample#%s,%u,%u,%d,%d\n",
+                   sample_config_host.mode == SAMPLE_BLOCK ? "block" : "warp",
+                   sample_config_host.rate, sample_config_host.seed,
+                   sample_config_host.block_begin, sample_config_host.block_end);
+        }
+    }
 }
+
+void nvbit_at_term() {
+    if (binary_trace != NULL) {
+        fclose(binary_trace);
+    }
+}
+/* whether the memory instructions of a function are instrumented */
+bool function_traced(int func_id, const char *func_name) {
+    if (func_id < filter_func_begin || func_id >= filter_func_end) {
+        return false;
+    }
+    if (filter_functions.empty()) {
+        return true;
+    }
+    for (const std::string &pattern : filter_functions) {
+        if (fnmatch(pattern.c_str(), func_name, 0) == 0) {
+            return true;
+        }
+    }
+    return false;
+}
+
 /* Set used to avoid re-instrumenting the same functions multiple times */
 std::unordered_set<CUfunction> already_instrumented;
 
@@ -99,16 +390,53 @@ void instrument_function_if_needed(CUcontext ctx, CUfunction func) {
         /* its index is func_id */
         int func_id = id_to_func_name.size();
         id_to_func_name.push_back(std::string(func_name));
+        bool traced = function_traced(func_id, func_name);
 
         uint32_t inst_id = 0;
 
+        /* in binary mode, the function is sent as one frame */
+        std::string func_frame;
+
+        /* a function of the function cache is sent by key */
+        std::string func_key;
+        if (!func_cache_dir.empty()) {
+            func_key = function_key(func_name, instrs);
+            if (access((func_cache_dir + "/" + func_key + ".func").c_str(), R_OK) != 0) {
+                func_key.clear();
+            }
+        }
+        bool func_cached = !func_key.empty();
+
         /* tell python script the content of a function begins here*/
-        printf("\n#func_begin#%s\n", func_name);
+        if (func_cached) {
+            if (binary_trace) {
+                func_frame.append((const char *)&func_id, sizeof(int32_t));
+                func_frame.append(func_key);
+                func_frame.push_back('\0');
+                func_frame.append(func_name);
+                func_frame.push_back('\0');
+            } else {
+                printf("\n#func_ref#%s,%s\n", func_key.c_str(), func_name);
+            }
+        } else if (binary_trace) {
+            uint32_t num_instrs = instrs.size();
+            func_frame.append((const char *)&func_id, sizeof(int32_t));
+            func_frame.append((const char *)&num_instrs, sizeof(uint32_t));
+            func_frame.append(func_name);
+            func_frame.push_back('\0');
+        } else {
+            printf("\n#func_begin#%s\n", func_name);
+        }
 
         /* iterate on all the static instructions in the function */
         for (auto instr : instrs) {
             /* print SASS, which is used by python script*/
-            printf("\n#SASS#%s\n", instr->getSass());
+            if (binary_trace && !func_cached) {
+                func_frame.append(instr->getSass());
+                func_frame.push_back('\0');
+            } else if (!func_cached) {
+                printf("\n#SASS#%s\n", instr->getSass());
+            }
 
             // check syn op first
             const char *shortOpcode = instr->getOpcodeShort();
@@ -124,16 +452,36 @@ void instrument_function_if_needed(CUcontext ctx, CUfunction func) {
                 // then we can just update the counter by one
                 nvbit_insert_call(instr, "instrument_syn", IPOINT_AFTER);
                 nvbit_add_call_arg_const_val64(instr, (uint64_t)syn_ops_counter);
+                nvbit_add_call_arg_const_val64(instr, (uint64_t)launch_table);
                 inst_id++;
                 continue; //skip the rest
             } 
 
+            // the last thread to exit ends the launch
+            if (concurrent_launches && strcmp(shortOpcode, "EXIT") == 0) {
+                nvbit_insert_call(instr, "instrument_exit", IPOINT_BEFORE);
+                nvbit_add_call_arg_pred_val(instr);
+                nvbit_add_call_arg_const_val64(instr, (uint64_t)launch_table);
+                nvbit_add_call_arg_const_val64(instr, (uint64_t)&channel_dev);
+                inst_id++;
+                continue;
+            }
+
             if ((instr->getMemOpType()!=Instr::memOpType::GLOBAL
                     && instr->getMemOpType()!=Instr::memOpType::SHARED && instr->getMemOpType()!=Instr::memOpType::GENERIC)) {
                 inst_id++;
                 continue;
             }
 
+            /* filtered functions, instructions and memory spaces are not
+             * instrumented, their synchronization operations still are */
+            if (!traced || inst_id < instr_begin_interval || inst_id >= instr_end_interval ||
+                (filter_config_host.space == FILTER_SHARED && instr->getMemOpType() == Instr::memOpType::GLOBAL) ||
+                (filter_config_host.space == FILTER_GLOBAL && instr->getMemOpType() == Instr::memOpType::SHARED)) {
+                inst_id++;
+                continue;
+            }
+
             if (opcode_to_id_map.find(instr->getOpcode()) ==
                 opcode_to_id_map.end()) {
                 int opcode_id = opcode_to_id_map.size();
@@ -179,7 +527,11 @@ void instrument_function_if_needed(CUcontext ctx, CUfunction func) {
                         nvbit_add_call_arg_const_val32(instr, instr->getMemOpType()==Instr::memOpType::SHARED);
                     }                               
                     nvbit_add_call_arg_const_val32(instr, instr->isLoad());
+                    nvbit_add_call_arg_const_val32(instr, block_warp_id);
                     nvbit_add_call_arg_const_val64(instr, (uint64_t)syn_ops_counter);
+                    nvbit_add_call_arg_const_val64(instr, (uint64_t)&sample_config);
+                    nvbit_add_call_arg_const_val64(instr, (uint64_t)&filter_config);
+                    nvbit_add_call_arg_const_val64(instr, (uint64_t)launch_table);
 
                 }
             }
@@ -187,21 +539,162 @@ void instrument_function_if_needed(CUcontext ctx, CUfunction func) {
         }
 
         /* tell python script the content of a function ends here*/
-        printf("\n#func_end#\n");
+        if (binary_trace) {
+            write_frame(func_cached ? FRAME_FUNC_REF : FRAME_FUNC, func_frame.data(), func_frame.size());
+        } else if (!func_cached) {
+            printf("\n#func_end#\n");
+        }
     }
 }
 
-__global__ void flush_channel() {
-    /* push memory access with negative cta id to communicate the kernel is
-     * completed */
-    mem_access_t ma;
-    ma.block_id = -1;
-    channel_dev.push(&ma, sizeof(mem_access_t));
+__global__ void flush_channel(bool concurrent) {
+    if (concurrent) {
+        /* the launches end in their own messages */
+        launch_msg_t msg;
+        msg.type = LAUNCH_MSG_FLUSH;
+        msg.launch_id = 0;
+        channel_dev.push(&msg, sizeof(launch_msg_t));
+    } else {
+        /* push memory access with negative cta id to communicate the kernel
+         * is completed */
+        mem_access_t ma;
+        ma.block_id = -1;
+        channel_dev.push(&ma, sizeof(mem_access_t));
+    }
 
     /* flush channel */
     channel_dev.flush();
 }
 
+/* end a completed launch whose slot was not freed, its threads did not
+ * all find the slot (see LAUNCH_SLOT_SPINS) */
+__global__ void end_unslotted_launch(launch_table_t *table, int slot) {
+    launch_msg_t msg;
+    msg.type = LAUNCH_MSG_END;
+    msg.launch_id = table->slots[slot].launch_id;
+    table->slots[slot].state = LAUNCH_FREE;
+    __threadfence();
+    channel_dev.push(&msg, sizeof(launch_msg_t));
+}
+
+/* end the launch of a completed launch event if its slot is still taken */
+void end_if_unslotted(const launch_event_t &launch) {
+    launch_slot_t dev;
+    CUDA_SAFECALL(cudaMemcpyAsync(&dev, &launch_table->slots[launch.slot], sizeof(launch_slot_t),
+                                  cudaMemcpyDeviceToHost, launch_stream));
+    CUDA_SAFECALL(cudaStreamSynchronize(launch_stream));
+    if (dev.state != LAUNCH_FREE && dev.launch_id == launch.launch_id) {
+        end_unslotted_launch<<<1, 1, 0, launch_stream>>>(launch_table, launch.slot);
+        unslotted_launches++;
+    }
+}
+
+/* flush the channel once the launches returned since the last flush are
+ * completed, with launch_mutex held. wait: wait for them, otherwise
+ * return if some still run */
+void flush_launches(bool wait) {
+    if (launch_events.empty()) {
+        return;
+    }
+    for (const launch_event_t &launch : launch_events) {
+        if (wait) {
+            CUDA_SAFECALL(cudaEventSynchronize(launch.event));
+        } else if (cudaEventQuery(launch.event) != cudaSuccess) {
+            return;
+        }
+    }
+    skip_flag = true;
+    for (const launch_event_t &launch : launch_events) {
+        end_if_unslotted(launch);
+        CUDA_SAFECALL(cudaEventDestroy(launch.event));
+    }
+    launch_events.clear();
+
+    flush_channel<<<1, 1, 0, launch_stream>>>(true);
+    CUDA_SAFECALL(cudaStreamSynchronize(launch_stream));
+    skip_flag = false;
+}
+
+void *flush_thread_fun(void *) {
+    cuCtxSetCurrent(launch_ctx);
+    while (recv_thread_started) {
+        pthread_mutex_lock(&launch_mutex);
+        flush_launches(false);
+        pthread_mutex_unlock(&launch_mutex);
+        usleep(1000);
+    }
+    return NULL;
+}
+
+bool launches_in_flight() {
+    for (int i = 0; i < LAUNCH_SLOTS; i++) {
+        if (launch_slots[i].launch_id != 0) {
+            return true;
+        }
+    }
+    return false;
+}
+
+/* offer a slot of the launch table to the kernel being launched,
+ * with launch_mutex held, return the slot */
+int offer_launch_slot(CUcontext ctx, int num_blocks) {
+    if (launch_table == NULL) {
+        CUDA_SAFECALL(cudaMalloc(&launch_table, sizeof(launch_table_t)));
+        CUDA_SAFECALL(cudaMemset(launch_table, 0, sizeof(launch_table_t)));
+        CUDA_SAFECALL(cudaStreamCreateWithFlags(&launch_stream, cudaStreamNonBlocking));
+        launch_ctx = ctx;
+        pthread_create(&flush_thread, NULL, flush_thread_fun, NULL);
+    }
+
+    int slot = -1;
+    while (slot < 0) {
+        for (int i = 0; i < LAUNCH_SLOTS && slot < 0; i++) {
+            if (launch_slots[i].launch_id == 0) {
+                slot = i;
+            }
+        }
+        if (slot < 0) {
+            /* every slot is taken, wait for launches to end */
+            flush_launches(true);
+            pthread_yield();
+        }
+    }
+
+    launch_host_t *host = &launch_slots[slot];
+    if (host->num_counters < num_blocks) {
+        if (host->syn_ops_counter != NULL) {
+            CUDA_SAFECALL(cudaFree(host->syn_ops_counter));
+        }
+        CUDA_SAFECALL(cudaMalloc(&host->syn_ops_counter, num_blocks * sizeof(int)));
+        host->num_counters = num_blocks;
+    }
+    host->launch_id = ++launch_counter;
+
+    launch_slot_t offer = {LAUNCH_OFFERED, host->launch_id, 0, num_blocks, 0, host->syn_ops_counter};
+    launch_slot_t *dev = &launch_table->slots[slot];
+    CUDA_SAFECALL(cudaMemsetAsync(host->syn_ops_counter, 0, num_blocks * sizeof(int), launch_stream));
+    /* the state is written last, running warps may look for their slot */
+    CUDA_SAFECALL(cudaMemcpyAsync((char *)dev + sizeof(int), (char *)&offer + sizeof(int),
+                                  sizeof(launch_slot_t) - sizeof(int), cudaMemcpyHostToDevice, launch_stream));
+    CUDA_SAFECALL(cudaMemcpyAsync(&dev->state, &offer.state, sizeof(int), cudaMemcpyHostToDevice, launch_stream));
+    CUDA_SAFECALL(cudaStreamSynchronize(launch_stream));
+    return slot;
+}
+
+/* the launch ended on the GPU and its accesses are written */
+void end_launch(int launch_id) {
+    if (binary_trace) {
+        write_frame(FRAME_KERNEL_END, &launch_id, sizeof(int32_t));
+    } else {
+        printf("\n#kernelends#%d\n", launch_id);
+    }
+    for (int i = 0; i < LAUNCH_SLOTS; i++) {
+        if (launch_slots[i].launch_id == launch_id) {
+            launch_slots[i].launch_id = 0;
+        }
+    }
+}
+
 void nvbit_at_cuda_event(CUcontext ctx, int is_exit, nvbit_api_cuda_t cbid,
                          const char *name, void *params, CUresult *pStatus) {
     if (skip_flag) return;
@@ -211,10 +704,16 @@ void nvbit_at_cuda_event(CUcontext ctx, int is_exit, nvbit_api_cuda_t cbid,
         cuLaunchKernel_params *p = (cuLaunchKernel_params *)params;
 
         if (!is_exit) {
-            /* allocate syn_ops_counter for each block */
             int num_block = p->gridDimX * p->gridDimY * p->gridDimZ;
-            CUDA_SAFECALL(cudaMalloc(&syn_ops_counter, num_block * sizeof(int)));
-            CUDA_SAFECALL(cudaMemset(syn_ops_counter, 0, num_block * sizeof(int)));
+            if (concurrent_launches) {
+                /* released when the kernel is launched */
+                pthread_mutex_lock(&launch_mutex);
+                offered_slot = offer_launch_slot(ctx, num_block);
+            } else {
+                /* allocate syn_ops_counter for each block */
+                CUDA_SAFECALL(cudaMalloc(&syn_ops_counter, num_block * sizeof(int)));
+                CUDA_SAFECALL(cudaMemset(syn_ops_counter, 0, num_block * sizeof(int)));
+            }
 
             instrument_function_if_needed(ctx, p->f);
 
@@ -222,6 +721,15 @@ void nvbit_at_cuda_event(CUcontext ctx, int is_exit, nvbit_api_cuda_t cbid,
 
             recv_thread_receiving = true;
 
+        } else if (concurrent_launches) {
+            /* the application goes on, the channel is flushed
+             * by flush_thread once the kernel is completed */
+            cudaEvent_t event;
+            CUDA_SAFECALL(cudaEventCreateWithFlags(&event, cudaEventDisableTiming));
+            CUDA_SAFECALL(cudaEventRecord(event, (cudaStream_t)p->hStream));
+            launch_events.push_back({event, offered_slot, launch_slots[offered_slot].launch_id});
+            pthread_mutex_unlock(&launch_mutex);
+
         } else {
             /* make sure current kernel is completed */
             cudaDeviceSynchronize();
@@ -236,7 +744,7 @@ void nvbit_at_cuda_event(CUcontext ctx, int is_exit, nvbit_api_cuda_t cbid,
 
             /* issue flush of channel so we are sure all the memory accesses
              * have been pushed */
-            flush_channel<<<1, 1>>>();
+            flush_channel<<<1, 1>>>(false);
             cudaDeviceSynchronize();
             assert(cudaGetLastError() == cudaSuccess);
 
@@ -249,8 +757,92 @@ void nvbit_at_cuda_event(CUcontext ctx, int is_exit, nvbit_api_cuda_t cbid,
                 pthread_yield();
             }
 
-            printf("\n#kernelends#\n");
+            if (binary_trace) {
+                write_frame(FRAME_KERNEL_END, NULL, 0);
+            } else {
+                printf("\n#kernelends#\n");
+            }
+        }
+    }
+}
+
+void print_access(const mem_access_t *ma) {
+    /* "#{ld/st}#" is used to grep */
+    if (ma->is_load) {
+        for (int i = 0; i < 32; i++) {
+            if (ma->addrs[i] == 0) continue;
+            printf("\n#ld#%d,%d,%d,%d,%d,%d,%d,0x%016lx\n",
+                ma->is_shared_memory,  ma->block_id, ma->warp_id, i, ma->func_id, ma->inst_id,
+                ma->SFR_id, ma->addrs[i]);
+        }
+    } else {
+        for (int i = 0; i < 32; i++) {
+            if (ma->addrs[i] == 0) continue;
+            printf("\n#st#%d,%d,%d,%d,%d,%d,%d,0x%016lx\n",
+                ma->is_shared_memory,  ma->block_id, ma->warp_id, i, ma->func_id, ma->inst_id,
+                ma->SFR_id, ma->addrs[i]);
+        }
+    }
+}
+
+/* launch of the accesses written last (CONCURRENT_LAUNCHES=1), 0 after
+ * a launch ended, and its records not written yet in binary mode */
+int written_launch_id = 0;
+std::vector<char> launch_records;
+
+void write_launch_records() {
+    if (!launch_records.empty()) {
+        write_frame(FRAME_ACCESS, launch_records.data(), launch_records.size());
+        launch_records.clear();
+    }
+}
+
+/* the accesses that follow are of launch_id */
+void switch_launch(int launch_id) {
+    if (launch_id == written_launch_id) {
+        return;
+    }
+    if (binary_trace) {
+        write_launch_records();
+        write_frame(FRAME_LAUNCH, &launch_id, sizeof(int32_t));
+    } else {
+        printf("\n#launch#%d\n", launch_id);
+    }
+    written_launch_id = launch_id;
+}
+
+/* the messages of concurrent launches, see launch_msg_t */
+void recv_launch_messages(const char *recv_buffer, uint32_t num_recv_bytes) {
+    uint32_t num_processed_bytes = 0;
+    while (num_processed_bytes < num_recv_bytes) {
+        const launch_msg_t *msg = (const launch_msg_t *)&recv_buffer[num_processed_bytes];
+        if (msg->type != LAUNCH_MSG_ACCESS) {
+            if (msg->type == LAUNCH_MSG_END) {
+                /* all the accesses of the launch are before its end */
+                if (binary_trace) {
+                    write_launch_records();
+                }
+                end_launch(msg->launch_id);
+                written_launch_id = 0;
+            } else if (msg->type == LAUNCH_MSG_DROPPED) {
+                dropped_records++;
+            }
+            num_processed_bytes += sizeof(launch_msg_t);
+            continue;
+        }
+
+        const mem_access_t *ma = &((const launch_access_t *)msg)->ma;
+        switch_launch(msg->launch_id);
+        if (binary_trace) {
+            launch_records.insert(launch_records.end(), (const char *)ma, (const char *)(ma + 1));
+        } else {
+            print_access(ma);
         }
+        num_processed_bytes += sizeof(launch_access_t);
+    }
+
+    if (binary_trace) {
+        write_launch_records();
     }
 }
 
@@ -262,7 +854,13 @@ void *recv_thread_fun(void *) {
         if (recv_thread_receiving &&
             (num_recv_bytes = channel_host.recv(recv_buffer, CHANNEL_SIZE)) >
                 0) {
+            if (concurrent_launches) {
+                recv_launch_messages(recv_buffer, num_recv_bytes);
+                continue;
+            }
+
             uint32_t num_processed_bytes = 0;
+            bool kernel_completed = false;
             while (num_processed_bytes < num_recv_bytes) {
                 mem_access_t *ma =
                     (mem_access_t *)&recv_buffer[num_processed_bytes];
@@ -270,28 +868,25 @@ void *recv_thread_fun(void *) {
                 /* when we get this block_id it means the kernel has completed
                  */
                 if (ma->block_id == -1) {
-                    recv_thread_receiving = false;
+                    kernel_completed = true;
                     break;
                 }
-                
-                /* "#{ld/st}#" is used to grep */
-                if (ma->is_load) {
-                    for (int i = 0; i < 32; i++) {
-                        if (ma->addrs[i] == 0) continue;
-                        printf("\n#ld#%d,%d,%d,%d,%d,%d,%d,0x%016lx\n",
-                            ma->is_shared_memory,  ma->block_id, ma->warp_id, i, ma->func_id, ma->inst_id,
-                            ma->SFR_id, ma->addrs[i]);
-                    }
-                } else {
-                    for (int i = 0; i < 32; i++) {
-                        if (ma->addrs[i] == 0) continue;
-                        printf("\n#st#%d,%d,%d,%d,%d,%d,%d,0x%016lx\n",
-                            ma->is_shared_memory,  ma->block_id, ma->warp_id, i, ma->func_id, ma->inst_id,
-                            ma->SFR_id, ma->addrs[i]);
-                    }
+
+                /* in binary mode records are written as they are below */
+                if (!binary_trace) {
+                    print_access(ma);
                 }
                 num_processed_bytes += sizeof(mem_access_t);
             }
+
+            if (binary_trace && num_processed_bytes > 0) {
+                write_frame(FRAME_ACCESS, recv_buffer, num_processed_bytes);
+            }
+
+            /* the frame must be written before the kernel end is signaled */
+            if (kernel_completed) {
+                recv_thread_receiving = false;
+            }
         }
     }
     free(recv_buffer);
@@ -299,14 +894,34 @@ void *recv_thread_fun(void *) {
 }
 
 void nvbit_at_ctx_init(CUcontext ctx) {
+    sample_config = sample_config_host;
+    filter_config = filter_config_host;
     recv_thread_started = true;
+    /* the launches end in the records, the receiving thread never waits */
+    recv_thread_receiving = concurrent_launches != 0;
     channel_host.init(0, CHANNEL_SIZE, &channel_dev, NULL);
     pthread_create(&recv_thread, NULL, recv_thread_fun, NULL);
 }
 
 void nvbit_at_ctx_term(CUcontext ctx) {
+    if (recv_thread_started && launch_table != NULL) {
+        /* the last launches end before the threads stop */
+        pthread_mutex_lock(&launch_mutex);
+        flush_launches(true);
+        while (launches_in_flight()) {
+            pthread_yield();
+        }
+        pthread_mutex_unlock(&launch_mutex);
+        if (dropped_records || unslotted_launches) {
+            fprintf(stderr, "race_check_trace: %llu records of warps without a launch slot dropped, "
+                    "%d launches ended by the host\n", dropped_records, unslotted_launches);
+        }
+    }
     if (recv_thread_started) {
         recv_thread_started = false;
         pthread_join(recv_thread, NULL);
+        if (launch_table != NULL) {
+            pthread_join(flush_thread, NULL);
+        }
     }
 }